@@ -0,0 +1,54 @@
+"""Compare looking up the submit_spawner_attribute and
+submit_spawner_attribute_keys by walking the path on every spawn, as
+rec_get_attr and tuple_dict_select did, with the compiled accessors.
+
+    python benchmarks/accessors.py 1000000
+"""
+
+import sys
+import timeit
+from types import SimpleNamespace
+from ldap_hooks.accessors import attribute_accessor, key_accessor
+
+PATH = "user.data"
+KEYS = ("User", "DN")
+
+
+def walk_attributes(obj, path):
+    for attr in path.split("."):
+        obj = getattr(obj, attr) if hasattr(obj, attr) else False
+        if not obj:
+            return False
+    return obj
+
+
+def walk_keys(select_tuple, select_dict):
+    selected = {}
+    for key in select_tuple:
+        if selected and isinstance(selected, dict) and key in selected:
+            selected = selected[key]
+        else:
+            selected = select_dict[key]
+    return selected
+
+
+def walked(spawner):
+    return walk_keys(KEYS, walk_attributes(spawner, PATH))
+
+
+def compiled(spawner):
+    return key_accessor(KEYS)(attribute_accessor(PATH)(spawner))
+
+
+def main(number):
+    spawner = SimpleNamespace(
+        user=SimpleNamespace(data={"User": {"DN": "/CN=alice/O=example"}})
+    )
+    assert walked(spawner) == compiled(spawner)
+    for label, lookup in (("walked", walked), ("compiled", compiled)):
+        seconds = min(timeit.repeat(lambda: lookup(spawner), number=number, repeat=5))
+        print("{:>8}: {:>6.0f} ns per lookup".format(label, seconds / number * 1e9))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,70 @@
+"""Compare the memory used by cached directory entries stored as the
+ldap3 response dicts and as CompactEntry objects.
+
+    python benchmarks/entry_memory.py 10000 100000
+"""
+
+import copy
+import sys
+import tracemalloc
+from ldap3.utils.ciDict import CaseInsensitiveDict
+from ldap_hooks.entry import CompactEntry
+
+
+def response_entry(number):
+    uid = "user{}".format(number)
+    attributes = CaseInsensitiveDict()
+    attributes["objectClass"] = ["top", "posixAccount", "inetOrgPerson"]
+    attributes["uid"] = [uid]
+    attributes["cn"] = [uid]
+    attributes["uidNumber"] = 10000 + number
+    attributes["gidNumber"] = 100
+    attributes["homeDirectory"] = "/home/{}".format(uid)
+    attributes["mail"] = ["{}@example.org".format(uid)]
+    raw_attributes = CaseInsensitiveDict()
+    for key, value in attributes.items():
+        if not isinstance(value, list):
+            value = [value]
+        raw_attributes[key] = [str(item).encode() for item in value]
+    return {
+        "dn": "uid={},ou=people,dc=example,dc=org".format(uid),
+        "attributes": attributes,
+        "raw_attributes": raw_attributes,
+    }
+
+
+def measure(count, build):
+    entries = [response_entry(number) for number in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    stored = build(entries)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    used = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del stored
+    return used
+
+
+def as_response(entries):
+    # A copy of what a cache that keeps the ldap3 response entries holds
+    return copy.deepcopy(entries)
+
+
+def as_compact(entries):
+    return [CompactEntry(entry["dn"], entry["attributes"]) for entry in entries]
+
+
+def main(counts):
+    for count in counts:
+        response = measure(count, as_response)
+        compact = measure(count, as_compact)
+        print(
+            "{:>8} entries: response {:>10.1f} KiB, compact {:>10.1f} KiB, "
+            "{:.1f}x smaller".format(
+                count, response / 1024, compact / 1024, response / compact
+            )
+        )
+
+
+if __name__ == "__main__":
+    main([int(count) for count in sys.argv[1:]] or [10000, 100000])
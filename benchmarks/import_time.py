@@ -0,0 +1,55 @@
+"""Compare the time that `python -X importtime` reports for importing the
+ldap_hooks package, as a jupyterhub_config.py does, with importing
+ldap_hooks.hooks, which loads ldap3, tornado and traitlets as the package
+did before its names were loaded lazily.
+
+    python benchmarks/import_time.py 10
+"""
+
+import statistics
+import subprocess
+import sys
+
+STATEMENTS = {
+    # The modules that every interpreter imports at startup
+    "interpreter startup": "pass",
+    "import ldap_hooks": "import ldap_hooks",
+    "config names": "from ldap_hooks import LDAP, SPAWNER_SUBMIT_DATA, "
+    "setup_ldap_entry_hook",
+    "import ldap_hooks.hooks": "import ldap_hooks.hooks",
+}
+
+
+def import_time(statement):
+    """The cumulative microseconds of the top level imports of `statement`,
+    measured in a fresh interpreter.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    total = 0
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split(":", 1)[1].split("|")
+        # Nested imports are indented below the top level import they belong to
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            total += int(cumulative)
+    return total
+
+
+def main(repeat):
+    for label, statement in STATEMENTS.items():
+        times = [import_time(statement) for _ in range(repeat)]
+        print(
+            "{:>24}: median {:>8.1f} ms, min {:>8.1f} ms".format(
+                label, statistics.median(times) / 1000, min(times) / 1000
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
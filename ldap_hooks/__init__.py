@@ -1 +1,57 @@
-from .hooks import *
+import importlib
+from . import constants
+from .constants import *
+from .entrypoints import hello_hook, pre_provision_hook, setup_ldap_entry_hook
+
+# The modules that the rest of the public names are imported from when they
+# are first accessed, such that importing ldap_hooks in a jupyterhub_config.py
+# does not import ldap3, tornado or traitlets before they are needed.
+_lazy_names = {
+    "LDAP": ".config",
+    "warm_up": ".hooks",
+    "circuit_breaker_status": ".breaker",
+    "CircuitBreakerStatusHandler": ".breaker",
+    "write_behind_status": ".writebehind",
+    "watch_config": ".reload",
+    "reload_settings": ".reload",
+    "config_reload_status": ".reload",
+    "ConfigReloadHandler": ".reload",
+    "AsyncConnectionManager": ".ldap",
+    "ConnectionManager": ".ldap",
+}
+
+__all__ = [
+    "hello_hook",
+    "pre_provision_hook",
+    "setup_ldap_entry_hook",
+    "LDAP",
+    "warm_up",
+    "circuit_breaker_status",
+    "CircuitBreakerStatusHandler",
+    "write_behind_status",
+    "watch_config",
+    "reload_settings",
+    "config_reload_status",
+    "ConfigReloadHandler",
+    "AsyncConnectionManager",
+    "ConnectionManager",
+] + [name for name in dir(constants) if name.isupper()]
+
+
+def __getattr__(name):
+    # Private and dunder names, E.g. those that tools probe for, don't
+    # import anything
+    if name.startswith("_"):
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    # Any other name that ldap_hooks.hooks defines is still importable
+    # from the package, as it was when it did `from .hooks import *`
+    module = importlib.import_module(_lazy_names.get(name, ".hooks"), __name__)
+    if not hasattr(module, name):
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_names))
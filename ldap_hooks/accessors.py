@@ -0,0 +1,74 @@
+from functools import lru_cache
+from operator import attrgetter, itemgetter
+
+
+class MissingSegment(LookupError):
+    """Raised when a segment of an attribute path or of a key path is
+    missing from the object that it is looked up in.
+    """
+
+    def __init__(self, path, segment, index):
+        self.path = path
+        self.segment = segment
+        self.index = index
+        super().__init__(
+            "{!r} is missing at segment {} of: {!r}".format(segment, index, path)
+        )
+
+
+def missing_attribute(obj, segments):
+    """The index of the first of `segments` that is missing from `obj`."""
+    for index, segment in enumerate(segments):
+        if not hasattr(obj, segment):
+            return index
+        obj = getattr(obj, segment)
+    return len(segments) - 1
+
+
+def missing_key(data, keys):
+    """The index of the first of `keys` that is missing from `data`."""
+    for index, key in enumerate(keys):
+        try:
+            data = data[key]
+        except (KeyError, IndexError, TypeError):
+            return index
+    return len(keys) - 1
+
+
+@lru_cache(maxsize=None)
+def attribute_accessor(path):
+    """Compile the dotted attribute `path`, E.g. 'user.data', into a callable
+    that returns the value at the path of an object. The path is split once,
+    and is looked up with a single attrgetter.
+    """
+    segments = tuple(path.split("."))
+    getter = attrgetter(path)
+
+    def access(obj):
+        try:
+            return getter(obj)
+        except AttributeError:
+            index = missing_attribute(obj, segments)
+            raise MissingSegment(path, segments[index], index) from None
+
+    return access
+
+
+@lru_cache(maxsize=None)
+def key_accessor(keys):
+    """Compile the tuple of `keys` into a callable that returns the value
+    of a nested dict, E.g. ('User', 'DN') returns data['User']['DN'].
+    """
+    getters = tuple(itemgetter(key) for key in keys)
+
+    def access(data):
+        value = data
+        try:
+            for getter in getters:
+                value = getter(value)
+        except (KeyError, IndexError, TypeError):
+            index = missing_key(data, keys)
+            raise MissingSegment(keys, keys[index], index) from None
+        return value
+
+    return access
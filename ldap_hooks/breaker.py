@@ -0,0 +1,164 @@
+import json
+import threading
+import time
+from tornado.web import RequestHandler
+
+try:
+    from prometheus_client import Gauge
+except ImportError:
+    Gauge = None
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+CIRCUIT_BREAKER_STATES = (CLOSED, OPEN, HALF_OPEN)
+
+if Gauge is not None:
+    CIRCUIT_BREAKER_STATE = Gauge(
+        "ldap_hooks_circuit_breaker_state",
+        "State of the LDAP server circuit breaker, "
+        "0 is closed, 1 is half-open and 2 is open",
+        ["url"],
+    )
+else:
+    CIRCUIT_BREAKER_STATE = None
+
+_STATE_METRIC_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """Tracks the health of a single LDAP server.
+
+    The breaker starts closed and lets every request through. After
+    failure_threshold consecutive failures it opens, and every request
+    is rejected until cooldown seconds have passed. It then turns half-open
+    and lets a single trial request through, which either closes the
+    breaker again on success or reopens it on failure. A trial whose
+    outcome is never recorded expires after another cooldown, such that
+    the next request becomes the trial.
+    """
+
+    def __init__(self, url, failure_threshold=5, cooldown=30.0, clock=time.monotonic):
+        self.url = url
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        self.trial_started_at = None
+        self._state = CLOSED
+        self._lock = threading.Lock()
+        self._report_state()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and self.clock() - self.opened_at >= self.cooldown:
+            self._set_state(HALF_OPEN)
+        if (
+            self._state == HALF_OPEN
+            and self.trial_in_progress
+            and self.clock() - self.trial_started_at >= self.cooldown
+        ):
+            self.trial_in_progress = False
+        return self._state
+
+    def _set_state(self, state):
+        self._state = state
+        if state == OPEN:
+            self.opened_at = self.clock()
+        self.trial_in_progress = False
+        self._report_state()
+
+    def _report_state(self):
+        if CIRCUIT_BREAKER_STATE is not None:
+            CIRCUIT_BREAKER_STATE.labels(url=self.url).set(
+                _STATE_METRIC_VALUES[self._state]
+            )
+
+    def allow_request(self):
+        """Whether a request should be sent to the server."""
+        if not self.failure_threshold:
+            return True
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self.trial_in_progress:
+                self.trial_in_progress = True
+                self.trial_started_at = self.clock()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self._state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._state == HALF_OPEN or (
+                self.failure_threshold and self.failures >= self.failure_threshold
+            ):
+                self._set_state(OPEN)
+
+    def status(self):
+        with self._lock:
+            state = self._current_state()
+            retry_in = None
+            if state == OPEN:
+                retry_in = max(0.0, self.cooldown - (self.clock() - self.opened_at))
+            return {
+                "url": self.url,
+                "state": state,
+                "failures": self.failures,
+                "failure_threshold": self.failure_threshold,
+                "cooldown": self.cooldown,
+                "retry_in": retry_in,
+            }
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(url, failure_threshold=5, cooldown=30.0):
+    """Return the shared circuit breaker of the server at `url`,
+    the thresholds are updated to the currently configured values.
+    """
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(url)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                url, failure_threshold=failure_threshold, cooldown=cooldown
+            )
+            _circuit_breakers[url] = breaker
+        else:
+            breaker.failure_threshold = failure_threshold
+            breaker.cooldown = cooldown
+        return breaker
+
+
+def circuit_breaker_status():
+    """The current status of every known circuit breaker keyed by url."""
+    with _circuit_breakers_lock:
+        breakers = list(_circuit_breakers.values())
+    return {breaker.url: breaker.status() for breaker in breakers}
+
+
+class CircuitBreakerStatusHandler(RequestHandler):
+    """Serves circuit_breaker_status as JSON, E.g. via
+    c.JupyterHub.extra_handlers = [(r"/ldap/status", CircuitBreakerStatusHandler)]
+    """
+
+    def get(self):
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(circuit_breaker_status()))
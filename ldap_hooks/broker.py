@@ -0,0 +1,310 @@
+"""A local broker that provisions the LDAP entries of several Hub
+processes, such that they share its connections, entry cache and ID
+allocator.
+
+    ldap-hooks-broker --config jupyterhub_config.py --socket /run/ldap-hooks.sock
+
+Each message on the Unix socket is a 4 byte big-endian length, followed
+by that many bytes of compact JSON. A request names its "op", and the
+response carries "ok", with an "error" if it is false.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from .spawn import apply_provision_result, remote_timeout, spawn_inputs
+
+HEADER = struct.Struct("!I")
+# The largest message that is accepted
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+PING = "ping"
+STATUS = "status"
+PROVISION = "provision"
+BROKER_OPS = (PING, STATUS, PROVISION)
+
+# The number of entries that the broker provisions concurrently
+BROKER_WORKERS = 8
+
+
+def encode_message(message):
+    body = json.dumps(message, separators=(",", ":"), default=str).encode("utf-8")
+    if len(body) > MAX_MESSAGE_SIZE:
+        raise ValueError("message of {} bytes is too large".format(len(body)))
+    return HEADER.pack(len(body)) + body
+
+
+def decode_size(header):
+    (size,) = HEADER.unpack(header)
+    if size > MAX_MESSAGE_SIZE:
+        raise ValueError("message of {} bytes is too large".format(size))
+    return size
+
+
+def read_message(stream):
+    """Read a message from the file-like `stream`, None at the end of it."""
+    header = stream.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise ValueError("message header was cut short")
+    size = decode_size(header)
+    body = stream.read(size)
+    if len(body) < size:
+        raise ValueError("message body was cut short")
+    return json.loads(body.decode("utf-8"))
+
+
+async def request_broker(path, message, timeout=None):
+    """Send `message` to the broker at `path` and return its response."""
+
+    async def exchange():
+        reader, writer = await asyncio.open_unix_connection(path)
+        try:
+            writer.write(encode_message(message))
+            await writer.drain()
+            size = decode_size(await reader.readexactly(HEADER.size))
+            return json.loads((await reader.readexactly(size)).decode("utf-8"))
+        finally:
+            writer.close()
+
+    return await asyncio.wait_for(exchange(), timeout)
+
+
+async def provision_through_broker(spawner, instance):
+    """Have the broker at broker_socket provision the entry of the
+    spawner's user, and apply the set_spawner_attributes that it returns.
+    """
+    try:
+        response = await request_broker(
+            instance.broker_socket,
+            {"op": PROVISION, "inputs": spawn_inputs(spawner, instance)},
+            timeout=remote_timeout(instance),
+        )
+    except (
+        OSError,
+        ValueError,
+        asyncio.IncompleteReadError,
+        asyncio.TimeoutError,
+    ) as err:
+        spawner.log.error(
+            "LDAP - failed to reach the broker at: {}, exception: {!r}".format(
+                instance.broker_socket, err
+            )
+        )
+        return False
+    if not response.get("ok"):
+        spawner.log.error(
+            "LDAP - the broker failed to provision: {}, error: {}".format(
+                spawner.user.name, response.get("error")
+            )
+        )
+        return False
+    return apply_provision_result(spawner, response, "the broker")
+
+
+class BrokerRequestHandler(socketserver.StreamRequestHandler):
+    """Answers the requests of a client connection until it is closed."""
+
+    def handle(self):
+        broker = self.server.broker
+        while True:
+            try:
+                message = read_message(self.rfile)
+            except (OSError, ValueError) as err:
+                broker.logger.error(
+                    "LDAP - broker received an invalid message: {}".format(err)
+                )
+                return
+            if message is None:
+                return
+            self.wfile.write(encode_message(broker.respond(message)))
+            self.wfile.flush()
+
+
+class LDAPBroker:
+    """Provisions the entries that the clients on the Unix socket at `path`
+    request, with the process wide connections and caches of the hook and
+    a single IncrementAllocator.
+    """
+
+    def __init__(
+        self,
+        path,
+        config=None,
+        block_size=1,
+        workers=BROKER_WORKERS,
+        mode=0o660,
+        logger=None,
+    ):
+        from .bulk import IncrementAllocator
+
+        self.path = path
+        self.config = config
+        self.mode = mode
+        self.logger = logger or logging.getLogger(__name__)
+        self.allocator = IncrementAllocator(block_size=block_size)
+        self._slots = threading.BoundedSemaphore(workers)
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "provisioned": 0, "failed": 0, "errors": 0}
+        self.started_at = time.time()
+        self.server = None
+
+    def _count(self, outcome):
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def status(self):
+        with self._lock:
+            status = dict(self._counts)
+        status["uptime"] = time.time() - self.started_at
+        return status
+
+    def provision(self, inputs):
+        from .config import LDAP
+        from .spawn import provision_inputs
+
+        instance = LDAP(config=self.config) if self.config is not None else LDAP()
+        with self._slots:
+            return provision_inputs(
+                inputs, self.logger, instance=instance, allocator=self.allocator
+            )
+
+    def respond(self, message):
+        self._count("requests")
+        op = message.get("op") if isinstance(message, dict) else None
+        try:
+            if op == PING:
+                return {"ok": True}
+            if op == STATUS:
+                return {"ok": True, "status": self.status()}
+            if op == PROVISION:
+                provisioned, attributes = self.provision(message["inputs"])
+                self._count("provisioned" if provisioned else "failed")
+                return {
+                    "ok": True,
+                    "provisioned": provisioned,
+                    "attributes": attributes,
+                }
+            raise ValueError(
+                "Unknown op: {}, must be one of: {}".format(op, BROKER_OPS)
+            )
+        except Exception as err:
+            self._count("errors")
+            self.logger.error(
+                "LDAP - broker failed to answer: {}, exception: {}".format(op, err)
+            )
+            return {"ok": False, "error": str(err)}
+
+    def remove_stale_socket(self):
+        """Remove the socket of a broker that is no longer running, raises
+        OSError if another broker is still listening on it.
+        """
+        if not os.path.exists(self.path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError:
+            os.unlink(self.path)
+            return
+        finally:
+            probe.close()
+        raise OSError("another broker is listening on: {}".format(self.path))
+
+    def start(self):
+        """Listen on the socket, the requests are answered by the threads
+        of serve_forever.
+        """
+        self.remove_stale_socket()
+        # The socket is created accessible to its owner only, and opened up
+        # to `mode` once it is bound, such that no client can connect under
+        # a default umask before then
+        umask = os.umask(0o177)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(
+                self.path, BrokerRequestHandler
+            )
+        finally:
+            os.umask(umask)
+        self.server.daemon_threads = True
+        self.server.broker = self
+        os.chmod(self.path, self.mode)
+        return self.server
+
+    def serve_forever(self):
+        if self.server is None:
+            self.start()
+        self.logger.info("LDAP - broker listening on: {}".format(self.path))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+    def close(self):
+        if self.server is not None:
+            self.server.server_close()
+            self.server = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def main(argv=None):
+    from .bulk import load_config
+
+    parser = argparse.ArgumentParser(
+        description="Provision LDAP entries for the Hub processes on this host."
+    )
+    parser.add_argument(
+        "--config",
+        required=True,
+        help="The jupyterhub_config.py that defines the LDAP settings",
+    )
+    parser.add_argument("--socket", required=True, help="The Unix socket path")
+    parser.add_argument("--workers", type=int, default=BROKER_WORKERS)
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=1,
+        help="The number of uidNumbers that are reserved at a time",
+    )
+    parser.add_argument(
+        "--mode",
+        type=lambda value: int(value, 8),
+        default=0o660,
+        help="The octal permissions of the socket",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    broker = LDAPBroker(
+        args.socket,
+        config=load_config(args.config),
+        block_size=args.block_size,
+        workers=args.workers,
+        mode=args.mode,
+        logger=logging.getLogger("ldap_hooks.broker"),
+    )
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
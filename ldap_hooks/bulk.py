@@ -0,0 +1,375 @@
+"""Provision the LDAP entries of a batch of users ahead of their first spawn.
+
+    ldap-hooks-bulk-provision --config jupyterhub_config.py users.csv
+
+Every record is provisioned with the same DN parsing, dynamic_attributes
+interpolation and object_attributes templating as setup_ldap_entry_hook,
+where the user of the spawner has the fields of the record as its
+attributes. CSV columns with dotted names are nested, E.g. the column
+data.PersonDN is available as user.data['PersonDN'].
+"""
+
+import argparse
+import csv
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from ldap3 import BASE, MODIFY_ADD, MODIFY_DELETE
+from traitlets.config.loader import PyFileConfigLoader
+from .hooks import (
+    INCREMENT_ATTRIBUTE,
+    LDAP,
+    LoginSpawner,
+    perform_search_result_operation,
+    setup_ldap_entry,
+)
+from .ldap import modify_dn, response_attributes, search_for
+
+RECORD_FORMATS = ("csv", "json", "jsonl")
+PROVISIONED = "provisioned"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+def read_counter(connection, dn, attr_key):
+    """The integer value of `attr_key` of the entry at `dn`, None if it
+    can't be read.
+    """
+    if not search_for(
+        connection, dn, "(objectClass=*)", search_scope=BASE, attributes=[attr_key]
+    ):
+        return None
+    attributes = response_attributes(connection.response) or {}
+    value = attributes.get(attr_key)
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class IncrementAllocator:
+    """Hands out the values of INCREMENT_ATTRIBUTE search_result_operations
+    from blocks of block_size values, each of which is reserved with a
+    single atomic modify of the counter entry.
+
+    Values of a reserved block that are not handed out are skipped. With a
+    block_size of 1, each value is reserved as it is handed out, which
+    serializes the increments of concurrent workers.
+
+    When the counter has changed since it was read, E.g. by another
+    process, the reservation is retried from the current value of the
+    counter up to `attempts` times.
+    """
+
+    def __init__(self, block_size=100, attempts=5):
+        self.block_size = block_size
+        self.attempts = attempts
+        self._blocks = {}
+        self._reserved = {}
+        self._lock = threading.Lock()
+
+    def allocate(self, logger, conn_manager, operation, attr_key, attr_val):
+        if (
+            self.block_size < 1
+            or operation.get("action") != INCREMENT_ATTRIBUTE
+            or "modify_dn" not in operation
+            or not isinstance(attr_val, int)
+        ):
+            return perform_search_result_operation(
+                logger, conn_manager, "", operation, attr_key, attr_val
+            )
+
+        key = (operation["modify_dn"].lower(), attr_key.lower())
+        with self._lock:
+            block = self._blocks.get(key)
+            if block:
+                return block.popleft()
+
+            # The value that was read may predate our own last reservation
+            current = max(attr_val, self._reserved.get(key, attr_val))
+            for _ in range(self.attempts):
+                reserved = current + self.block_size
+                if modify_dn(
+                    conn_manager.get_connection(),
+                    operation["modify_dn"],
+                    {
+                        attr_key: [
+                            (MODIFY_DELETE, [current]),
+                            (MODIFY_ADD, [reserved]),
+                        ]
+                    },
+                ):
+                    break
+                # Another writer moved the counter since it was read
+                current = read_counter(
+                    conn_manager.get_connection(), operation["modify_dn"], attr_key
+                )
+                if current is None:
+                    break
+            else:
+                current = None
+            if current is None:
+                logger.error(
+                    "LDAP - failed to reserve {} values of attr_key: {} "
+                    "in LDAP DIT with: {}".format(
+                        self.block_size, attr_key, operation["modify_dn"]
+                    )
+                )
+                return False
+            logger.info(
+                "LDAP - reserved {} values {}-{} of {}".format(
+                    attr_key, current + 1, reserved, operation["modify_dn"]
+                )
+            )
+            self._reserved[key] = reserved
+            block = deque(range(current + 1, reserved + 1))
+            self._blocks[key] = block
+            return block.popleft()
+
+
+def nest_record(record):
+    """Turn the dotted keys of a flat record into nested dicts."""
+    nested = {}
+    for key, value in record.items():
+        if key is None or value in (None, ""):
+            continue
+        target = nested
+        parts = key.split(".")
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return nested
+
+
+def read_records(stream, record_format):
+    """Yield the user records of `stream` one at a time."""
+    if record_format == "csv":
+        for record in csv.DictReader(stream):
+            yield nest_record(record)
+    elif record_format == "jsonl":
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    elif record_format == "json":
+        yield from json.load(stream)
+    else:
+        raise ValueError(
+            "Unknown record format: {}, must be one of: {}".format(
+                record_format, RECORD_FORMATS
+            )
+        )
+
+
+def guess_format(path):
+    for record_format in RECORD_FORMATS:
+        if path.endswith("." + record_format):
+            return record_format
+    return "jsonl"
+
+
+def read_state(path):
+    """The names of the users that a previous run has provisioned."""
+    provisioned = set()
+    try:
+        with open(path, "r") as state:
+            for line in state:
+                try:
+                    outcome = json.loads(line)
+                except ValueError:
+                    # A line that was cut short by the interruption
+                    continue
+                if outcome.get("status") == PROVISIONED:
+                    provisioned.add(outcome["name"])
+    except FileNotFoundError:
+        pass
+    return provisioned
+
+
+def provision_record(config, record, allocator, workers, logger):
+    instance = LDAP(config=config)
+    # Keep a pooled connection per worker between the records
+    instance.connection_pool_max_idle = max(instance.connection_pool_max_idle, workers)
+    # Provisioning ahead of the first spawn is not a spawn
+    instance.deferred_modifications = []
+    spawner = LoginSpawner(record, logger)
+    try:
+        return setup_ldap_entry(spawner, instance, allocator=allocator)
+    except Exception as err:
+        logger.error(
+            "LDAP - failed to provision: {}, exception: {}".format(record["name"], err)
+        )
+        return False
+
+
+class Progress:
+    """Counts the outcomes of a run and reports its throughput."""
+
+    def __init__(
+        self,
+        logger,
+        interval=10.0,
+        clock=time.monotonic,
+        statuses=(PROVISIONED, FAILED, SKIPPED),
+        unit="users",
+    ):
+        self.logger = logger
+        self.interval = interval
+        self.clock = clock
+        self.unit = unit
+        self.started = clock()
+        self.reported = self.started
+        self.counts = {status: 0 for status in statuses}
+
+    def add(self, status, count=1):
+        self.counts[status] += count
+        now = self.clock()
+        if now - self.reported >= self.interval:
+            self.reported = now
+            self.report()
+
+    def rate(self):
+        elapsed = max(self.clock() - self.started, 1e-9)
+        handled = sum(
+            count for status, count in self.counts.items() if status != SKIPPED
+        )
+        return handled / elapsed
+
+    def report(self):
+        self.logger.info(
+            "{} in {:.1f}s, {:.1f} {}/s".format(
+                ", ".join(
+                    "{} {}".format(count, status)
+                    for status, count in self.counts.items()
+                ),
+                self.clock() - self.started,
+                self.rate(),
+                self.unit,
+            )
+        )
+
+
+def bulk_provision(
+    records,
+    config=None,
+    workers=8,
+    block_size=100,
+    state_path=None,
+    logger=None,
+    report_interval=10.0,
+):
+    """Provision the entries of `records` with concurrent workers,
+    skipping the users that are recorded as provisioned in the state file.
+    Returns the Progress of the run.
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    done = read_state(state_path) if state_path else set()
+    allocator = IncrementAllocator(block_size=block_size)
+    progress = Progress(logger, interval=report_interval)
+    state = open(state_path, "a") if state_path else None
+
+    def finish(future, name):
+        status = PROVISIONED if future.result() else FAILED
+        progress.add(status)
+        if state is not None:
+            state.write(json.dumps({"name": name, "status": status}) + "\n")
+            state.flush()
+
+    pending = {}
+    try:
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="ldap-bulk"
+        ) as executor:
+            for record in records:
+                if "name" not in record:
+                    logger.error("LDAP - record without a name: {}".format(record))
+                    progress.add(FAILED)
+                    continue
+                if record["name"] in done:
+                    progress.add(SKIPPED)
+                    continue
+                # Bound the number of records that are read ahead
+                if len(pending) >= workers * 2:
+                    completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        finish(future, pending.pop(future))
+                future = executor.submit(
+                    provision_record, config, record, allocator, workers, logger
+                )
+                pending[future] = record["name"]
+            for future in list(pending):
+                finish(future, pending.pop(future))
+    finally:
+        if state is not None:
+            state.close()
+    progress.report()
+    return progress
+
+
+def load_config(path):
+    """Load a jupyterhub_config.py, which defines the LDAP settings."""
+    loader = PyFileConfigLoader(path)
+    return loader.load_config()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Provision the LDAP entries of a batch of users."
+    )
+    parser.add_argument(
+        "records", help="CSV, JSON or JSONL file of user records, - for stdin"
+    )
+    parser.add_argument(
+        "--config",
+        required=True,
+        help="The jupyterhub_config.py that defines the LDAP settings",
+    )
+    parser.add_argument("--format", choices=RECORD_FORMATS, default=None)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=100,
+        help="The number of uidNumbers that are reserved at a time",
+    )
+    parser.add_argument(
+        "--state",
+        default=None,
+        help="File that records the provisioned users, to resume from",
+    )
+    parser.add_argument("--report-interval", type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    logger = logging.getLogger("ldap_hooks.bulk")
+    config = load_config(args.config)
+    record_format = args.format or guess_format(args.records)
+
+    if args.records == "-":
+        stream = sys.stdin
+    else:
+        stream = open(args.records, "r", newline="")
+    try:
+        progress = bulk_provision(
+            read_records(stream, record_format),
+            config=config,
+            workers=args.workers,
+            block_size=args.block_size,
+            state_path=args.state,
+            logger=logger,
+            report_interval=args.report_interval,
+        )
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return 1 if progress.counts[FAILED] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from .entry import CompactEntry
+
+# How many writes of the persistent cache between each eviction of the
+# entries that exceed max_size
+EVICT_EVERY = 1000
+
+
+class EntryCache:
+    """A bounded in-memory cache of resolved LDAP entry attributes.
+
+    Entries are keyed by the distinguished name that was submitted by the
+    spawner and are evicted in least recently used order once max_size
+    is reached. The age limit is given when an entry is looked up, such
+    that different callers can accept different levels of staleness.
+    """
+
+    def __init__(self, max_size=10000, clock=time.time):
+        self.max_size = max_size
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, max_age=None):
+        """Return the cached attributes of `key`, None if the entry is
+        missing or older than max_age seconds.
+        """
+        return self.get_with_age(key, max_age=max_age)[0]
+
+    def get_with_age(self, key, max_age=None):
+        """Return the cached attributes of `key` and their age in seconds,
+        (None, None) if the entry is missing or older than max_age seconds.
+        """
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                return None, None
+            value, stored_at = cached
+            age = self.clock() - stored_at
+            if max_age is not None and age > max_age:
+                return None, None
+            self._entries.move_to_end(key)
+            return value, age
+
+    def set(self, key, value, stored_at=None):
+        if not self.max_size:
+            return
+        if stored_at is None:
+            stored_at = self.clock()
+        with self._lock:
+            self._entries[key] = (value, stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return str(value)
+
+
+class PersistentEntryCache(EntryCache):
+    """An EntryCache that is backed by an sqlite database at `path`,
+    such that the entries survive a restart of the Hub.
+
+    The database is opened in WAL mode, which lets several Hub processes
+    on the same host read and write it concurrently. Lookups are served
+    from memory and fall back to the database, the time an entry was
+    stored is kept with it such that max_age holds across restarts.
+
+    The rows are keyed by `scope` as well, E.g. a digest of the settings
+    that decide which entry is cached under a key. A Hub whose settings
+    changed misses on the rows of the others, rather than deleting them,
+    and clear() only empties the memory tier of this process.
+    """
+
+    def __init__(
+        self, path, max_size=10000, clock=time.time, busy_timeout=5.0, scope=None
+    ):
+        super().__init__(max_size=max_size, clock=clock)
+        self.path = path
+        self.scope = scope
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(
+            path, timeout=busy_timeout, check_same_thread=False, isolation_level=None
+        )
+        self._db_lock = threading.Lock()
+        self._writes = 0
+        with self._db_lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, dn TEXT, value TEXT, stored_at REAL)"
+            )
+
+    def _row_key(self, key):
+        if not self.scope:
+            return key
+        return "{}:{}".format(self.scope, key)
+
+    def set_scope(self, scope):
+        """Scope the rows by `scope` from now on, the entries of the memory
+        tier were cached with the previous one.
+        """
+        if scope != self.scope:
+            self.scope = scope
+            super().clear()
+
+    def _load(self, key):
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT dn, value, stored_at FROM entries WHERE key = ?",
+                (self._row_key(key),),
+            ).fetchone()
+        if row is None:
+            return None
+        dn, value, stored_at = row
+        return CompactEntry(dn, json.loads(value)), stored_at
+
+    def get_with_age(self, key, max_age=None):
+        value, age = super().get_with_age(key, max_age=max_age)
+        if value is not None:
+            return value, age
+        loaded = self._load(key)
+        if loaded is None:
+            return None, None
+        value, stored_at = loaded
+        age = self.clock() - stored_at
+        if max_age is not None and age > max_age:
+            return None, None
+        super().set(key, value, stored_at=stored_at)
+        return value, age
+
+    def set(self, key, value, stored_at=None):
+        if not self.max_size:
+            return
+        if stored_at is None:
+            stored_at = self.clock()
+        super().set(key, value, stored_at=stored_at)
+        dn = getattr(value, "dn", key)
+        encoded = json.dumps(dict(value), default=encode_value)
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, dn, value, stored_at) "
+                "VALUES (?, ?, ?, ?)",
+                (self._row_key(key), dn, encoded, stored_at),
+            )
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict()
+
+    def _evict(self):
+        # Keep the max_size most recently stored entries on disk
+        self._db.execute(
+            "DELETE FROM entries WHERE key NOT IN ("
+            "SELECT key FROM entries ORDER BY stored_at DESC LIMIT ?)",
+            (self.max_size,),
+        )
+
+    def delete(self, key):
+        super().delete(key)
+        with self._db_lock:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (self._row_key(key),))
+
+    def close(self):
+        with self._db_lock:
+            self._db.close()
+
+
+_entry_cache = None
+_entry_cache_lock = threading.Lock()
+
+
+def get_entry_cache(max_size=10000, path=None, scope=None):
+    """Return the process wide entry cache, it is persisted in
+    an sqlite database at `path` if it is given, in rows of `scope`.
+    """
+    global _entry_cache
+    with _entry_cache_lock:
+        current_path = getattr(_entry_cache, "path", None)
+        if _entry_cache is None or current_path != (path or None):
+            if path:
+                _entry_cache = PersistentEntryCache(
+                    path, max_size=max_size, scope=scope
+                )
+            else:
+                _entry_cache = EntryCache(max_size=max_size)
+        else:
+            _entry_cache.max_size = max_size
+            if path:
+                _entry_cache.set_scope(scope)
+        return _entry_cache
+
+
+def clear_entry_cache():
+    """Discard every cached entry of this process, if the entry cache has
+    been created. The rows of a persistent entry cache are kept for the
+    other Hubs that share it.
+    """
+    with _entry_cache_lock:
+        if _entry_cache is not None:
+            _entry_cache.clear()
+
+
+class SchemaCache:
+    """The objectClasses definitions that each server url supports."""
+
+    def __init__(self):
+        self._object_classes = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            return self._object_classes.get(url)
+
+    def set(self, url, object_classes):
+        with self._lock:
+            self._object_classes[url] = list(object_classes)
+
+    def clear(self):
+        with self._lock:
+            self._object_classes.clear()
+
+
+_schema_cache = SchemaCache()
+
+
+def get_schema_cache():
+    return _schema_cache
@@ -0,0 +1,795 @@
+import threading
+from textwrap import dedent
+from traitlets import Unicode, Dict, List, Tuple, Float, Integer, Union, Bool, Enum
+from traitlets import TraitType
+from traitlets.config import LoggingConfigurable
+from .constants import DROP_NEWEST, OVERFLOW_POLICIES
+
+# Held while the settings that are assigned to the LDAP class are read or
+# replaced, such that an instance sees either all or none of a reload
+settings_lock = threading.RLock()
+
+
+class LDAP(LoggingConfigurable):
+
+    url = Union(
+        [Unicode(), List(trait=Union([Unicode(), Dict()]))],
+        allow_none=False,
+        config=True,
+        help=dedent(
+            """
+    URL/IP of the LDAP server. E.g. 127.0.0.1
+
+    Alternatively a list of servers, where each server is either a URL
+    string, which is a PROVIDER, or a dict that sets its role.
+    Writes are sent to the PROVIDER, whereas reads are sent to the
+    CONSUMER with the lowest recent latency.
+    E.g.
+        [{'url': 'ldap://provider', 'role': PROVIDER},
+         {'url': 'ldap://consumer1', 'role': CONSUMER},
+         {'url': 'ldap://consumer2', 'role': CONSUMER}]
+    """
+        ),
+    )
+
+    user = Unicode(
+        allow_none=False,
+        config=True,
+        help=dedent(
+            """
+    Distinguished Name String that is used to connect to the LDAP server.
+    E.g. cn=admin,dc=example,dc=org
+    """
+        ),
+    )
+
+    password = Unicode(
+        allow_none=True,
+        config=True,
+        help=dedent(
+            """
+    Password used to authenticate as user.
+    """
+        ),
+    )
+
+    ssl_cert_path = Unicode(
+        allow_none=True,
+        config=True,
+        help=dedent(
+            """
+    A path to the SSL certificate that is used to authenticate
+    as the 'user' with.
+    """
+        ),
+    )
+
+    hook_timeout = Float(
+        allow_none=True,
+        config=True,
+        default_value=None,
+        help=dedent(
+            """
+    The total number of seconds that the hook is allowed to spend on
+    the LDAP server. The remaining budget is carried down into the
+    timeout of each connect, bind, search and modify operation.
+    If the budget runs out, the pending operation is abandoned and
+    the hook fails with an error that names the step which overran.
+    E.g. 10.0
+    """
+        ),
+    )
+
+    connect_timeout = Float(
+        allow_none=True,
+        config=True,
+        default_value=None,
+        help=dedent(
+            """
+    The number of seconds to wait for the TCP connection
+    to the LDAP server to be established.
+    """
+        ),
+    )
+
+    receive_timeout = Float(
+        allow_none=True,
+        config=True,
+        default_value=None,
+        help=dedent(
+            """
+    The number of seconds to wait for the response of a single
+    LDAP operation before it is abandoned.
+    """
+        ),
+    )
+
+    search_time_limit = Integer(
+        allow_none=False,
+        config=True,
+        default_value=0,
+        help=dedent(
+            """
+    The server side time limit in seconds of each search operation,
+    0 means no limit. When hook_timeout is set, the remaining budget
+    further limits it.
+    """
+        ),
+    )
+
+    search_size_limit = Integer(
+        allow_none=False,
+        config=True,
+        default_value=0,
+        help=dedent(
+            """
+    The maximum number of entries that the server should return from
+    each search operation, 0 means no limit.
+    """
+        ),
+    )
+
+    hedge_percentile = Float(
+        allow_none=True,
+        config=True,
+        default_value=None,
+        help=dedent(
+            """
+    Enables hedged reads when multiple CONSUMER servers are configured.
+    If a search on the selected replica has not been answered within this
+    percentile of its recent latencies, the same search is issued to a second
+    replica, and the first answer is used. Writes are never hedged.
+    E.g. 95.0
+    """
+        ),
+    )
+
+    hedge_min_delay = Float(
+        allow_none=False,
+        config=True,
+        default_value=0.05,
+        help=dedent(
+            """
+    The minimum number of seconds that a read waits before it is hedged,
+    also used until enough latencies have been recorded for the percentile.
+    """
+        ),
+    )
+
+    connection_pool_min_size = Integer(
+        allow_none=False,
+        config=True,
+        default_value=1,
+        help=dedent(
+            """
+    The number of connections to each server that warm_up opens and
+    binds ahead of the first spawn.
+    """
+        ),
+    )
+
+    connection_pool_max_idle = Integer(
+        allow_none=False,
+        config=True,
+        default_value=4,
+        help=dedent(
+            """
+    The maximum number of bound connections to each server that are kept
+    open between spawns, 0 opens a new connection for every spawn. If the
+    first search on a kept connection fails, E.g. because the server or a
+    load balancer dropped it while it was idle, the search is retried once
+    on a new connection.
+    """
+        ),
+    )
+
+    connection_pool_max_idle_time = Float(
+        allow_none=True,
+        config=True,
+        default_value=300.0,
+        help=dedent(
+            """
+    The number of seconds that an idle connection is reused for before
+    it is closed, which should be below any idle timeout of the server.
+    """
+        ),
+    )
+
+    directory_mirror = Bool(
+        allow_none=False,
+        config=True,
+        default_value=False,
+        help=dedent(
+            """
+    Keep an in-memory mirror of the entries below base_dn with the
+    configured object_classes, such that returning users are found without
+    any round trip to the LDAP server. The mirror is filled by a paged
+    search, and kept current by searching for entries with a newer
+    modifyTimestamp every directory_mirror_sync_interval seconds.
+    Deleted entries are not seen by these searches, they stay in the mirror
+    and are used until the next directory_mirror_full_sync_interval.
+    """
+        ),
+    )
+
+    directory_mirror_confirm = Bool(
+        allow_none=False,
+        config=True,
+        default_value=False,
+        help=dedent(
+            """
+    Confirm that an entry found in the directory mirror still exists with
+    a base-scoped search of its DN before it is used, which costs a round
+    trip to the LDAP server for every returning user. An entry that has
+    been deleted is removed from the mirror, and the user's entry is searched
+    for as without the mirror. If the directory can't be reached, the
+    mirrored entry is used. By default, an entry that was deleted is used
+    until the next directory_mirror_full_sync_interval.
+    """
+        ),
+    )
+
+    directory_mirror_page_size = Integer(
+        allow_none=False,
+        config=True,
+        default_value=500,
+        help=dedent(
+            """
+    The number of entries that are retrieved per page when the
+    directory mirror is synced.
+    """
+        ),
+    )
+
+    directory_mirror_sync_interval = Float(
+        allow_none=False,
+        config=True,
+        default_value=60.0,
+        help=dedent(
+            """
+    The number of seconds between each sync of modified entries
+    into the directory mirror.
+    """
+        ),
+    )
+
+    directory_mirror_full_sync_interval = Float(
+        allow_none=False,
+        config=True,
+        default_value=3600.0,
+        help=dedent(
+            """
+    The number of seconds between each full sync of the directory mirror,
+    which also removes the entries that have been deleted from the DIT.
+    """
+        ),
+    )
+
+    circuit_breaker_failure_threshold = Integer(
+        allow_none=False,
+        config=True,
+        default_value=5,
+        help=dedent(
+            """
+    The number of consecutive connection or operation failures
+    after which the circuit breaker of the url opens. While open, the hook
+    fails instantly or serves a cached entry for returning users instead
+    of waiting for the LDAP server. 0 disables the circuit breaker.
+    """
+        ),
+    )
+
+    circuit_breaker_cooldown = Float(
+        allow_none=False,
+        config=True,
+        default_value=30.0,
+        help=dedent(
+            """
+    The number of seconds that an open circuit breaker waits before
+    it lets a single trial request through to the LDAP server.
+    """
+        ),
+    )
+
+    entry_cache_size = Integer(
+        allow_none=False,
+        config=True,
+        default_value=10000,
+        help=dedent(
+            """
+    The maximum number of resolved LDAP entries that are kept in memory,
+    0 disables the entry cache.
+    """
+        ),
+    )
+
+    entry_cache_max_age = Float(
+        allow_none=True,
+        config=True,
+        default_value=86400.0,
+        help=dedent(
+            """
+    The maximum age in seconds of a cached entry that is served to a
+    returning user while the circuit breaker is open.
+    None means that any cached entry is served.
+    """
+        ),
+    )
+
+    entry_cache_path = Unicode(
+        allow_none=True,
+        config=True,
+        default_value=None,
+        help=dedent(
+            """
+    The path of an sqlite database that the entry cache is persisted in,
+    such that it survives restarts of the Hub. It can be shared by the
+    Hub processes on the same host. None keeps the cache in memory only.
+    """
+        ),
+    )
+
+    entry_cache_ttl = Float(
+        allow_none=False,
+        config=True,
+        default_value=0.0,
+        help=dedent(
+            """
+    Returning users whose cached entry is younger than entry_cache_ttl
+    seconds are served from the entry cache without searching the
+    directory. 0 disables serving from the cache while the servers
+    are available.
+    """
+        ),
+    )
+
+    entry_cache_hard_ttl = Float(
+        allow_none=False,
+        config=True,
+        default_value=0.0,
+        help=dedent(
+            """
+    Cached entries older than entry_cache_ttl but younger than
+    entry_cache_hard_ttl seconds are still served, while the entry is
+    refreshed in the background. Past the hard TTL the spawn searches
+    the directory. If the refresh fails, the stale entry is served for
+    up to entry_cache_max_age seconds.
+    """
+        ),
+    )
+
+    memoize_results = Bool(
+        allow_none=False,
+        config=True,
+        default_value=False,
+        help=dedent(
+            """
+    Remember the interpolated dynamic_attributes and the rendered
+    set_spawner_attributes of each user, such that subsequent spawns of
+    the same user apply them without resolving the entry again. They are
+    discarded when the configuration or the submitted object changes.
+    """
+        ),
+    )
+
+    memoize_validate = Bool(
+        allow_none=False,
+        config=True,
+        default_value=True,
+        help=dedent(
+            """
+    Validate a memoized result by a base search of the entry for its
+    entryCSN or modifyTimestamp before it is applied, such that changes
+    to the entry in the directory are picked up.
+    """
+        ),
+    )
+
+    pre_provision_wait = Float(
+        allow_none=False,
+        config=True,
+        default_value=5.0,
+        help=dedent(
+            """
+    The number of seconds that a spawn waits for the pre-provisioning
+    of the user by pre_provision_hook to finish, before it falls back
+    to provisioning the entry itself.
+    """
+        ),
+    )
+
+    deferred_modifications = List(
+        trait=Dict(),
+        default_value=[],
+        help=dedent(
+            """
+    A list of modifications that are written by the write-behind queue
+    after the spawn, instead of delaying it. Each modification has an
+    'action' of MODIFY_ADD, MODIFY_DELETE or MODIFY_REPLACE, an 'attribute'
+    and a 'value', which is formatted with the dynamic_attributes and
+    spawn_time, the GeneralizedTime of the spawn. The modification is made
+    to the entry of the user, or to the entry of 'modify_dn'.
+    E.g.
+        [{'action': MODIFY_REPLACE, 'attribute': 'description',
+          'value': 'Last spawn at {spawn_time}'},
+         {'action': MODIFY_ADD, 'attribute': 'memberUid', 'value': '{uid}',
+          'modify_dn': 'cn=students,ou=groups,dc=example,dc=org'}]
+    """
+        ),
+    )
+
+    write_behind_max_size = Integer(
+        allow_none=False,
+        config=True,
+        default_value=10000,
+        help=dedent(
+            """
+    The maximum number of DNs with deferred_modifications that are
+    queued to be written, beyond which write_behind_overflow_policy applies.
+    """
+        ),
+    )
+
+    write_behind_overflow_policy = Enum(
+        OVERFLOW_POLICIES,
+        config=True,
+        default_value=DROP_NEWEST,
+        help=dedent(
+            """
+    What happens to a deferred modification when the write-behind queue
+    is full. 'drop_newest' drops it, 'drop_oldest' drops the longest
+    queued DN instead, and 'block' waits for up to one second for room
+    before it drops it, which holds up the spawn. 'block' only waits in the
+    threads that provision without an event loop, E.g. the pre-provisioning
+    at login, the broker and the provisioning service. On the Hub's event
+    loop it drops the newest modification, as 'drop_newest' does.
+    """
+        ),
+    )
+
+    write_behind_batch_size = Integer(
+        allow_none=False,
+        config=True,
+        default_value=50,
+        help=dedent(
+            """
+    The maximum number of DNs that are written over a single connection
+    to the provider at a time.
+    """
+        ),
+    )
+
+    write_behind_flush_interval = Float(
+        allow_none=False,
+        config=True,
+        default_value=1.0,
+        help=dedent(
+            """
+    The maximum number of seconds that a deferred modification waits for
+    a full batch before it is written.
+    """
+        ),
+    )
+
+    write_behind_max_retries = Integer(
+        allow_none=False,
+        config=True,
+        default_value=5,
+        help=dedent(
+            """
+    The number of times that a failed deferred modification is retried,
+    with a backoff that starts at write_behind_retry_backoff seconds
+    and doubles with each attempt.
+    """
+        ),
+    )
+
+    write_behind_retry_backoff = Float(
+        allow_none=False,
+        config=True,
+        default_value=1.0,
+        help=dedent(
+            """
+    The number of seconds before the first retry of a failed
+    deferred modification.
+    """
+        ),
+    )
+
+    write_behind_drain_timeout = Float(
+        allow_none=False,
+        config=True,
+        default_value=10.0,
+        help=dedent(
+            """
+    The maximum number of seconds that the shutdown of the Hub waits for
+    the queued deferred modifications to be written.
+    """
+        ),
+    )
+
+    config_reload_token = Unicode(
+        allow_none=True,
+        config=True,
+        default_value=None,
+        help=dedent(
+            """
+    The token that a request to the ConfigReloadHandler must present in its
+    'Authorization: token <token>' header. The handler refuses every
+    request while it is not set.
+    """
+        ),
+    )
+
+    broker_socket = Unicode(
+        allow_none=True,
+        config=True,
+        default_value=None,
+        help=dedent(
+            """
+    The path of the Unix socket of an ldap-hooks-broker. If it is set,
+    setup_ldap_entry_hook sends the inputs of the spawn to the broker, which
+    provisions the entry with its own connections, entry cache and ID
+    allocator, and applies the set_spawner_attributes that it returns.
+    E.g. /run/ldap-hooks/broker.sock
+    """
+        ),
+    )
+
+    service_url = Unicode(
+        allow_none=True,
+        config=True,
+        default_value=None,
+        help=dedent(
+            """
+    The URL of an ldap-hooks-service, E.g. the url of the JupyterHub service
+    that runs it. If it is set, and broker_socket is not,
+    setup_ldap_entry_hook posts the inputs of the spawn to its /provision
+    endpoint and applies the set_spawner_attributes that it returns.
+    E.g. http://127.0.0.1:10101
+    """
+        ),
+    )
+
+    service_token = Unicode(
+        allow_none=True,
+        config=True,
+        default_value=None,
+        help=dedent(
+            """
+    The token that setup_ldap_entry_hook presents to the service_url in its
+    'Authorization: token <token>' header, E.g. the api_token of the
+    JupyterHub service that runs the ldap-hooks-service.
+    """
+        ),
+    )
+
+    record_path = Unicode(
+        allow_none=True,
+        config=True,
+        default_value=None,
+        help=dedent(
+            """
+    The path of a JSONL file that setup_ldap_entry_hook appends a record of
+    each call to, which ldap-hooks-replay can replay. A record has the
+    pseudonymized user name and submitted object, the branch that was taken,
+    and the timings of the LDAP operations. Nothing is recorded if it is not
+    set. E.g. /var/log/jupyterhub/ldap-hooks.jsonl
+    """
+        ),
+    )
+
+    record_key = Unicode(
+        allow_none=True,
+        config=True,
+        default_value=None,
+        help=dedent(
+            """
+    The secret that the values in the record_path file are pseudonymized
+    with, such that a user has the same pseudonym across the restarts of the
+    Hub. A random key of the process is used if it is not set.
+    """
+        ),
+    )
+
+    base_dn = Unicode(
+        allow_none=False,
+        config=True,
+        help=dedent(
+            """
+    """
+        ),
+    )
+
+    object_classes = List(
+        trait=Unicode(),
+        default_value=[],
+        allow_none=False,
+        config=True,
+        help=dedent(
+            """
+    Which LDAP object classes should be used for the add operation.
+    """
+        ),
+    )
+
+    object_attributes = Dict(
+        value_trait=Unicode(),
+        key_trait=Unicode(),
+        default_value={},
+        help=dedent(
+            """
+    Which attributes should be attached to a specified LDAP object_class.
+    """
+        ),
+    )
+
+    unique_object_attributes = List(
+        trait=Unicode(),
+        default_value=[],
+        help=dedent(
+            """
+    List of attributes inside the defined object_classes which are unique
+    and can't have duplicates in the DIT with the same object classes.
+    """
+        ),
+    )
+
+    replace_object_with = Dict(
+        value_trait=Unicode(),
+        key_trait=Unicode(),
+        default_value={},
+        help=dedent(
+            """
+    A dictionary of key value pairs that should be used to prepare the submit
+    object string.
+
+    E.g. {'/': '+'}
+    Which translates the following distinguished name as:
+        /C=NA/ST=NA/L=NA/O=NA/OU=NA/CN=User Name/emailAddress=email@address.com
+
+        +C=NA+ST=NA+L=NA+O=NA+OU=NA+CN=User Name+emailAddress=email@address.com
+    """
+        ),
+    )
+
+    name_strip_chars = List(
+        trait=Unicode(),
+        default_value=["/", "+", "*", ",", ".", "!", " "],
+        help=dedent(
+            """
+    A list of characters that should be lstriped and rstriped from
+    the submit name.
+    """
+        ),
+    )
+
+    submit_spawner_attribute = Unicode(
+        allow_none=False,
+        config=True,
+        default_value=None,
+        help=dedent(
+            """
+    A . seperated string that contains the property path to access
+    the LDAP object string in the passed in spawner object.
+
+    The resulting attribute can subsequently be prepared by
+    submit_spawner_attribute_keys lookup, if the attribute contains
+    a dictionary.
+
+    The final extracted submit value is subsequently processed
+     by replace_object_with before it is submitted to the LDAP DIT.
+    E.g:
+        'user.data.ldap_object_distinguish_name_string_or_dict'
+    """
+        ),
+    )
+
+    submit_spawner_attribute_keys = Tuple(
+        allow_none=True,
+        config=True,
+        default_value=(),
+        help=dedent(
+            """
+    A tuple containing the key's lookup path to extract the
+    submit value from the identified dictionary as defined by
+    submit_spawner_attribute.
+
+    E.g:
+        ('ldap_object_dict_key',)
+    """
+        ),
+    )
+
+    dynamic_attributes = Dict(
+        value_trait=Unicode(),
+        key_trait=Unicode(),
+        default_value={},
+        help=dedent(
+            """
+    A dict of dynamic attributes that is generated from one of
+    DYNAMIC_ATTRIBUTE_METHODS methods to extract values.
+    """
+        ),
+    )
+
+    search_attribute_queries = List(
+        trait=Dict(),
+        default_value=[],
+        help=dedent(
+            """
+    A list of expected variables to be extracted and prepared
+    from the base_dn LDAP DIT before creation
+    """
+        ),
+    )
+
+    search_result_operations = Dict(
+        value_trait=Dict(),
+        key_trait=Unicode(),
+        default_value={},
+        help=dedent(
+            """
+    A dict of attribute operations that should be carried out after
+    search_attribute_queries has been retrived. The 'action' key value
+    must be defined in SEARCH_RESULT_OPERATION_ACTIONS.
+    E.g.
+        {'uidNumber': {'action': INCREMENT_ATTRIBUTE,
+                       'modify_dn': 'cn=uidNext,dc=example,dc=org'}}
+    """
+        ),
+    )
+
+    group_memberships = List(
+        trait=Dict(),
+        default_value=[],
+        help=dedent(
+            """
+    A list of groups that a newly created entry, or an existing entry that
+    is found in the directory, is added to. The 'group_dn' and the 'value'
+    of the member 'attribute' are formatted with the dynamic_attributes and
+    dn, the DN of the entry. The groups that already have the member are
+    found by a single search, and the member is added to the others
+    concurrently.
+    E.g.
+        [{'group_dn': 'cn=students,ou=groups,dc=example,dc=org',
+          'attribute': 'memberUid', 'value': '{uid}'},
+         {'group_dn': 'cn={course},ou=groups,dc=example,dc=org',
+          'attribute': 'member', 'value': '{dn}'}]
+    """
+        ),
+    )
+
+    group_memberships_deferred = Bool(
+        allow_none=False,
+        config=True,
+        default_value=False,
+        help=dedent(
+            """
+    Add the members of the group_memberships through the write-behind
+    queue after the spawn, instead of during it.
+    """
+        ),
+    )
+
+    set_spawner_attributes = Dict(
+        value_trait=Unicode(),
+        key_trait=Unicode(),
+        default_value={},
+        help=dedent(
+            """
+    A dict of attributes that should be set on the passed in spawner object.
+    """
+        ),
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Keep the settings that were assigned to the class when the hook
+        # started, a reload that happens meanwhile applies to the next hook
+        cls = type(self)
+        with settings_lock:
+            for name in cls.class_own_traits():
+                value = cls.__dict__.get(name)
+                if value is not None and not isinstance(value, TraitType):
+                    self.__dict__.setdefault(name, value)
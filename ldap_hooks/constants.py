@@ -0,0 +1,81 @@
+SPAWNER_SUBMIT_DATA = "1"
+LDAP_SEARCH_ATTRIBUTE_QUERY = "2"
+SPAWNER_ATTRIBUTE = "3"
+SPAWNER_USER_ATTRIBUTE = "4"
+LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY = "5"
+
+DYNAMIC_ATTRIBUTE_METHODS = (
+    SPAWNER_SUBMIT_DATA,
+    LDAP_SEARCH_ATTRIBUTE_QUERY,
+    SPAWNER_ATTRIBUTE,
+    SPAWNER_USER_ATTRIBUTE,
+    LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY,
+)
+INCREMENT_ATTRIBUTE = "1"
+SEARCH_RESULT_OPERATION_ACTIONS = (INCREMENT_ATTRIBUTE,)
+
+PROVIDER = "provider"
+CONSUMER = "consumer"
+
+SERVER_ROLES = (PROVIDER, CONSUMER)
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+OVERFLOW_POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK)
+
+# The settings that tune how the hook reaches the servers, rather than what
+# it provisions, such that changing them keeps the memoized results
+OPERATIONAL_SETTINGS = (
+    "user",
+    "password",
+    "ssl_cert_path",
+    "hook_timeout",
+    "connect_timeout",
+    "receive_timeout",
+    "search_time_limit",
+    "search_size_limit",
+    "hedge_percentile",
+    "hedge_min_delay",
+    "connection_pool_min_size",
+    "connection_pool_max_idle",
+    "connection_pool_max_idle_time",
+    "directory_mirror",
+    "directory_mirror_page_size",
+    "directory_mirror_sync_interval",
+    "directory_mirror_full_sync_interval",
+    "circuit_breaker_failure_threshold",
+    "circuit_breaker_cooldown",
+    "entry_cache_size",
+    "entry_cache_max_age",
+    "entry_cache_path",
+    "entry_cache_ttl",
+    "entry_cache_hard_ttl",
+    "pre_provision_wait",
+    "write_behind_max_size",
+    "write_behind_overflow_policy",
+    "write_behind_batch_size",
+    "write_behind_flush_interval",
+    "write_behind_max_retries",
+    "write_behind_retry_backoff",
+    "write_behind_drain_timeout",
+    "config_reload_token",
+    "broker_socket",
+    "service_url",
+    "service_token",
+    "record_path",
+    "record_key",
+)
+
+# The settings that decide which entry is cached under a key
+ENTRY_CACHE_SETTINGS = (
+    "url",
+    "base_dn",
+    "object_classes",
+    "unique_object_attributes",
+    "submit_spawner_attribute",
+    "submit_spawner_attribute_keys",
+    "replace_object_with",
+    "name_strip_chars",
+)
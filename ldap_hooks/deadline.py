@@ -0,0 +1,76 @@
+import math
+import time
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the total time budget of a hook has been spent."""
+
+    def __init__(self, step, timeout):
+        self.step = step
+        self.timeout = timeout
+        super().__init__(
+            "deadline of {} seconds exceeded during step: {}".format(timeout, step)
+        )
+
+
+class Deadline:
+    """Tracks the remaining time budget of a single hook invocation.
+
+    A timeout of None or 0 disables the deadline, in which case every
+    derived operation timeout falls back to the configured limit.
+    """
+
+    def __init__(self, timeout=None, clock=time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        self.started = clock()
+        self.current_step = None
+        # The name of each step and the seconds into the budget it was entered
+        self.steps = []
+
+    def child(self):
+        """A Deadline with the remaining budget of this one, whose steps
+        are recorded on their own, E.g. for an operation on another thread.
+        """
+        child = Deadline(self.timeout, clock=self.clock)
+        child.started = self.started
+        return child
+
+    def remaining(self):
+        if not self.timeout:
+            return None
+        return self.timeout - (self.clock() - self.started)
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def step(self, name):
+        """Enter the step `name`, raise DeadlineExceeded if no time is left."""
+        self.current_step = name
+        self.steps.append((name, self.clock() - self.started))
+        if self.expired():
+            raise DeadlineExceeded(name, self.timeout)
+
+    def operation_timeout(self, limit=None):
+        """The client side timeout in seconds for the next operation,
+        that is the smallest of `limit` and the remaining budget.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return limit or None
+        if limit:
+            return min(limit, remaining)
+        return remaining
+
+    def time_limit(self, limit=0):
+        """The server side search time_limit in whole seconds,
+        0 means that the server should apply no limit.
+        """
+        timeout = self.operation_timeout(limit)
+        if timeout is None:
+            return 0
+        return max(1, int(math.ceil(timeout)))
+
+    def exceeded(self):
+        return DeadlineExceeded(self.current_step, self.timeout)
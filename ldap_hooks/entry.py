@@ -0,0 +1,91 @@
+import sys
+import threading
+from collections.abc import Mapping
+
+
+class EntryLayout:
+    """The attribute names shared by every entry with the same set of
+    attributes, along with a case insensitive index into their values.
+    """
+
+    __slots__ = ("names", "index")
+
+    def __init__(self, names):
+        self.names = tuple(sys.intern(name) for name in names)
+        self.index = {name.lower(): position for position, name in enumerate(names)}
+
+
+_layouts = {}
+_layouts_lock = threading.Lock()
+
+
+def get_entry_layout(names):
+    names = tuple(names)
+    layout = _layouts.get(names)
+    if layout is None:
+        with _layouts_lock:
+            layout = _layouts.setdefault(names, EntryLayout(names))
+    return layout
+
+
+def compact_value(value):
+    if isinstance(value, (list, set)):
+        return tuple(value)
+    return value
+
+
+class CompactEntry(Mapping):
+    """A read-only, memory compact representation of the attributes
+    of a cached LDAP entry.
+
+    Attribute names are interned and shared with every other entry that
+    has the same attributes, multi-valued attributes are stored as tuples
+    and returned as lists, as ldap3 returns them, such that they are
+    interpolated in the same way. The lookup of attribute names is case
+    insensitive, as it is in ldap3. The raw values are only kept if they
+    are explicitly passed.
+    """
+
+    __slots__ = ("dn", "_layout", "_values", "raw_attributes")
+
+    def __init__(self, dn, attributes, raw_attributes=None):
+        self.dn = dn
+        names = tuple(attributes.keys())
+        self._layout = get_entry_layout(names)
+        self._values = tuple(compact_value(attributes[name]) for name in names)
+        if raw_attributes is not None:
+            raw_attributes = CompactEntry(dn, raw_attributes)
+        self.raw_attributes = raw_attributes
+
+    def __getitem__(self, key):
+        try:
+            value = self._values[self._layout.index[key.lower()]]
+        except (KeyError, AttributeError):
+            raise KeyError(key)
+        if isinstance(value, tuple):
+            return list(value)
+        return value
+
+    def __contains__(self, key):
+        return isinstance(key, str) and key.lower() in self._layout.index
+
+    def __iter__(self):
+        return iter(self._layout.names)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return "CompactEntry({!r}, {!r})".format(self.dn, dict(self.items()))
+
+    def __reduce__(self):
+        return (CompactEntry, (self.dn, dict(self.items()), self.raw_attributes))
+
+
+def compact_entry(dn, attributes, raw_attributes=None):
+    """Return `attributes` as a CompactEntry, entries that already are
+    compact are returned as is.
+    """
+    if isinstance(attributes, CompactEntry):
+        return attributes
+    return CompactEntry(dn, attributes, raw_attributes=raw_attributes)
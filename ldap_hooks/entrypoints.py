@@ -0,0 +1,31 @@
+"""The hooks that a jupyterhub_config.py refers to. They defer importing
+ldap_hooks.hooks, and with it ldap3, until the first hook is called, such
+that loading the config does not pay for it.
+"""
+
+
+async def hello_hook(spawner):
+    spawner.log.info("Hello from hook")
+    return True
+
+
+async def setup_ldap_entry_hook(spawner):
+    from .config import LDAP
+
+    instance = LDAP()
+    if instance.broker_socket or instance.service_url:
+        # The broker or the provisioning service don't need ldap3 here
+        from .spawn import provision_remotely as provision
+    else:
+        from .hooks import provision_entry as provision
+    if instance.record_path:
+        from .record import record_hook
+
+        return await record_hook(spawner, instance, provision)
+    return await provision(spawner, instance)
+
+
+def pre_provision_hook(authenticator, handler, authentication):
+    from . import hooks
+
+    return hooks.pre_provision_hook(authenticator, handler, authentication)
@@ -0,0 +1,137 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ldap3 import LEVEL, MODIFY_ADD
+from ldap3.core.exceptions import LDAPException
+from ldap3.utils.conv import escape_filter_chars
+from ldap3.utils.dn import parse_dn
+from .ldap import modify_dn
+from .pool import ServerUnavailable
+
+# The number of group modifies that are sent concurrently
+GROUP_MEMBERSHIP_WORKERS = 8
+
+# The result of adding a member that a concurrent spawn has added already
+ATTRIBUTE_OR_VALUE_EXISTS = "attributeOrValueExists"
+
+
+def format_group_memberships(logger, group_memberships):
+    """The (group_dn, attribute, value) of each formatted membership, None
+    if any of them is incomplete or could not be formatted.
+    """
+    memberships = []
+    for membership in group_memberships:
+        if not all(key in membership for key in ("group_dn", "attribute", "value")):
+            logger.error(
+                "LDAP - group_dn, attribute or value is missing from "
+                "group_memberships: {}".format(membership)
+            )
+            return None
+        if "{" in membership["group_dn"] or "{" in membership["value"]:
+            logger.error(
+                "LDAP - failed to format the group membership: {}".format(membership)
+            )
+            return None
+        memberships.append(
+            (membership["group_dn"], membership["attribute"], membership["value"])
+        )
+    return memberships
+
+
+def membership_searches(memberships):
+    """Group the `memberships` by the parent of their group, and return the
+    one level search_base and search_filter that finds the groups among
+    them which already have their member.
+    """
+    filters = {}
+    for group_dn, attribute, value in memberships:
+        rdn, *parent = parse_dn(group_dn)
+        parent_dn = ",".join("{}={}".format(attr, val) for attr, val, _ in parent)
+        search_base, terms = filters.setdefault(parent_dn.lower(), (parent_dn, []))
+        terms.append(
+            "(&({}={})({}={}))".format(
+                rdn[0],
+                escape_filter_chars(rdn[1]),
+                attribute,
+                escape_filter_chars(value),
+            )
+        )
+    return [
+        (search_base, "(|{})".format("".join(terms)))
+        for search_base, terms in filters.values()
+    ]
+
+
+def existing_memberships(connection, memberships, **search_limits):
+    """The lowercased DNs of the groups that already have their member,
+    found with a single search per parent of the groups.
+    """
+    present = set()
+    for search_base, search_filter in membership_searches(memberships):
+        if connection.search(
+            search_base,
+            search_filter,
+            search_scope=LEVEL,
+            attributes=["1.1"],
+            **search_limits
+        ):
+            present.update(
+                entry["dn"].lower()
+                for entry in connection.response
+                if entry.get("type") == "searchResEntry"
+            )
+    return present
+
+
+_group_executor = None
+_group_executor_lock = threading.Lock()
+
+
+def get_group_executor():
+    global _group_executor
+    with _group_executor_lock:
+        if _group_executor is None:
+            _group_executor = ThreadPoolExecutor(
+                max_workers=GROUP_MEMBERSHIP_WORKERS,
+                thread_name_prefix="ldap-group",
+            )
+        return _group_executor
+
+
+def add_membership(pool_factory, logger, group_dn, attribute, value):
+    pool = pool_factory()
+    try:
+        connection = pool.writer().get_connection()
+        success = modify_dn(connection, group_dn, {attribute: [(MODIFY_ADD, [value])]})
+        pool.record_success()
+        if success or connection.result.get("description") == ATTRIBUTE_OR_VALUE_EXISTS:
+            return True
+        logger.error(
+            "LDAP - failed to add {} to the group: {}, result: {}".format(
+                value, group_dn, connection.result
+            )
+        )
+        return False
+    except (ServerUnavailable, LDAPException) as err:
+        pool.record_failure(pool.current)
+        logger.error(
+            "LDAP - failed to add {} to the group: {}, exception: {}".format(
+                value, group_dn, err
+            )
+        )
+        return False
+    finally:
+        pool.disconnect()
+
+
+def add_memberships(pool_factory, logger, memberships):
+    """Add the members of `memberships` to their groups concurrently, each
+    over a pooled connection from `pool_factory`. Returns whether every
+    member was added.
+    """
+    futures = [
+        get_group_executor().submit(
+            add_membership, pool_factory, logger, group_dn, attribute, value
+        )
+        for group_dn, attribute, value in memberships
+    ]
+    return all([future.result() for future in futures])
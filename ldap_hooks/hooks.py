@@ -1,344 +1,67 @@
+import asyncio
+import datetime
 import logging
 import copy
-from tornado import gen
-from ldap3 import Server, Connection, MODIFY_DELETE, MODIFY_ADD, BASE, ALL_ATTRIBUTES
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from ldap3 import Server, MODIFY_DELETE, MODIFY_ADD, BASE, ALL_ATTRIBUTES
 from ldap3.core.exceptions import LDAPException
+from ldap3.core.results import RESULT_SUCCESS
 from ldap3.utils.log import set_library_log_detail_level, BASIC
-from traitlets import Unicode, Dict, List, Tuple
-from traitlets.config import LoggingConfigurable
-from textwrap import dedent
-from .ldap import add_dn, search_for, modify_dn
-from .utils import recursive_format
-
-
-SPAWNER_SUBMIT_DATA = "1"
-LDAP_SEARCH_ATTRIBUTE_QUERY = "2"
-SPAWNER_ATTRIBUTE = "3"
-SPAWNER_USER_ATTRIBUTE = "4"
-LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY = "5"
-
-DYNAMIC_ATTRIBUTE_METHODS = (
-    SPAWNER_SUBMIT_DATA,
+from .accessors import MissingSegment, attribute_accessor, key_accessor
+from .cache import get_entry_cache, get_schema_cache
+from .config import LDAP
+from .constants import (
+    DYNAMIC_ATTRIBUTE_METHODS,
+    INCREMENT_ATTRIBUTE,
+    LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY,
     LDAP_SEARCH_ATTRIBUTE_QUERY,
+    SEARCH_RESULT_OPERATION_ACTIONS,
     SPAWNER_ATTRIBUTE,
+    SPAWNER_SUBMIT_DATA,
     SPAWNER_USER_ATTRIBUTE,
-    LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY,
 )
-INCREMENT_ATTRIBUTE = "1"
-SEARCH_RESULT_OPERATION_ACTIONS = (INCREMENT_ATTRIBUTE,)
-
-
-class LDAP(LoggingConfigurable):
-
-    url = Unicode(
-        allow_none=False,
-        config=True,
-        help=dedent(
-            """
-    URL/IP of the LDAP server. E.g. 127.0.0.1
-    """
-        ),
-    )
-
-    user = Unicode(
-        allow_none=False,
-        config=True,
-        help=dedent(
-            """
-    Distinguished Name String that is used to connect to the LDAP server.
-    E.g. cn=admin,dc=example,dc=org
-    """
-        ),
-    )
-
-    password = Unicode(
-        allow_none=True,
-        config=True,
-        help=dedent(
-            """
-    Password used to authenticate as user.
-    """
-        ),
-    )
-
-    ssl_cert_path = Unicode(
-        allow_none=True,
-        config=True,
-        help=dedent(
-            """
-    A path to the SSL certificate that is used to authenticate
-    as the 'user' with.
-    """
-        ),
-    )
-
-    base_dn = Unicode(
-        allow_none=False,
-        config=True,
-        help=dedent(
-            """
-    """
-        ),
-    )
-
-    object_classes = List(
-        trait=Unicode(),
-        default_value=[],
-        allow_none=False,
-        config=True,
-        help=dedent(
-            """
-    Which LDAP object classes should be used for the add operation.
-    """
-        ),
-    )
-
-    object_attributes = Dict(
-        value_trait=Unicode(),
-        key_trait=Unicode(),
-        default_value={},
-        help=dedent(
-            """
-    Which attributes should be attached to a specified LDAP object_class.
-    """
-        ),
-    )
-
-    unique_object_attributes = List(
-        trait=Unicode(),
-        default_value=[],
-        help=dedent(
-            """
-    List of attributes inside the defined object_classes which are unique
-    and can't have duplicates in the DIT with the same object classes.
-    """
-        ),
-    )
-
-    replace_object_with = Dict(
-        value_trait=Unicode(),
-        key_trait=Unicode(),
-        default_value={},
-        help=dedent(
-            """
-    A dictionary of key value pairs that should be used to prepare the submit
-    object string.
-
-    E.g. {'/': '+'}
-    Which translates the following distinguished name as:
-        /C=NA/ST=NA/L=NA/O=NA/OU=NA/CN=User Name/emailAddress=email@address.com
-
-        +C=NA+ST=NA+L=NA+O=NA+OU=NA+CN=User Name+emailAddress=email@address.com
-    """
-        ),
-    )
-
-    name_strip_chars = List(
-        trait=Unicode(),
-        default_value=["/", "+", "*", ",", ".", "!", " "],
-        help=dedent(
-            """
-    A list of characters that should be lstriped and rstriped from
-    the submit name.
-    """
-        ),
-    )
-
-    submit_spawner_attribute = Unicode(
-        allow_none=False,
-        config=True,
-        default_value=None,
-        help=dedent(
-            """
-    A . seperated string that contains the property path to access
-    the LDAP object string in the passed in spawner object.
-
-    The resulting attribute can subsequently be prepared by
-    submit_spawner_attribute_keys lookup, if the attribute contains
-    a dictionary.
-
-    The final extracted submit value is subsequently processed
-     by replace_object_with before it is submitted to the LDAP DIT.
-    E.g:
-        'user.data.ldap_object_distinguish_name_string_or_dict'
-    """
-        ),
-    )
-
-    submit_spawner_attribute_keys = Tuple(
-        allow_none=True,
-        config=True,
-        default_value=(),
-        help=dedent(
-            """
-    A tuple containing the key's lookup path to extract the
-    submit value from the identified dictionary as defined by
-    submit_spawner_attribute.
-
-    E.g:
-        ('ldap_object_dict_key',)
-    """
-        ),
-    )
-
-    dynamic_attributes = Dict(
-        value_trait=Unicode(),
-        key_trait=Unicode(),
-        default_value={},
-        help=dedent(
-            """
-    A dict of dynamic attributes that is generated from one of
-    DYNAMIC_ATTRIBUTE_METHODS methods to extract values.
-    """
-        ),
-    )
-
-    search_attribute_queries = List(
-        trait=Dict(),
-        default_value=[],
-        help=dedent(
-            """
-    A list of expected variables to be extracted and prepared
-    from the base_dn LDAP DIT before creation
-    """
-        ),
-    )
-
-    search_result_operations = Dict(
-        value_trait=Dict(),
-        key_trait=Unicode(),
-        default_value={},
-        help=dedent(
-            """
-    A dict of attribute operations that should be carried out after
-    search_attribute_queries has been retrived. The 'action' key value
-    must be defined in SEARCH_RESULT_OPERATION_ACTIONS.
-    E.g.
-        {'uidNumber': {'action': INCREMENT_ATTRIBUTE,
-                       'modify_dn': 'cn=uidNext,dc=example,dc=org'}}
-    """
-        ),
-    )
-
-    set_spawner_attributes = Dict(
-        value_trait=Unicode(),
-        key_trait=Unicode(),
-        default_value={},
-        help=dedent(
-            """
-    A dict of attributes that should be set on the passed in spawner object.
-    """
-        ),
-    )
-
-
-class ConnectionManager:
-    def __init__(self, url, logger=None, **connection_args):
-        if url is None:
-            raise TypeError("url argument must be provided")
-
-        if not isinstance(url, str) or not url:
-            raise ValueError("url must be a non zero length string")
-
-        if connection_args and not isinstance(connection_args, dict):
-            raise TypeError("con    nection_args must be a dictionary")
-
-        self.url = url
-        self.logger = logger
-        self.connection_args = connection_args
-        self.connection = None
-        self.connected = False
-
-    def connect(self, **kwargs):
-        server = Server(self.url, **kwargs)
-        try:
-            if self.connection_args:
-                # Can be Anonymous if both 'user' and 'password' are None
-                self.connection = Connection(server, **self.connection_args)
-            else:
-                # Anonymous login
-                self.connection = Connection(server)
-        except LDAPException as err:
-            self.connected = False
-            if (
-                self.logger is not None
-                and getattr(self.logger, "error", None)
-                and callable(self.logger.error)
-            ):
-                self.logger.error(
-                    "LDAP - Failed to create a connection, " "exception: {}".format(err)
-                )
-            return None
-
-        try:
-            self.connected = self.connection.bind()
-            if not self.connected:
-                if (
-                    self.logger is not None
-                    and getattr(self.logger, "error", None)
-                    and callable(self.logger.error)
-                ):
-                    self.logger.error(
-                        "LDAP - bind executed without error, "
-                        "but bind still failed: {}".format(self.connected)
-                    )
-        except LDAPException as err:
-            self.connected = False
-            if (
-                self.logger is not None
-                and getattr(self.logger, "error", None)
-                and callable(self.logger.error)
-            ):
-                self.logger.error(
-                    "LDAP - Failed to bind connection, " "exception: {}".format(err)
-                )
-            return None
-
-    def is_connected(self):
-        return self.connected
-
-    def get_connection(self):
-        return self.connection
-
-    def change_connection_user(self, **user_args):
-        try:
-            self.connection = self.connection.rebind(user_args)
-        except LDAPException as err:
-            if (
-                self.logger is not None
-                and getattr(self.logger, "error", None)
-                and callable(self.logger.error)
-            ):
-                self.logger.error(
-                    "LDAP - Failed to rebind connection, " "exception: {}".format(err)
-                )
-
-    def disconnect(self):
-        if self.connection.unbind():
-            self.connected = False
-
-    def get_response(self):
-        return self.connection.response
+from .deadline import Deadline, DeadlineExceeded
+from .entrypoints import hello_hook, setup_ldap_entry_hook  # noqa: F401
+from .entry import compact_entry
+from .groups import add_memberships, existing_memberships, format_group_memberships
+from .ldap import add_dn, modify_dn, paged_search_for, search_for
+from .memo import (
+    ENTRY_VERSION_ATTRIBUTES,
+    MemoizedResult,
+    config_fingerprint,
+    entry_cache_scope,
+    entry_version,
+    get_result_memo,
+)
+from .mirror import format_generalized_time, start_directory_mirror
+from .pool import ServerPool, ServerUnavailable
+from .record import (
+    CACHE,
+    CREATED,
+    EXISTING,
+    INVALID,
+    MEMOIZED,
+    MIRROR,
+    STALE_CACHE,
+    UNAVAILABLE,
+    UNAVAILABLE_CACHE,
+    note_branch,
+    note_deadline,
+)
+from .reducers import parse_reducers, reduce_entries
+from .spawn import provision_remotely, update_spawner_attributes
+from .utils import recursive_format
+from .writebehind import MODIFY_ACTIONS, start_write_behind_queue
 
-    def get_response_attributes(self):
-        entry_attributes = {}
-        resp = self.get_response()
-        if not resp:
-            return None
 
-        dn = None
-        for entry in resp:
-            if not dn:
-                dn = entry["dn"]
-            if "attributes" in entry:
-                # Multiple dn's, fail
-                if dn != entry["dn"]:
-                    return None
-                entry_attributes.update({entry["dn"]: entry["attributes"]})
-        return entry_attributes[dn]
+# The default page size of a paged search_attribute_queries query
+SEARCH_ATTRIBUTE_QUERY_PAGE_SIZE = 500
 
-    def get_result(self):
-        return self.connection.result
+# The number of users that are pre-provisioned concurrently
+PRE_PROVISION_WORKERS = 4
 
 
 def get_dict_key(input_dict, attr):
@@ -347,39 +70,28 @@ def get_dict_key(input_dict, attr):
     return input_dict[attr]
 
 
-def get_attr(obj, attr):
-    has_attr = hasattr(obj, attr)
-    if not has_attr:
+def rec_get_attr(obj, attr):
+    try:
+        return attribute_accessor(attr)(obj)
+    except MissingSegment:
         return False
-    return getattr(obj, attr)
 
 
-def rec_get_attr(obj, attr):
-    attributes = attr.split(".")
-    for attr in attributes:
-        obj = get_attr(obj, attr)
-        if not obj:
-            return False
-    return obj
+def get_attr(obj, attr):
+    return rec_get_attr(obj, attr)
 
 
 def tuple_dict_select(select_tuple, select_dict):
-    selected = {}
-    for key in select_tuple:
-        if selected and isinstance(selected, dict) and key in selected:
-            selected = selected[key]
-        else:
-            selected = select_dict[key]
-    return selected
+    """The value of the nested dict `select_dict` at the keys of
+    `select_tuple`, KeyError if a key is missing from its level.
+    """
+    try:
+        return key_accessor(tuple(select_tuple))(select_dict)
+    except MissingSegment as err:
+        raise KeyError(err.segment) from None
 
 
-def perform_search_result_operation(
-    logger, conn_manager, base_dn, operation, attr_key, attr_val
-):
-    logger.debug(
-        "LDAP - enter perform_search_result_operation, "
-        "{}-{}-{}".format(operation, attr_key, attr_val)
-    )
+def valid_search_result_operation(logger, operation, attr_val):
     if "action" not in operation:
         logger.error("LDAP - missing action key in: {}".format(operation))
         return False
@@ -392,7 +104,6 @@ def perform_search_result_operation(
             )
         )
         return False
-    return_value = None
     if operation["action"] == INCREMENT_ATTRIBUTE:
         valid_types = (int, float)
         if not isinstance(attr_val, valid_types):
@@ -408,23 +119,55 @@ def perform_search_result_operation(
                 "LDAP - Missing required modify_dn key in: {}".format(operation)
             )
             return False
-        return_value = attr_val + 1
+    return True
 
-        # Atomic increment
-        dn = operation["modify_dn"]
-        success = modify_dn(
-            conn_manager.get_connection(),
-            dn,
-            {attr_key: [(MODIFY_DELETE, [attr_val]), (MODIFY_ADD, [return_value])]},
-        )
+
+def perform_search_result_operations(logger, conn_manager, base_dn, operations):
+    """Perform the (operation, attr_key, attr_val) `operations`, where the
+    increments of the same modify_dn are sent as a single modify that the
+    server applies atomically. Returns the resulting value of each attr_key,
+    or False if any of the operations failed.
+    """
+    logger.debug("LDAP - enter perform_search_result_operations, {}".format(operations))
+    return_values = {}
+    changes_by_dn = {}
+    for operation, attr_key, attr_val in operations:
+        if not valid_search_result_operation(logger, operation, attr_val):
+            return False
+        return_values[attr_key] = None
+        if operation["action"] == INCREMENT_ATTRIBUTE:
+            return_value = attr_val + 1
+            dn, changes = changes_by_dn.setdefault(
+                operation["modify_dn"].lower(), (operation["modify_dn"], {})
+            )
+            changes[attr_key] = [
+                (MODIFY_DELETE, [attr_val]),
+                (MODIFY_ADD, [return_value]),
+            ]
+            return_values[attr_key] = return_value
+
+    # Atomic increment
+    for dn, changes in changes_by_dn.values():
+        success = modify_dn(conn_manager.get_connection(), dn, changes)
         if not success:
             logger.error(
                 "LDAP - failed to increment attr_key: {} "
-                "in LDAP DIT with: {}".format(attr_key, dn)
+                "in LDAP DIT with: {}".format(", ".join(changes), dn)
             )
             return False
 
-    return return_value
+    return return_values
+
+
+def perform_search_result_operation(
+    logger, conn_manager, base_dn, operation, attr_key, attr_val
+):
+    return_values = perform_search_result_operations(
+        logger, conn_manager, base_dn, [(operation, attr_key, attr_val)]
+    )
+    if not return_values:
+        return False
+    return return_values[attr_key]
 
 
 def get_interpolated_dynamic_attributes(logger, sources, dynamic_attributes):
@@ -456,498 +199,1491 @@ def get_interpolated_dynamic_attributes(logger, sources, dynamic_attributes):
         if attr_val == SPAWNER_SUBMIT_DATA:
             if SPAWNER_SUBMIT_DATA in sources and sources[SPAWNER_SUBMIT_DATA]:
                 val = get_dict_key(sources[SPAWNER_SUBMIT_DATA], attr_key)
-        if attr_val == SPAWNER_ATTRIBUTE:
-            if SPAWNER_ATTRIBUTE in sources and sources[SPAWNER_ATTRIBUTE]:
-                val = get_attr(sources[SPAWNER_ATTRIBUTE], attr_key)
-        if attr_val == SPAWNER_USER_ATTRIBUTE:
-            if SPAWNER_USER_ATTRIBUTE in sources and sources[SPAWNER_USER_ATTRIBUTE]:
-                val = get_attr(sources[SPAWNER_USER_ATTRIBUTE], attr_key)
+        if attr_val in (SPAWNER_ATTRIBUTE, SPAWNER_USER_ATTRIBUTE):
+            if attr_val in sources and sources[attr_val]:
+                val = rec_get_attr(sources[attr_val], attr_key)
         if val:
             return_dict[attr_key] = val
     logger.debug("LDAP - prepared interpolated_attributes {}".format(return_dict))
     return return_dict
 
 
-def update_spawner_attributes(spawner, spawner_attributes):
-    for spawner_attr, spawner_value in spawner_attributes.items():
-        if hasattr(spawner, spawner_attr):
-            attr = getattr(spawner, spawner_attr)
-            if isinstance(attr, dict):
-                attr.update(spawner_value)
-            if isinstance(attr, (list, set, tuple, str)):
-                setattr(spawner, spawner_attr, spawner_value)
-        else:
-            setattr(spawner, spawner_attr, spawner_value)
+def prepare_submit_data(spawner, instance, ldap_data):
+    """Prepare the submitted DN string for the LDAP DIT and split it
+    into a dict of its attributes.
+    """
+    spawner.log.info("LDAP - Submit data {}".format(ldap_data))
+    spawner.log.info(
+        "LDAP - replace_object_with {}".format(instance.replace_object_with)
+    )
 
+    for replace_key, replace_val in instance.replace_object_with.items():
+        ldap_data = ldap_data.replace(replace_key, replace_val)
 
-async def hello_hook(spawner):
-    spawner.log.info("Hello from hook")
-    return True
+    for strip in instance.name_strip_chars:
+        ldap_data = ldap_data.strip(strip)
 
+    # Turn ldap data string into dict, split on =
+    ldap_dict = {}
+    for replace_key, replace_val in instance.replace_object_with.items():
+        ldap_dict.update(dict(item.split("=") for item in ldap_data.split(replace_val)))
 
-async def setup_ldap_entry_hook(spawner):
-    instance = LDAP()
-    # TODO, copy entire default config options dynamically
-    instance.dynamic_attributes = copy.deepcopy(instance.dynamic_attributes)
-    instance.set_spawner_attributes = copy.deepcopy(instance.set_spawner_attributes)
-    instance.object_attributes = copy.deepcopy(instance.object_attributes)
-    instance.search_result_operations = copy.deepcopy(instance.search_result_operations)
+    spawner.log.info(
+        "LDAP - Prepared dn: {} for submission and dict: {} "
+        "for attribute setup".format(ldap_data, ldap_dict)
+    )
+    return ldap_data, ldap_dict
 
-    logging.basicConfig(filename="client_application.log", level=logging.DEBUG)
-    set_library_log_detail_level(BASIC)
 
-    if not instance.submit_spawner_attribute:
-        spawner.log.error(
-            "LDAP - either submit_spawner_attribute "
-            "has to define the object which is to be submitted to the LDAP DIT"
-        )
-        return False
+def entry_sources(spawner, ldap_dict, attributes):
+    """The sources of the dynamic_attributes of an existing entry."""
+    return {
+        LDAP_SEARCH_ATTRIBUTE_QUERY: attributes,
+        LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY: attributes,
+        SPAWNER_SUBMIT_DATA: ldap_dict,
+        SPAWNER_ATTRIBUTE: spawner,
+        SPAWNER_USER_ATTRIBUTE: spawner.user,
+    }
 
-    ldap_data = rec_get_attr(spawner, instance.submit_spawner_attribute)
-    if not ldap_data:
+
+def apply_entry_attributes(
+    spawner, instance, ldap_data, ldap_dict, attributes, fingerprint
+):
+    """Interpolate the dynamic_attributes from the `attributes` of an
+    existing entry and set the resulting set_spawner_attributes.
+    """
+    sources = entry_sources(spawner, ldap_dict, attributes)
+    spawner.log.debug(
+        "LDAP - dynamic_attributes "
+        "pre interpolated: {}".format(instance.dynamic_attributes)
+    )
+    prepared_dynamic_attributes = get_interpolated_dynamic_attributes(
+        spawner.log, sources, instance.dynamic_attributes
+    )
+
+    if instance.dynamic_attributes and not prepared_dynamic_attributes:
         spawner.log.error(
-            "LDAP - The spawner object: {} did not have "
-            "the specified attribute: {}".format(
-                spawner.user.__dict__, instance.submit_spawner_attribute
+            "LDAP - Failed to setup prepared_attributes:"
+            " {} with attribute_dict: {}".format(
+                prepared_dynamic_attributes, attributes
             )
         )
         return False
+    spawner.log.debug(
+        "LDAP - dynamic_attributes "
+        "post interpolated: {}".format(prepared_dynamic_attributes)
+    )
+    # Setup set_spawner_attributes
+    recursive_format(instance.set_spawner_attributes, prepared_dynamic_attributes)
+    remember_result(
+        spawner,
+        instance,
+        fingerprint,
+        ldap_data,
+        attributes,
+        prepared_dynamic_attributes,
+    )
+    defer_modifications(
+        instance,
+        spawner.log,
+        getattr(attributes, "dn", None),
+        prepared_dynamic_attributes,
+    )
+    update_spawner_attributes(spawner, instance.set_spawner_attributes)
+    return True
 
-    if isinstance(ldap_data, dict):
-        if not instance.submit_spawner_attribute_keys:
-            spawner.log.error(
-                "LDAP - Found attribute: {} in spawner object: "
-                "{}, of type: {}, requires that submit_spawner"
-                "_attribute_keys is set to extract the value "
-                "from the dictionary".format(
-                    instance.submit_spawner_attribute, spawner, type(ldap_data)
-                )
-            )
-            return False
-
-        if not isinstance(instance.submit_spawner_attribute_keys, tuple):
-            spawner.log.error(
-                "LDAP - submit_spawner_attribute_keys is "
-                "of incorrect type: {} must be a tuple".format(
-                    type(instance.submit_spawner_attribute_keys)
-                )
-            )
-            return False
 
-        new_ldap_data = tuple_dict_select(
-            instance.submit_spawner_attribute_keys, ldap_data
-        )
-        if not new_ldap_data:
-            spawner.log.error(
-                "LDAP - Failed to extract the specified dict "
-                "tuple string: {} from dict: {}".format(
-                    instance.submit_spawner_attribute_keys, ldap_data
-                )
-            )
-            return False
+# The dynamic attribute methods that are resolved without the directory
+LOCAL_DYNAMIC_ATTRIBUTE_METHODS = (
+    SPAWNER_SUBMIT_DATA,
+    SPAWNER_ATTRIBUTE,
+    SPAWNER_USER_ATTRIBUTE,
+)
 
-        ldap_data = new_ldap_data
-        if not isinstance(ldap_data, str):
-            spawner.log.error(
-                "LDAP - {} is of incorrect type, requires: {} "
-                "found: {}".format(ldap_data, str, type(ldap_data))
-            )
-            return False
 
-    # Parse spawner user LDAP string to be parsed for submission
-    conn_manager = ConnectionManager(
-        instance.url, logger=spawner.log, user=instance.user, password=instance.password
+def remember_result(
+    spawner, instance, fingerprint, ldap_data, attributes, dynamic_attributes
+):
+    """Memoize the resolved attributes of the spawner's user under the
+    `fingerprint` of the settings that they were resolved with, if
+    memoize_results is enabled.
+    """
+    if not instance.memoize_results:
+        return
+    get_result_memo(instance.entry_cache_size).set(
+        spawner.user.name,
+        MemoizedResult(
+            fingerprint,
+            ldap_data,
+            getattr(attributes, "dn", None),
+            entry_version(attributes),
+            dict(dynamic_attributes),
+            copy.deepcopy(instance.set_spawner_attributes),
+        ),
     )
-    conn_manager.connect()
 
-    entry = None
-    if conn_manager.is_connected():
-        # Check objectclasses support
-        success = search_for(
-            conn_manager.get_connection(),
-            "cn=Subschema",
-            "(objectClass=Subschema)",
+
+def validate_memoized_result(instance, logger, memoized):
+    """Whether the entry of `memoized` still exists in the directory
+    with the same version.
+    """
+    if memoized.dn is None:
+        return False
+    deadline = Deadline(instance.hook_timeout)
+    pool = new_server_pool(instance, logger, deadline)
+    try:
+        conn_manager, search_limits = prepare_operation(
+            instance, pool, deadline, "memoized entry validation"
+        )
+        conn_manager, success = pool.search(
+            conn_manager,
+            memoized.dn,
+            "(objectClass=*)",
             search_scope=BASE,
-            attributes=["objectClasses"],
+            attributes=version_attributes(conn_manager) or ["1.1"],
+            **search_limits
         )
-        response = conn_manager.get_response()
+        pool.record_success()
         if not success:
-            spawner.log.error(
-                "LDAP - failed to query for "
-                "supported objectClasses {}".format(response)
-            )
             return False
+        return entry_version(conn_manager.get_response_attributes()) == (
+            memoized.version
+        )
+    except (DeadlineExceeded, ServerUnavailable, LDAPException) as err:
+        pool.record_failure(pool.current)
+        logger.warning(
+            "LDAP - failed to validate the memoized entry: {}, "
+            "exception: {}".format(memoized.dn, err)
+        )
+        return False
+    finally:
+        pool.disconnect()
 
-        spawner.log.debug("LDAP - supported objectClasses {}".format(response))
-        found = []
-        for entry in response:
-            object_classes = entry["attributes"]["objectClasses"]
-            found = [
-                req_obj_class
-                for obj_class in object_classes
-                for req_obj_class in instance.object_classes
-                if req_obj_class.lower() in obj_class.lower()
-            ]
-
-        missing = set(instance.object_classes) - set(found)
-        if missing:
-            spawner.log.error(
-                "LDAP - only found: {} required "
-                "supported objectclasses, missing: {}".format(found, missing)
-            )
-            return False
 
-        # Prepare ldap data
-        spawner.log.info("LDAP - Submit data {}".format(ldap_data))
-        spawner.log.info(
-            "LDAP - replace_object_with {}".format(instance.replace_object_with)
+def confirm_mirrored_entry(instance, logger, dn):
+    """Whether the entry at `dn` that was found in the directory mirror
+    has not been deleted from the directory. It is assumed to exist if the
+    directory can't be reached.
+    """
+    deadline = Deadline(instance.hook_timeout)
+    pool = new_server_pool(instance, logger, deadline)
+    try:
+        conn_manager, search_limits = prepare_operation(
+            instance, pool, deadline, "mirrored entry confirmation"
+        )
+        conn_manager, success = pool.search(
+            conn_manager,
+            dn,
+            "(objectClass=*)",
+            search_scope=BASE,
+            attributes=["1.1"],
+            **search_limits
         )
+        pool.record_success()
+        return success
+    except (DeadlineExceeded, ServerUnavailable, LDAPException) as err:
+        pool.record_failure(pool.current)
+        logger.warning(
+            "LDAP - failed to confirm the mirrored entry: {}, "
+            "exception: {}".format(dn, err)
+        )
+        return True
+    finally:
+        pool.disconnect()
 
-        for replace_key, replace_val in instance.replace_object_with.items():
-            ldap_data = ldap_data.replace(replace_key, replace_val)
 
-        for strip in instance.name_strip_chars:
-            ldap_data = ldap_data.strip(strip)
+def apply_memoized_result(spawner, instance, ldap_dict, memoized):
+    """Set the memoized set_spawner_attributes on the spawner. They are
+    rendered again if a dynamic attribute that is taken from the spawner
+    differs from the memoized one, E.g. for another named server.
+    """
+    sources = {
+        SPAWNER_SUBMIT_DATA: ldap_dict,
+        SPAWNER_ATTRIBUTE: spawner,
+        SPAWNER_USER_ATTRIBUTE: spawner.user,
+    }
+    local_attributes = get_interpolated_dynamic_attributes(
+        spawner.log,
+        sources,
+        {
+            attr_key: attr_val
+            for attr_key, attr_val in instance.dynamic_attributes.items()
+            if attr_val in LOCAL_DYNAMIC_ATTRIBUTE_METHODS
+        },
+    )
+    dynamic_attributes = dict(memoized.dynamic_attributes)
+    dynamic_attributes.update(local_attributes)
+    if dynamic_attributes == memoized.dynamic_attributes:
+        spawner_attributes = copy.deepcopy(memoized.spawner_attributes)
+    else:
+        spawner_attributes = instance.set_spawner_attributes
+        recursive_format(spawner_attributes, dynamic_attributes)
+    defer_modifications(instance, spawner.log, memoized.dn, dynamic_attributes)
+    update_spawner_attributes(spawner, spawner_attributes)
+    return True
 
-        # Turn ldap data string into dict, split on =
-        ldap_dict = {}
-        for replace_key, replace_val in instance.replace_object_with.items():
-            ldap_dict.update(
-                dict(item.split("=") for item in ldap_data.split(replace_val))
-            )
 
-        spawner.log.info(
-            "LDAP - Prepared dn: {} for submission and dict: {} "
-            "for attribute setup".format(ldap_data, ldap_dict)
-        )
+def get_response_object_classes(response):
+    """Extract the objectClasses definitions from a Subschema response."""
+    object_classes = []
+    for entry in response:
+        object_classes = entry["attributes"]["objectClasses"]
+    return object_classes
 
-        # LDAP, check for unique attributes that should not be duplicated
 
-        search_filter = ""
-        # objectclasses search filter
-        if instance.object_classes:
-            search_filter = "(&{})".format(
-                "".join(
-                    [
-                        "(objectclass={})".format(object_class)
-                        for object_class in instance.object_classes
-                    ]
-                )
-            )
+def check_object_classes(logger, required_object_classes, object_classes):
+    """Whether every required object class is among the supported
+    objectClasses definitions.
+    """
+    found = [
+        req_obj_class
+        for obj_class in object_classes
+        for req_obj_class in required_object_classes
+        if req_obj_class.lower() in obj_class.lower()
+    ]
+
+    missing = set(required_object_classes) - set(found)
+    if missing:
+        logger.error(
+            "LDAP - only found: {} required "
+            "supported objectclasses, missing: {}".format(found, missing)
+        )
+        return False
+    return True
 
-        if instance.unique_object_attributes:
-            # Specific attributes to check for existing dn
-            search_attributes = "".join(
-                [
-                    "({}={})".format(attr.lower(), ldap_dict[attr])
-                    for attr in instance.unique_object_attributes
-                    if attr in ldap_dict
-                ]
+
+def object_class_filter(object_classes):
+    if not object_classes:
+        return "(objectClass=*)"
+    return "(&{})".format(
+        "".join(
+            ["(objectclass={})".format(object_class) for object_class in object_classes]
+        )
+    )
+
+
+def get_mirror_attributes(instance):
+    """The attributes that the directory mirror must keep to find an entry
+    and interpolate the dynamic_attributes of it.
+    """
+    attributes = set(instance.unique_object_attributes)
+    attributes.update(
+        attr_key
+        for attr_key, attr_val in instance.dynamic_attributes.items()
+        if attr_val in (LDAP_SEARCH_ATTRIBUTE_QUERY, LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY)
+    )
+    return sorted(attributes)
+
+
+def ensure_directory_mirror(instance, logger):
+    """Return the directory mirror if it is enabled, it is started
+    in the background on the first call. Its pools are built from the
+    current settings, such that a reloaded url applies to them.
+    """
+    if not instance.directory_mirror:
+        return None
+    return start_directory_mirror(
+        lambda: new_server_pool(LDAP(), logger),
+        instance.base_dn,
+        object_class_filter(instance.object_classes),
+        get_mirror_attributes(instance),
+        instance.unique_object_attributes,
+        page_size=instance.directory_mirror_page_size,
+        sync_interval=instance.directory_mirror_sync_interval,
+        full_sync_interval=instance.directory_mirror_full_sync_interval,
+        logger=logger,
+    )
+
+
+def ensure_write_behind_queue(instance, logger):
+    """Return the write-behind queue, its worker is started
+    on the first call. Its pools are built from the current settings,
+    such that a reloaded url applies to them.
+    """
+    return start_write_behind_queue(
+        lambda: new_server_pool(LDAP(), logger),
+        drain_timeout=instance.write_behind_drain_timeout,
+        max_size=instance.write_behind_max_size,
+        batch_size=instance.write_behind_batch_size,
+        flush_interval=instance.write_behind_flush_interval,
+        max_retries=instance.write_behind_max_retries,
+        retry_backoff=instance.write_behind_retry_backoff,
+        overflow_policy=instance.write_behind_overflow_policy,
+        logger=logger,
+    )
+
+
+def defer_modifications(instance, logger, dn, dynamic_attributes):
+    """Queue the deferred_modifications of the entry at `dn` on the
+    write-behind queue. Returns the number of DNs that were queued.
+    """
+    if not instance.deferred_modifications or not dn:
+        return 0
+    values = {
+        "spawn_time": format_generalized_time(
+            datetime.datetime.now(datetime.timezone.utc)
+        )
+    }
+    values.update(dynamic_attributes or {})
+    modifications = copy.deepcopy(instance.deferred_modifications)
+    recursive_format(modifications, values)
+
+    changes = {}
+    for modification in modifications:
+        if (
+            modification.get("action") not in MODIFY_ACTIONS
+            or "attribute" not in modification
+        ):
+            logger.error(
+                "LDAP - Illegal deferred_modifications: {}, the action"
+                " must be one of: {}".format(modification, MODIFY_ACTIONS)
             )
-        else:
-            # Use every attribute to check for existing dn
-            search_attributes = "".join(
+            continue
+        value = modification.get("value")
+        if isinstance(value, str) and "{" in value:
+            logger.error(
+                "LDAP - failed to format the deferred modification: {} "
+                "with: {}".format(modification, values)
+            )
+            continue
+        target = modification.get("modify_dn", dn)
+        changes.setdefault(target, {}).setdefault(modification["attribute"], []).append(
+            (modification["action"], [] if value is None else [value])
+        )
+
+    queue = ensure_write_behind_queue(instance, logger)
+    return sum(1 for target, change in changes.items() if queue.put(target, change))
+
+
+def new_server_pool(instance, logger, deadline=None):
+    return ServerPool(
+        instance.url,
+        logger=logger,
+        deadline=deadline,
+        connect_timeout=instance.connect_timeout,
+        receive_timeout=instance.receive_timeout,
+        failure_threshold=instance.circuit_breaker_failure_threshold,
+        cooldown=instance.circuit_breaker_cooldown,
+        hedge_percentile=instance.hedge_percentile,
+        hedge_min_delay=instance.hedge_min_delay,
+        max_idle=instance.connection_pool_max_idle,
+        max_idle_time=instance.connection_pool_max_idle_time,
+        user=instance.user,
+        password=instance.password,
+    )
+
+
+def version_attributes(conn_manager):
+    """The ENTRY_VERSION_ATTRIBUTES that the schema of the server defines."""
+    schema = conn_manager.get_connection().server.schema
+    return [
+        attr
+        for attr in ENTRY_VERSION_ATTRIBUTES
+        if schema is None or attr in schema.attribute_types
+    ]
+
+
+def entry_attributes(instance, conn_manager):
+    """The attributes to request of an entry, including the attributes of
+    its version if memoize_results is enabled.
+    """
+    if not instance.memoize_results:
+        return ALL_ATTRIBUTES
+    return [ALL_ATTRIBUTES] + version_attributes(conn_manager)
+
+
+def existing_entry_filter(instance, ldap_dict):
+    """The search filter that finds the existing entry of `ldap_dict`."""
+    search_filter = ""
+    # objectclasses search filter
+    if instance.object_classes:
+        search_filter = "(&{})".format(
+            "".join(
                 [
-                    "({}={})".format(ldap_key, ldap_value)
-                    for ldap_key, ldap_value in ldap_dict.items()
+                    "(objectclass={})".format(object_class)
+                    for object_class in instance.object_classes
                 ]
             )
+        )
 
-        # unique attributes search filter
-        if search_filter:
-            # strip last )
-            search_filter = search_filter[:-1]
-            search_filter += search_attributes + ")"
-        else:
-            search_filter = "(&{})".format(search_attributes)
+    if instance.unique_object_attributes:
+        # Specific attributes to check for existing dn
+        search_attributes = "".join(
+            [
+                "({}={})".format(attr.lower(), ldap_dict[attr])
+                for attr in instance.unique_object_attributes
+                if attr in ldap_dict
+            ]
+        )
+    else:
+        # Use every attribute to check for existing dn
+        search_attributes = "".join(
+            [
+                "({}={})".format(ldap_key, ldap_value)
+                for ldap_key, ldap_value in ldap_dict.items()
+            ]
+        )
 
-        spawner.log.debug(
-            "LDAP - unique_check, search_filter: {}".format(search_filter)
+    # unique attributes search filter
+    if search_filter:
+        # strip last )
+        search_filter = search_filter[:-1]
+        search_filter += search_attributes + ")"
+    else:
+        search_filter = "(&{})".format(search_attributes)
+
+    return search_filter
+
+
+def instance_entry_cache(instance):
+    """The entry cache of the hook, a persistent one is scoped by the
+    settings of `instance` that decide which entry is cached under a key.
+    """
+    scope = entry_cache_scope(instance) if instance.entry_cache_path else None
+    return get_entry_cache(
+        instance.entry_cache_size, instance.entry_cache_path, scope=scope
+    )
+
+
+def entry_cache_key(instance, ldap_data):
+    return ",".join([ldap_data, instance.base_dn])
+
+
+def prepare_operation(instance, pool, deadline, step, write=False):
+    """Enter the `step` of the deadline, select the server connection
+    from the pool and carry the remaining budget down into the timeout
+    of the next operation on it. Returns the connection and the limits
+    that should be passed on to a search operation.
+    """
+    deadline.step(step)
+    if write:
+        conn_manager = pool.writer()
+    else:
+        conn_manager = pool.reader()
+    conn_manager.set_operation_timeout(
+        deadline.operation_timeout(instance.receive_timeout)
+    )
+    return conn_manager, {
+        "time_limit": deadline.time_limit(instance.search_time_limit),
+        "size_limit": instance.search_size_limit,
+    }
+
+
+_revalidating = set()
+_revalidation_failures = set()
+_revalidating_lock = threading.Lock()
+
+
+def revalidate_entry(instance, logger, ldap_data, ldap_dict):
+    """Search the directory for the existing entry of `ldap_data` and
+    update its entry in the entry cache, it is removed from the cache if
+    the entry no longer exists. Returns None if the directory could not
+    be searched.
+    """
+    entry_cache = instance_entry_cache(instance)
+    key = entry_cache_key(instance, ldap_data)
+    deadline = Deadline(instance.hook_timeout)
+    pool = new_server_pool(instance, logger, deadline)
+    try:
+        conn_manager, search_limits = prepare_operation(
+            instance, pool, deadline, "existing entry revalidation"
         )
-        # Check whether dn already exists
-        success = search_for(
-            conn_manager.get_connection(),
+        conn_manager, success = pool.search(
+            conn_manager,
             instance.base_dn,
-            search_filter,
-            attributes=ALL_ATTRIBUTES,
+            existing_entry_filter(instance, ldap_dict),
+            attributes=entry_attributes(instance, conn_manager),
+            **search_limits
         )
-        if success:
-            spawner.log.info(
-                "LDAP - {} already exist, response {}".format(
-                    ldap_dict, conn_manager.get_response()
+        pool.record_success()
+        if not success:
+            logger.info(
+                "LDAP - {} no longer exists, removed it from the cache".format(
+                    ldap_data
                 )
             )
+            entry_cache.delete(key)
+            return False
+        if len(conn_manager.get_response()) > 1:
+            entry_cache.delete(key)
+            return False
+        attributes = conn_manager.get_response_attributes()
+        if attributes:
+            entry_cache.set(
+                key, compact_entry(conn_manager.get_response()[0]["dn"], attributes)
+            )
+        return True
+    except (DeadlineExceeded, ServerUnavailable, LDAPException) as err:
+        pool.record_failure(pool.current)
+        logger.warning(
+            "LDAP - failed to revalidate the cached entry of: {}, "
+            "exception: {}".format(ldap_data, err)
+        )
+        return None
+    finally:
+        pool.disconnect()
 
-            response = conn_manager.get_response()
-            if len(response) > 1:
-                spawner.log.error(
-                    "LDAP - multiple entries: {} "
-                    "were found with: {}".format(response, search_filter)
-                )
-                return False
 
-            attributes = conn_manager.get_response_attributes()
-            if not attributes:
-                spawner.log.error(
-                    "LDAP - No attributes were returned from "
-                    "existing dn: {} "
-                    "with search_filer: {}".format(ldap_data, search_filter)
-                )
-                return False
+def lookup_cached_entry(instance, entry_cache, key):
+    """Return the cached attributes of `key` that can be served without
+    searching the directory, and whether they are stale and should be
+    refreshed in the background. (None, False) if the spawn must search
+    the directory.
+    """
+    if not instance.entry_cache_ttl:
+        return None, False
+
+    max_age = max(instance.entry_cache_ttl, instance.entry_cache_hard_ttl)
+    with _revalidating_lock:
+        failing = key in _revalidation_failures
+    if failing and instance.entry_cache_hard_ttl:
+        # Keep serving the stale entry while the directory can't be reached
+        if instance.entry_cache_max_age is None:
+            max_age = None
+        else:
+            max_age = max(max_age, instance.entry_cache_max_age)
 
-            spawner.log.info("LDAP - Retrived attributes {}".format(attributes))
-            # Extract attributes from existing object
-            sources = {
-                LDAP_SEARCH_ATTRIBUTE_QUERY: attributes,
-                LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY: attributes,
-                SPAWNER_SUBMIT_DATA: ldap_dict,
-                SPAWNER_ATTRIBUTE: spawner,
-                SPAWNER_USER_ATTRIBUTE: spawner.user,
-            }
-            spawner.log.debug(
-                "LDAP - dynamic_attributes "
-                "pre interpolated: {}".format(instance.dynamic_attributes)
-            )
-            prepared_dynamic_attributes = get_interpolated_dynamic_attributes(
-                spawner.log, sources, instance.dynamic_attributes
-            )
-
-            if instance.dynamic_attributes and not prepared_dynamic_attributes:
-                spawner.log.error(
-                    "LDAP - Failed to setup prepared_attributes:"
-                    " {} with attribute_dict: {}".format(
-                        prepared_dynamic_attributes, attributes
-                    )
-                )
-                return False
-            spawner.log.debug(
-                "LDAP - dynamic_attributes "
-                "post interpolated: {}".format(prepared_dynamic_attributes)
-            )
-            # Setup set_spawner_attributes
-            recursive_format(
-                instance.set_spawner_attributes, prepared_dynamic_attributes
-            )
-            update_spawner_attributes(spawner, instance.set_spawner_attributes)
-            return True
-
-        # Create new DIT entry
-        # Get extract variables
-        sources = {}
-        for q in instance.search_attribute_queries:
-            query = copy.deepcopy(q)
-            spawner.log.debug("LDAP - extract search_attribute_query: {}".format(query))
-            if "search_base" not in query or "search_filter" not in query:
-                spawner.log.error(
-                    "LDAP - search_base or search_filter "
-                    "is missing from search_attribute_queries: "
-                    "{}".format(query)
-                )
-                return False
-            success = search_for(
-                conn_manager.get_connection(),
-                query.pop("search_base", ""),
-                query.pop("search_filter", ""),
-                **query
-            )
-            if not success:
-                spawner.log.error(
-                    "LDAP - failed to use the query: {} "
-                    "for extracting attributes, response was:"
-                    "{}".format(query, conn_manager.get_response())
-                )
-                return False
+    attributes, age = entry_cache.get_with_age(key, max_age=max_age)
+    if attributes is None:
+        return None, False
+    return attributes, age > instance.entry_cache_ttl
 
-            # get responses
-            response = conn_manager.get_response()
-            if len(response) > 1:
-                spawner.log.error(
-                    "LDAP - multiple entries: {} "
-                    "were found with: {}".format(response, search_filter)
-                )
-                return False
 
-            attributes = conn_manager.get_response_attributes()
-            spawner.log.debug(
-                "LDAP - search_attribute_queries " "attributes: {}".format(attributes)
-            )
-            if attributes:
-                # Perform search_result_operations
-                for attr_key, attr_val in attributes.items():
-                    if attr_key in instance.search_result_operations:
-                        post_operation_val = perform_search_result_operation(
-                            spawner.log,
-                            conn_manager,
-                            instance.base_dn,
-                            instance.search_result_operations[attr_key],
-                            attr_key,
-                            attr_val,
-                        )
-                        if not post_operation_val:
-                            spawner.log.error(
-                                "LDAP - Failed to get "
-                                "a valid result from "
-                                "perform_search_result_operation"
-                            )
-                            return False
-                        attributes[attr_key] = post_operation_val
-                        sources.update(
-                            {
-                                LDAP_SEARCH_ATTRIBUTE_QUERY: {
-                                    attr_key: post_operation_val
-                                },
-                                LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY: {
-                                    attr_key: post_operation_val
-                                },
-                            }
-                        )
+def revalidate_entry_in_background(instance, logger, ldap_data, ldap_dict):
+    """Revalidate the cached entry of `ldap_data` in a daemon thread,
+    unless it is already being revalidated.
+    """
+    key = entry_cache_key(instance, ldap_data)
+    with _revalidating_lock:
+        if key in _revalidating:
+            return None
+        _revalidating.add(key)
 
-                ldap_dict.update(attributes)
+    def run():
+        revalidated = None
+        try:
+            revalidated = revalidate_entry(instance, logger, ldap_data, ldap_dict)
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(key)
+                if revalidated is None:
+                    _revalidation_failures.add(key)
+                else:
+                    _revalidation_failures.discard(key)
+
+    thread = threading.Thread(target=run, name="ldap-revalidate", daemon=True)
+    thread.start()
+    return thread
+
+
+def prefetch_server_info(logger, instance, url, conn_manager):
+    """Read the root DSE and the Subschema of `url` into the schema cache,
+    and validate that the configured object_classes are supported.
+    """
+    connection = conn_manager.get_connection()
+    try:
+        if not search_for(
+            connection, "", "(objectClass=*)", search_scope=BASE, attributes=["+"]
+        ):
+            logger.error("LDAP - warm up failed to read the root DSE of {}".format(url))
+            return False
 
-        # Prepare required dynamic attributes
-        sources.update(
-            {
-                SPAWNER_SUBMIT_DATA: ldap_dict,
-                SPAWNER_ATTRIBUTE: spawner,
-                SPAWNER_USER_ATTRIBUTE: spawner.user,
-            }
+        if not search_for(
+            connection,
+            "cn=Subschema",
+            "(objectClass=Subschema)",
+            search_scope=BASE,
+            attributes=["objectClasses"],
+        ):
+            logger.error(
+                "LDAP - warm up failed to read the Subschema of {}".format(url)
+            )
+            return False
+    except LDAPException as err:
+        logger.error(
+            "LDAP - warm up failed to read the server info of {}, "
+            "exception: {}".format(url, err)
         )
-        spawner.log.debug(
-            "LDAP - Sources state before interpolation "
-            "with dynamic attributes {}".format(sources)
+        return False
+
+    object_classes = get_response_object_classes(connection.response)
+    get_schema_cache().set(url, object_classes)
+    return check_object_classes(logger, instance.object_classes, object_classes)
+
+
+def warm_up(logger=None, background=False):
+    """Prepare the configured LDAP servers before the first spawn.
+
+    Resolves each server, opens and binds connection_pool_min_size
+    connections that are kept for subsequent spawns, fetches the root DSE
+    and the Subschema, and validates that the configured object_classes
+    are supported. The directory mirror is started as well if it is enabled.
+    Can be called from the jupyterhub_config.py after the LDAP settings
+    are defined, with background=True it runs in a daemon thread,
+    which is returned, instead of blocking the Hub startup.
+    """
+    if background:
+        thread = threading.Thread(
+            target=warm_up, kwargs={"logger": logger}, name="ldap-warm-up", daemon=True
         )
+        thread.start()
+        return thread
 
-        prepared_object_attributes = get_interpolated_dynamic_attributes(
-            spawner.log, sources, instance.dynamic_attributes
+    instance = LDAP()
+    if logger is None:
+        logger = instance.log
+    ensure_directory_mirror(instance, logger)
+    pool = new_server_pool(instance, logger, Deadline(instance.hook_timeout))
+    warmed = True
+    for url, role in pool.servers:
+        server = Server(url)
+        try:
+            addresses = socket.getaddrinfo(server.host, server.port)
+            logger.debug(
+                "LDAP - warm up resolved {} to {}".format(
+                    url, sorted(set(address[4][0] for address in addresses))
+                )
+            )
+        except OSError as err:
+            logger.error("LDAP - warm up failed to resolve {}: {}".format(url, err))
+            pool.breaker(url).record_failure()
+            warmed = False
+            continue
+
+        conn_managers = []
+        for _ in range(max(instance.connection_pool_min_size, 1)):
+            conn_manager = pool.open_connection(url)
+            if conn_manager is None:
+                break
+            conn_managers.append(conn_manager)
+        if not conn_managers:
+            logger.error("LDAP - warm up failed to connect to {}".format(url))
+            pool.breaker(url).record_failure()
+            warmed = False
+            continue
+
+        if not prefetch_server_info(logger, instance, url, conn_managers[0]):
+            warmed = False
+
+        pool.breaker(url).record_success()
+        for conn_manager in conn_managers:
+            pool.idle.checkin(
+                pool.idle_key(url), conn_manager, instance.connection_pool_max_idle
+            )
+        logger.info(
+            "LDAP - warmed up {} with {} connections".format(url, len(conn_managers))
         )
+    return warmed
 
-        spawner.log.debug(
-            "LDAP - prepared_object_attributes:"
-            " {}".format(prepared_object_attributes)
+
+class LoginSpawner:
+    """Stands in for the spawner of a user that has just logged in, such
+    that the entry can be provisioned before the user spawns.
+
+    The user carries the name and the auth_state items of the
+    authentication as its attributes.
+    """
+
+    def __init__(self, authentication, log):
+        user_attributes = dict(authentication.get("auth_state") or {})
+        user_attributes.update(
+            (key, value) for key, value in authentication.items() if key != "auth_state"
         )
+        self.user = SimpleNamespace(**user_attributes)
+        self.log = log
+        self.name = ""
 
-        if instance.dynamic_attributes and not prepared_object_attributes:
-            spawner.log.error(
-                "LDAP - Failed to setup "
-                "prepared_object_attributes: {} with "
-                "attribute_dict: {}".format(prepared_object_attributes, ldap_dict)
+
+_pre_provisioning = {}
+_pre_provisioning_lock = threading.Lock()
+_pre_provision_executor = None
+
+
+def get_pre_provision_executor():
+    global _pre_provision_executor
+    with _pre_provisioning_lock:
+        if _pre_provision_executor is None:
+            _pre_provision_executor = ThreadPoolExecutor(
+                max_workers=PRE_PROVISION_WORKERS,
+                thread_name_prefix="ldap-pre-provision",
             )
-            return False
+        return _pre_provision_executor
 
-        # Format dn provided variables
-        recursive_format(instance.object_attributes, prepared_object_attributes)
-        spawner.log.debug(
-            "LDAP - prepared object attributes {}".format(instance.object_attributes)
+
+def pre_provision(authentication, log):
+    """Provision the entry of an authenticated user and memoize the
+    result, such that the spawn only has to apply it.
+    """
+    instance = LDAP()
+    instance.memoize_results = True
+    # The deferred_modifications are made by the spawn
+    instance.deferred_modifications = []
+    spawner = LoginSpawner(authentication, log)
+    try:
+        provisioned = setup_ldap_entry(spawner, instance)
+    except Exception as err:
+        log.error(
+            "LDAP - failed to pre-provision: {}, exception: {}".format(
+                spawner.user.name, err
+            )
         )
+        return False
+    if not provisioned:
+        log.warning("LDAP - failed to pre-provision: {}".format(spawner.user.name))
+    return provisioned
 
-        # Add DN
-        spawner.log.info(
-            "LDAP - submit object: {}, attributes: {} "
-            "dn: {}".format(
-                instance.object_classes, instance.object_attributes, ldap_data
+
+def pre_provision_hook(authenticator, handler, authentication):
+    """A post_auth_hook that provisions the entry of the user in the
+    background, without delaying the login response.
+    """
+    if not authentication or "name" not in authentication:
+        return authentication
+    name = authentication["name"]
+    executor = get_pre_provision_executor()
+    # The lookup and the insert are atomic, such that concurrent logins of
+    # a user start a single pre-provisioning
+    with _pre_provisioning_lock:
+        running = _pre_provisioning.get(name)
+        if running is None or running.done():
+            _pre_provisioning[name] = executor.submit(
+                pre_provision, authentication, authenticator.log
             )
+    return authentication
+
+
+async def wait_for_pre_provisioning(name, timeout):
+    """Whether the entry of `name` was pre-provisioned, waiting for at
+    most `timeout` seconds for a pre-provisioning that is still running.
+    The pre-provisioning is consumed, a later spawn provisions in full.
+    """
+    with _pre_provisioning_lock:
+        future = _pre_provisioning.pop(name, None)
+    if future is None:
+        return False
+    try:
+        # A timeout must not cancel a pre-provisioning that is still queued
+        return bool(
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
         )
-        success = add_dn(
-            conn_manager.get_connection(),
-            ",".join([ldap_data, instance.base_dn]),
-            object_class=instance.object_classes,
-            attributes=instance.object_attributes,
+    except asyncio.TimeoutError:
+        return False
+
+
+async def provision_entry(spawner, instance):
+    """Provision the entry of the spawner's user through the broker or the
+    provisioning service if either is configured, or else in this process.
+    """
+    provisioned = await provision_remotely(spawner, instance)
+    if provisioned is not None:
+        return provisioned
+    if await wait_for_pre_provisioning(spawner.user.name, instance.pre_provision_wait):
+        # Apply the result that was memoized at login
+        instance.memoize_results = True
+    return setup_ldap_entry(spawner, instance)
+
+
+def get_submit_data(spawner, instance):
+    """Extract the submitted object string from the spawner by the
+    submit_spawner_attribute path and submit_spawner_attribute_keys,
+    False if it could not be extracted.
+    """
+    if not instance.submit_spawner_attribute:
+        spawner.log.error(
+            "LDAP - either submit_spawner_attribute "
+            "has to define the object which is to be submitted to the LDAP DIT"
         )
-        if not success:
-            result = conn_manager.get_result()
+        return False
+
+    try:
+        ldap_data = attribute_accessor(instance.submit_spawner_attribute)(spawner)
+    except MissingSegment as err:
+        spawner.log.error(
+            "LDAP - The spawner object: {} did not have "
+            "the specified attribute: {}".format(spawner.user.__dict__, err)
+        )
+        return False
+    if not ldap_data:
+        spawner.log.error(
+            "LDAP - The specified attribute: {} of the spawner object: {} "
+            "is empty".format(instance.submit_spawner_attribute, spawner.user.__dict__)
+        )
+        return False
+
+    if isinstance(ldap_data, dict):
+        if not instance.submit_spawner_attribute_keys:
             spawner.log.error(
-                "LDAP - Failed to add {} to {} err: {}".format(
-                    ldap_data, instance.url, result
+                "LDAP - Found attribute: {} in spawner object: "
+                "{}, of type: {}, requires that submit_spawner"
+                "_attribute_keys is set to extract the value "
+                "from the dictionary".format(
+                    instance.submit_spawner_attribute, spawner, type(ldap_data)
                 )
             )
-            # If web enabled render result
             return False
 
-        spawner.log.info(
-            "LDAP - User: {} created: {} "
-            "at: {} with response: {}".format(
-                spawner.user.name, ldap_data, instance.url, conn_manager.get_response()
+        if not isinstance(instance.submit_spawner_attribute_keys, tuple):
+            spawner.log.error(
+                "LDAP - submit_spawner_attribute_keys is "
+                "of incorrect type: {} must be a tuple".format(
+                    type(instance.submit_spawner_attribute_keys)
+                )
+            )
+            return False
+
+        try:
+            new_ldap_data = key_accessor(instance.submit_spawner_attribute_keys)(
+                ldap_data
+            )
+        except MissingSegment as err:
+            spawner.log.error(
+                "LDAP - Failed to extract the specified dict "
+                "tuple string from dict: {}, {}".format(ldap_data, err)
+            )
+            return False
+        if not new_ldap_data:
+            spawner.log.error(
+                "LDAP - Failed to extract the specified dict "
+                "tuple string: {} from dict: {}".format(
+                    instance.submit_spawner_attribute_keys, ldap_data
+                )
+            )
+            return False
+
+        ldap_data = new_ldap_data
+        if not isinstance(ldap_data, str):
+            spawner.log.error(
+                "LDAP - {} is of incorrect type, requires: {} "
+                "found: {}".format(ldap_data, str, type(ldap_data))
             )
+            return False
+    return ldap_data
+
+
+def setup_ldap_entry(spawner, instance, allocator=None):
+    """Provision the LDAP entry of the spawner's user with the settings of
+    `instance`. The values of the search_result_operations are taken from
+    `allocator` if it is given, E.g. an IncrementAllocator.
+    """
+    # TODO, copy entire default config options dynamically
+    instance.dynamic_attributes = copy.deepcopy(instance.dynamic_attributes)
+    instance.set_spawner_attributes = copy.deepcopy(instance.set_spawner_attributes)
+    instance.object_attributes = copy.deepcopy(instance.object_attributes)
+    instance.search_result_operations = copy.deepcopy(instance.search_result_operations)
+    # The settings of this hook, before they are formatted in place, such
+    # that a result is memoized under the settings it was resolved with
+    fingerprint = config_fingerprint(instance)
+
+    logging.basicConfig(filename="client_application.log", level=logging.DEBUG)
+    set_library_log_detail_level(BASIC)
+
+    ldap_data = get_submit_data(spawner, instance)
+    if not ldap_data:
+        note_branch(INVALID)
+        return False
+
+    # Parse spawner user LDAP string to be parsed for submission
+    ldap_data, ldap_dict = prepare_submit_data(spawner, instance, ldap_data)
+
+    if instance.memoize_results:
+        memoized = get_result_memo(instance.entry_cache_size).get(spawner.user.name)
+        if memoized is not None and memoized.matches(fingerprint, ldap_data):
+            if not instance.memoize_validate or validate_memoized_result(
+                instance, spawner.log, memoized
+            ):
+                spawner.log.info(
+                    "LDAP - applying the memoized result of: {}".format(ldap_data)
+                )
+                note_branch(MEMOIZED)
+                return apply_memoized_result(spawner, instance, ldap_dict, memoized)
+
+    mirror = ensure_directory_mirror(instance, spawner.log)
+    if mirror is not None:
+        found = mirror.find(
+            ldap_dict,
+            instance.unique_object_attributes,
+            entry_cache_key(instance, ldap_data),
         )
-        # Check that it exists in the db
-        search_base = instance.base_dn
-        search_filter = "(&{}".format(
-            "".join(
-                [
-                    "(objectclass={})".format(object_class)
-                    for object_class in instance.object_classes
-                ]
+        if found is not None and instance.directory_mirror_confirm:
+            if not confirm_mirrored_entry(instance, spawner.log, found[0]):
+                spawner.log.info(
+                    "LDAP - {} was deleted, removing it from the directory "
+                    "mirror".format(found[0])
+                )
+                mirror.discard(found[0])
+                found = None
+        attributes = found[1] if found is not None else None
+        if attributes:
+            spawner.log.info(
+                "LDAP - {} found in the directory mirror".format(ldap_data)
+            )
+            note_branch(MIRROR)
+            return apply_entry_attributes(
+                spawner, instance, ldap_data, ldap_dict, attributes, fingerprint
+            )
+
+    entry_cache = instance_entry_cache(instance)
+    attributes, stale = lookup_cached_entry(
+        instance, entry_cache, entry_cache_key(instance, ldap_data)
+    )
+    if attributes:
+        if stale:
+            spawner.log.info(
+                "LDAP - {} found stale in the entry cache, refreshing it".format(
+                    ldap_data
+                )
             )
+            revalidate_entry_in_background(instance, spawner.log, ldap_data, ldap_dict)
+            note_branch(STALE_CACHE)
+        else:
+            spawner.log.info("LDAP - {} found in the entry cache".format(ldap_data))
+            note_branch(CACHE)
+        return apply_entry_attributes(
+            spawner, instance, ldap_data, ldap_dict, attributes, fingerprint
         )
 
-        search_filter += "{})".format(
-            "".join(
-                [
-                    "({}={})".format(attr_key, attr_val)
-                    for attr_key, attr_val in instance.object_attributes.items()
-                ]
+    deadline = Deadline(instance.hook_timeout)
+    note_deadline(deadline)
+    pool = new_server_pool(instance, spawner.log, deadline)
+    try:
+        pool.reader()
+    except DeadlineExceeded as err:
+        spawner.log.error("LDAP - {}".format(err))
+        return False
+    except ServerUnavailable as err:
+        # The servers that were connected to before, E.g. as the trial of a
+        # half-open breaker, did not fail
+        pool.record_success()
+        # Every server is either down or has an open circuit breaker
+        attributes = entry_cache.get(
+            entry_cache_key(instance, ldap_data),
+            max_age=instance.entry_cache_max_age,
+        )
+        if attributes:
+            spawner.log.warning(
+                "LDAP - {}, using cached attributes of: {}".format(err, ldap_data)
+            )
+            note_branch(UNAVAILABLE_CACHE)
+            return apply_entry_attributes(
+                spawner, instance, ldap_data, ldap_dict, attributes, fingerprint
             )
+        note_branch(UNAVAILABLE)
+        spawner.log.error("LDAP - {}, no cached entry of: {}".format(err, ldap_data))
+        return False
+
+    try:
+        provisioned = provision_ldap_entry(
+            spawner,
+            instance,
+            pool,
+            ldap_data,
+            ldap_dict,
+            deadline,
+            entry_cache,
+            fingerprint,
+            allocator=allocator,
         )
-        spawner.log.debug(
-            "LDAP - search_for, "
-            "search_base {}, search_filter {}".format(search_base, search_filter)
+        pool.record_success()
+        return provisioned
+    except DeadlineExceeded as err:
+        pool.record_failure(pool.current)
+        spawner.log.error("LDAP - {}".format(err))
+        return False
+    except ServerUnavailable as err:
+        pool.record_success()
+        spawner.log.error("LDAP - {}".format(err))
+        return False
+    except LDAPException as err:
+        pool.record_failure(pool.current)
+        # A socket timeout derived from the deadline surfaces as an
+        # LDAPException, report it as the step that overran
+        if not deadline.expired():
+            raise
+        spawner.log.error("LDAP - {}, exception: {}".format(deadline.exceeded(), err))
+        return False
+    finally:
+        pool.disconnect()
+
+
+def provision_group_memberships(spawner, instance, pool, deadline, attributes):
+    """Add the entry to the groups of group_memberships that it is not
+    a member of yet. Failures are logged, but don't fail the spawn.
+    """
+    if not instance.group_memberships:
+        return True
+    group_memberships = copy.deepcopy(instance.group_memberships)
+    recursive_format(group_memberships, attributes)
+    memberships = format_group_memberships(spawner.log, group_memberships)
+    if not memberships:
+        return False
+
+    conn_manager, search_limits = prepare_operation(
+        instance, pool, deadline, "group membership search"
+    )
+    present = existing_memberships(
+        conn_manager.get_connection(), memberships, **search_limits
+    )
+    missing = [
+        membership for membership in memberships if membership[0].lower() not in present
+    ]
+    spawner.log.debug(
+        "LDAP - adding the memberships: {}, already present in: {}".format(
+            missing, present
         )
-        success = search_for(
-            conn_manager.get_connection(),
-            search_base,
-            search_filter,
-            attributes=ALL_ATTRIBUTES,
+    )
+    if not missing:
+        return True
+
+    if instance.group_memberships_deferred:
+        queue = ensure_write_behind_queue(instance, spawner.log)
+        for group_dn, attribute, value in missing:
+            queue.put(group_dn, {attribute: [(MODIFY_ADD, [value])]})
+        return True
+
+    deadline.step("group membership modify")
+    # The steps of each concurrent modify are recorded on a child deadline
+    return add_memberships(
+        lambda: new_server_pool(instance, spawner.log, deadline.child()),
+        spawner.log,
+        missing,
+    )
+
+
+def search_attribute_query(logger, pool, conn_manager, query):
+    """The attributes of the single entry that `query` finds,
+    False if it finds none or several.
+    """
+    search_filter = query.get("search_filter", "")
+    conn_manager, success = pool.search(
+        conn_manager,
+        query.pop("search_base", ""),
+        query.pop("search_filter", ""),
+        **query
+    )
+    if not success:
+        logger.error(
+            "LDAP - failed to use the query: {} "
+            "for extracting attributes, response was:"
+            "{}".format(query, conn_manager.get_response())
+        )
+        return False
+
+    # get responses
+    response = conn_manager.get_response()
+    if len(response) > 1:
+        logger.error(
+            "LDAP - multiple entries: {} "
+            "were found with: {}".format(response, search_filter)
+        )
+        return False
+    return conn_manager.get_response_attributes()
+
+
+def paged_search_attribute_query(logger, conn_manager, query, page_size, reducers):
+    """Stream the entries of `query` page by page, and reduce them into
+    attributes with `reducers`. Without reducers the query must find a
+    single entry. Returns None if the query fails.
+    """
+    try:
+        reducers = parse_reducers(reducers or {})
+    except ValueError as err:
+        logger.error("LDAP - {} in search_attribute_queries: {}".format(err, query))
+        return None
+
+    search_base = query.pop("search_base")
+    search_filter = query.pop("search_filter")
+    entries = paged_search_for(
+        conn_manager.get_connection(),
+        search_base,
+        search_filter,
+        page_size=page_size,
+        **query
+    )
+    if reducers:
+        attributes = reduce_entries(entries, reducers)
+    else:
+        attributes = None
+        for dn, entry_attributes in entries:
+            if attributes is not None:
+                logger.error(
+                    "LDAP - multiple entries were found with: {}, "
+                    "declare reducers to aggregate them".format(search_filter)
+                )
+                return None
+            attributes = dict(entry_attributes)
+        if attributes is None:
+            logger.error(
+                "LDAP - no entry was found with the query: {}".format(search_filter)
+            )
+            return None
+
+    result = conn_manager.get_result()
+    if result and result["result"] != RESULT_SUCCESS:
+        logger.error(
+            "LDAP - the paged query: {} failed, result: {}".format(
+                search_filter, result
+            )
+        )
+        return None
+    return attributes
+
+
+def provision_ldap_entry(
+    spawner,
+    instance,
+    pool,
+    ldap_data,
+    ldap_dict,
+    deadline,
+    entry_cache,
+    fingerprint,
+    allocator=None,
+):
+    # Check objectclasses support
+    conn_manager, search_limits = prepare_operation(
+        instance, pool, deadline, "objectClasses schema search"
+    )
+    schema_cache = get_schema_cache()
+    object_classes = schema_cache.get(conn_manager.url)
+    if object_classes is None:
+        conn_manager, success = pool.search(
+            conn_manager,
+            "cn=Subschema",
+            "(objectClass=Subschema)",
+            search_scope=BASE,
+            attributes=["objectClasses"],
+            **search_limits
         )
+        response = conn_manager.get_response()
         if not success:
             spawner.log.error(
-                "Failed to find {} at {}".format(
-                    (search_base, search_filter), instance.url
-                )
+                "LDAP - failed to query for "
+                "supported objectClasses {}".format(response)
             )
             return False
+
+        spawner.log.debug("LDAP - supported objectClasses {}".format(response))
+        object_classes = get_response_object_classes(response)
+        schema_cache.set(conn_manager.url, object_classes)
+
+    if not check_object_classes(spawner.log, instance.object_classes, object_classes):
+        return False
+
+    # LDAP, check for unique attributes that should not be duplicated
+    search_filter = existing_entry_filter(instance, ldap_dict)
+    spawner.log.debug("LDAP - unique_check, search_filter: {}".format(search_filter))
+    # Check whether dn already exists
+    conn_manager, search_limits = prepare_operation(
+        instance, pool, deadline, "existing entry search"
+    )
+    conn_manager, success = pool.search(
+        conn_manager,
+        instance.base_dn,
+        search_filter,
+        attributes=entry_attributes(instance, conn_manager),
+        **search_limits
+    )
+    if success:
+        note_branch(EXISTING)
         spawner.log.info(
-            "LDAP - found {} in {}".format(conn_manager.get_response(), instance.url)
+            "LDAP - {} already exist, response {}".format(
+                ldap_dict, conn_manager.get_response()
+            )
         )
 
         response = conn_manager.get_response()
         if len(response) > 1:
             spawner.log.error(
-                "LDAP - multiple entries: {} were found with:"
-                " {}".format(response, search_filter)
+                "LDAP - multiple entries: {} "
+                "were found with: {}".format(response, search_filter)
             )
             return False
 
         attributes = conn_manager.get_response_attributes()
-        # TODO, validate all the attributes are as expected
         if not attributes:
             spawner.log.error(
                 "LDAP - No attributes were returned from "
-                "existing dn: {} with search_filer: {}".format(ldap_data, search_filter)
+                "existing dn: {} "
+                "with search_filer: {}".format(ldap_data, search_filter)
             )
             return False
 
-        sources.update(
-            {
-                LDAP_SEARCH_ATTRIBUTE_QUERY: attributes,
-                LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY: attributes,
-            }
-        )
-        prepared_spawner_attributes = get_interpolated_dynamic_attributes(
-            spawner.log, sources, instance.dynamic_attributes
+        spawner.log.info("LDAP - Retrived attributes {}".format(attributes))
+        attributes = compact_entry(response[0]["dn"], attributes)
+        entry_cache.set(entry_cache_key(instance, ldap_data), attributes)
+        if instance.group_memberships:
+            # Restore the memberships that the entry was removed from
+            dynamic_attributes = get_interpolated_dynamic_attributes(
+                spawner.log,
+                entry_sources(spawner, ldap_dict, attributes),
+                instance.dynamic_attributes,
+            )
+            provision_group_memberships(
+                spawner,
+                instance,
+                pool,
+                deadline,
+                dict(dynamic_attributes or {}, dn=attributes.dn),
+            )
+        return apply_entry_attributes(
+            spawner, instance, ldap_data, ldap_dict, attributes, fingerprint
         )
 
-        recursive_format(instance.set_spawner_attributes, prepared_spawner_attributes)
+    # Create new DIT entry
+    note_branch(CREATED)
+    # Get extract variables
+    sources = {}
+    for q in instance.search_attribute_queries:
+        query = copy.deepcopy(q)
+        spawner.log.debug("LDAP - extract search_attribute_query: {}".format(query))
+        if "search_base" not in query or "search_filter" not in query:
+            spawner.log.error(
+                "LDAP - search_base or search_filter "
+                "is missing from search_attribute_queries: "
+                "{}".format(query)
+            )
+            return False
+        page_size = query.pop("page_size", None)
+        reducers = query.pop("reducers", None)
+        # Values that are subsequently modified are read from the provider
+        modifies = set(query.get("attributes") or []) | set(reducers or [])
+        modifies &= set(instance.search_result_operations)
+        conn_manager, search_limits = prepare_operation(
+            instance,
+            pool,
+            deadline,
+            "search_attribute_query",
+            write=bool(modifies),
+        )
+        for limit_key, limit_value in search_limits.items():
+            query.setdefault(limit_key, limit_value)
+        if page_size or reducers:
+            attributes = paged_search_attribute_query(
+                spawner.log,
+                conn_manager,
+                query,
+                page_size or SEARCH_ATTRIBUTE_QUERY_PAGE_SIZE,
+                reducers,
+            )
+            if attributes is None:
+                return False
+        else:
+            attributes = search_attribute_query(spawner.log, pool, conn_manager, query)
+            if attributes is False:
+                return False
         spawner.log.debug(
-            "LDAP - formatted set_spawner_attributes: "
-            "{} for the new entry: {}".format(
-                instance.set_spawner_attributes, attributes
+            "LDAP - search_attribute_queries " "attributes: {}".format(attributes)
+        )
+        if attributes:
+            # Perform search_result_operations
+            operations = [
+                (instance.search_result_operations[attr_key], attr_key, attr_val)
+                for attr_key, attr_val in attributes.items()
+                if attr_key in instance.search_result_operations
+            ]
+            if operations:
+                write_manager, _ = prepare_operation(
+                    instance,
+                    pool,
+                    deadline,
+                    "search_result_operation on {}".format(
+                        ", ".join(attr_key for _, attr_key, _ in operations)
+                    ),
+                    write=True,
+                )
+                if allocator is not None:
+                    post_operation_vals = {}
+                    for operation, attr_key, attr_val in operations:
+                        post_operation_vals[attr_key] = allocator.allocate(
+                            spawner.log, write_manager, operation, attr_key, attr_val
+                        )
+                        if not post_operation_vals[attr_key]:
+                            break
+                else:
+                    post_operation_vals = perform_search_result_operations(
+                        spawner.log, write_manager, instance.base_dn, operations
+                    )
+                for _, attr_key, _ in operations:
+                    post_operation_val = (post_operation_vals or {}).get(attr_key)
+                    if not post_operation_val:
+                        spawner.log.error(
+                            "LDAP - Failed to get "
+                            "a valid result from "
+                            "perform_search_result_operation"
+                        )
+                        return False
+                    attributes[attr_key] = post_operation_val
+                    # Every incremented value is available to the entry
+                    for source in (
+                        LDAP_SEARCH_ATTRIBUTE_QUERY,
+                        LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY,
+                    ):
+                        sources.setdefault(source, {})[attr_key] = post_operation_val
+
+            ldap_dict.update(attributes)
+
+    # Prepare required dynamic attributes
+    sources.update(
+        {
+            SPAWNER_SUBMIT_DATA: ldap_dict,
+            SPAWNER_ATTRIBUTE: spawner,
+            SPAWNER_USER_ATTRIBUTE: spawner.user,
+        }
+    )
+    spawner.log.debug(
+        "LDAP - Sources state before interpolation "
+        "with dynamic attributes {}".format(sources)
+    )
+
+    prepared_object_attributes = get_interpolated_dynamic_attributes(
+        spawner.log, sources, instance.dynamic_attributes
+    )
+
+    spawner.log.debug(
+        "LDAP - prepared_object_attributes:" " {}".format(prepared_object_attributes)
+    )
+
+    if instance.dynamic_attributes and not prepared_object_attributes:
+        spawner.log.error(
+            "LDAP - Failed to setup "
+            "prepared_object_attributes: {} with "
+            "attribute_dict: {}".format(prepared_object_attributes, ldap_dict)
+        )
+        return False
+
+    # Format dn provided variables
+    recursive_format(instance.object_attributes, prepared_object_attributes)
+    spawner.log.debug(
+        "LDAP - prepared object attributes {}".format(instance.object_attributes)
+    )
+
+    # Add DN
+    spawner.log.info(
+        "LDAP - submit object: {}, attributes: {} "
+        "dn: {}".format(instance.object_classes, instance.object_attributes, ldap_data)
+    )
+    conn_manager, _ = prepare_operation(
+        instance, pool, deadline, "add entry", write=True
+    )
+    with pool.measure(conn_manager):
+        success = add_dn(
+            conn_manager.get_connection(),
+            ",".join([ldap_data, instance.base_dn]),
+            object_class=instance.object_classes,
+            attributes=instance.object_attributes,
+        )
+    if not success:
+        result = conn_manager.get_result()
+        spawner.log.error(
+            "LDAP - Failed to add {} to {} err: {}".format(
+                ldap_data, conn_manager.url, result
             )
         )
-        # Pass prepared attributes to spawner attributes
-        update_spawner_attributes(spawner, instance.set_spawner_attributes)
-        return True
-    else:
-        spawner.log.error("LDAP - Failed to connect to {}".format(instance.url))
+        # If web enabled render result
+        return False
+
+    spawner.log.info(
+        "LDAP - User: {} created: {} "
+        "at: {} with response: {}".format(
+            spawner.user.name, ldap_data, conn_manager.url, conn_manager.get_response()
+        )
+    )
+    # Check that it exists in the db
+    search_base = instance.base_dn
+    search_filter = "(&{}".format(
+        "".join(
+            [
+                "(objectclass={})".format(object_class)
+                for object_class in instance.object_classes
+            ]
+        )
+    )
+
+    search_filter += "{})".format(
+        "".join(
+            [
+                "({}={})".format(attr_key, attr_val)
+                for attr_key, attr_val in instance.object_attributes.items()
+            ]
+        )
+    )
+    spawner.log.debug(
+        "LDAP - search_for, "
+        "search_base {}, search_filter {}".format(search_base, search_filter)
+    )
+    conn_manager, search_limits = prepare_operation(
+        instance, pool, deadline, "created entry search"
+    )
+    conn_manager, success = pool.search(
+        conn_manager,
+        search_base,
+        search_filter,
+        attributes=entry_attributes(instance, conn_manager),
+        **search_limits
+    )
+    if not success:
+        spawner.log.error(
+            "Failed to find {} at {}".format(
+                (search_base, search_filter), conn_manager.url
+            )
+        )
+        return False
+    spawner.log.info(
+        "LDAP - found {} in {}".format(conn_manager.get_response(), conn_manager.url)
+    )
+
+    response = conn_manager.get_response()
+    if len(response) > 1:
+        spawner.log.error(
+            "LDAP - multiple entries: {} were found with:"
+            " {}".format(response, search_filter)
+        )
         return False
 
-    return None
+    attributes = conn_manager.get_response_attributes()
+    # TODO, validate all the attributes are as expected
+    if not attributes:
+        spawner.log.error(
+            "LDAP - No attributes were returned from "
+            "existing dn: {} with search_filer: {}".format(ldap_data, search_filter)
+        )
+        return False
+
+    attributes = compact_entry(response[0]["dn"], attributes)
+    entry_cache.set(entry_cache_key(instance, ldap_data), attributes)
+    sources.update(
+        {
+            LDAP_SEARCH_ATTRIBUTE_QUERY: attributes,
+            LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY: attributes,
+        }
+    )
+    prepared_spawner_attributes = get_interpolated_dynamic_attributes(
+        spawner.log, sources, instance.dynamic_attributes
+    )
+
+    recursive_format(instance.set_spawner_attributes, prepared_spawner_attributes)
+    spawner.log.debug(
+        "LDAP - formatted set_spawner_attributes: "
+        "{} for the new entry: {}".format(instance.set_spawner_attributes, attributes)
+    )
+    remember_result(
+        spawner,
+        instance,
+        fingerprint,
+        ldap_data,
+        attributes,
+        prepared_spawner_attributes,
+    )
+    defer_modifications(
+        instance, spawner.log, attributes.dn, prepared_spawner_attributes
+    )
+    provision_group_memberships(
+        spawner,
+        instance,
+        pool,
+        deadline,
+        dict(prepared_spawner_attributes or {}, dn=attributes.dn),
+    )
+    # Pass prepared attributes to spawner attributes
+    update_spawner_attributes(spawner, instance.set_spawner_attributes)
+    return True
@@ -1,3 +1,365 @@
+import asyncio
+import threading
+from ldap3 import ASYNC, Server, Connection
+from ldap3.core.exceptions import (
+    LDAPException,
+    LDAPResponseTimeoutError,
+    LDAPSessionTerminatedByServerError,
+)
+from ldap3.core.results import RESULT_SUCCESS
+from ldap3.strategy.base import RESPONSE_COMPLETE
+
+
+class ConnectionManager:
+    def __init__(self, url, logger=None, **connection_args):
+        if url is None:
+            raise TypeError("url argument must be provided")
+
+        if not isinstance(url, str) or not url:
+            raise ValueError("url must be a non zero length string")
+
+        if connection_args and not isinstance(connection_args, dict):
+            raise TypeError("con    nection_args must be a dictionary")
+
+        self.url = url
+        self.logger = logger
+        self.connection_args = connection_args
+        self.connection = None
+        self.connected = False
+        self.operation_timeout = None
+
+    def connect(self, **kwargs):
+        server = Server(self.url, **kwargs)
+        try:
+            if self.connection_args:
+                # Can be Anonymous if both 'user' and 'password' are None
+                self.connection = Connection(server, **self.connection_args)
+            else:
+                # Anonymous login
+                self.connection = Connection(server)
+        except LDAPException as err:
+            self.connected = False
+            if (
+                self.logger is not None
+                and getattr(self.logger, "error", None)
+                and callable(self.logger.error)
+            ):
+                self.logger.error(
+                    "LDAP - Failed to create a connection, " "exception: {}".format(err)
+                )
+            return None
+
+        try:
+            self.connected = self.connection.bind()
+            if not self.connected:
+                if (
+                    self.logger is not None
+                    and getattr(self.logger, "error", None)
+                    and callable(self.logger.error)
+                ):
+                    self.logger.error(
+                        "LDAP - bind executed without error, "
+                        "but bind still failed: {}".format(self.connected)
+                    )
+        except LDAPException as err:
+            self.connected = False
+            if (
+                self.logger is not None
+                and getattr(self.logger, "error", None)
+                and callable(self.logger.error)
+            ):
+                self.logger.error(
+                    "LDAP - Failed to bind connection, " "exception: {}".format(err)
+                )
+            return None
+
+    def is_connected(self):
+        return self.connected
+
+    def set_operation_timeout(self, timeout):
+        """Limit the time that the next operation can wait for
+        its response on the connection socket.
+        """
+        self.operation_timeout = timeout
+        if not self.connection:
+            return
+        socket = getattr(self.connection, "socket", None)
+        if socket is not None:
+            socket.settimeout(timeout)
+
+    def get_connection(self):
+        return self.connection
+
+    def change_connection_user(self, **user_args):
+        try:
+            self.connection = self.connection.rebind(user_args)
+        except LDAPException as err:
+            if (
+                self.logger is not None
+                and getattr(self.logger, "error", None)
+                and callable(self.logger.error)
+            ):
+                self.logger.error(
+                    "LDAP - Failed to rebind connection, " "exception: {}".format(err)
+                )
+
+    def disconnect(self):
+        if not self.connection:
+            return
+        try:
+            if self.connection.unbind():
+                self.connected = False
+        except LDAPException as err:
+            self.connected = False
+            if (
+                self.logger is not None
+                and getattr(self.logger, "error", None)
+                and callable(self.logger.error)
+            ):
+                self.logger.error(
+                    "LDAP - Failed to unbind connection, " "exception: {}".format(err)
+                )
+
+    def get_response(self):
+        return self.connection.response
+
+    def get_response_attributes(self):
+        return response_attributes(self.get_response())
+
+    def get_result(self):
+        return self.connection.result
+
+
+def response_attributes(response):
+    """The attributes of the single entry of `response`,
+    None if it holds no or multiple entries.
+    """
+    entry_attributes = {}
+    if not response:
+        return None
+
+    dn = None
+    for entry in response:
+        if not dn:
+            dn = entry["dn"]
+        if "attributes" in entry:
+            # Multiple dn's, fail
+            if dn != entry["dn"]:
+                return None
+            entry_attributes.update({entry["dn"]: entry["attributes"]})
+    return entry_attributes[dn]
+
+
+class ResponseFutures:
+    """Resolves an asyncio future for each message ID of an ldap3
+    asynchronous strategy, once the receiver thread of the connection has
+    read the complete response of it.
+    """
+
+    def __init__(self, strategy, loop):
+        self.strategy = strategy
+        self.loop = loop
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._set_event_for_message = strategy.set_event_for_message
+        self._close = strategy.close
+        # The receiver thread calls these through the strategy instance
+        strategy.set_event_for_message = self.set_event_for_message
+        strategy.close = self.close
+
+    def _complete(self, message_id):
+        with self.strategy.async_lock:
+            responses = self.strategy._responses.get(message_id)
+        if responses is None:
+            return False
+        # The mock strategies store the complete response at once
+        return isinstance(responses, tuple) or responses[-1] == RESPONSE_COMPLETE
+
+    def watch(self, message_id):
+        """A future that is resolved when the response of
+        `message_id` is complete.
+        """
+        future = self.loop.create_future()
+        with self._lock:
+            if self._complete(message_id):
+                future.set_result(message_id)
+            else:
+                self._futures[message_id] = future
+        return future
+
+    def forget(self, message_id):
+        with self._lock:
+            self._futures.pop(message_id, None)
+
+    def set_event_for_message(self, message_id):
+        self._set_event_for_message(message_id)
+        with self._lock:
+            future = self._futures.pop(message_id, None)
+        if future is not None:
+            self.loop.call_soon_threadsafe(_resolve_future, future, message_id)
+
+    def close(self):
+        self._close()
+        with self._lock:
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            self.loop.call_soon_threadsafe(
+                _fail_future,
+                future,
+                LDAPSessionTerminatedByServerError("the connection was closed"),
+            )
+
+
+def _resolve_future(future, message_id):
+    if not future.done():
+        future.set_result(message_id)
+
+
+def _fail_future(future, err):
+    if not future.done():
+        future.set_exception(err)
+
+
+class OperationResult:
+    """The response and result of a single asynchronous operation."""
+
+    __slots__ = ("message_id", "response", "result")
+
+    def __init__(self, message_id, response, result):
+        self.message_id = message_id
+        self.response = response
+        self.result = result
+
+    @property
+    def success(self):
+        """Whether the operation succeeded, where a search only succeeds
+        if it found an entry, as with a synchronous connection.
+        """
+        if not self.result or self.result["result"] != RESULT_SUCCESS:
+            return False
+        if self.result.get("type") == "searchResDone":
+            return len(self.response) > 0
+        return True
+
+    def get_response_attributes(self):
+        return response_attributes(self.response)
+
+
+class AsyncConnectionManager:
+    """An asyncio sibling of ConnectionManager, on the ldap3 ASYNC strategy.
+
+    Each operation is sent with its own message ID and awaited until the
+    receiver thread of the connection has read its response, such that
+    many operations can be in flight on a single connection. Every
+    operation returns its own OperationResult, rather than the shared
+    response and result of the connection.
+    """
+
+    def __init__(self, url, logger=None, **connection_args):
+        if url is None:
+            raise TypeError("url argument must be provided")
+
+        if not isinstance(url, str) or not url:
+            raise ValueError("url must be a non zero length string")
+
+        self.url = url
+        self.logger = logger
+        self.connection_args = connection_args
+        self.connection = None
+        self.connected = False
+        self.operation_timeout = None
+        self.futures = None
+
+    def _log_error(self, message):
+        if (
+            self.logger is not None
+            and getattr(self.logger, "error", None)
+            and callable(self.logger.error)
+        ):
+            self.logger.error(message)
+
+    async def connect(self, **kwargs):
+        loop = asyncio.get_running_loop()
+        server = Server(self.url, **kwargs)
+        connection_args = dict(client_strategy=ASYNC)
+        connection_args.update(self.connection_args)
+        try:
+            self.connection = Connection(server, **connection_args)
+        except LDAPException as err:
+            self.connected = False
+            self._log_error(
+                "LDAP - Failed to create a connection, exception: {}".format(err)
+            )
+            return None
+
+        self.futures = ResponseFutures(self.connection.strategy, loop)
+        try:
+            # Opening the socket and the bind are blocking in ldap3
+            self.connected = await loop.run_in_executor(None, self.connection.bind)
+            if not self.connected:
+                self._log_error(
+                    "LDAP - bind executed without error, "
+                    "but bind still failed: {}".format(self.connected)
+                )
+        except LDAPException as err:
+            self.connected = False
+            self._log_error(
+                "LDAP - Failed to bind connection, exception: {}".format(err)
+            )
+            return None
+
+    def is_connected(self):
+        return self.connected
+
+    def set_operation_timeout(self, timeout):
+        """Limit the time that the subsequent operations wait for
+        their response.
+        """
+        self.operation_timeout = timeout
+
+    def get_connection(self):
+        return self.connection
+
+    async def _complete(self, message_id, timeout):
+        if timeout is None:
+            timeout = self.operation_timeout
+        try:
+            await asyncio.wait_for(self.futures.watch(message_id), timeout)
+        except asyncio.TimeoutError:
+            self.futures.forget(message_id)
+            self.connection.abandon(message_id)
+            self.connection.strategy._outstanding.pop(message_id, None)
+            raise LDAPResponseTimeoutError(
+                "no response from server within {} seconds".format(timeout)
+            )
+        response, result = self.connection.get_response(message_id, timeout=0)
+        return OperationResult(message_id, response, result)
+
+    async def search(self, search_base, search_filter, timeout=None, **kwargs):
+        message_id = self.connection.search(search_base, search_filter, **kwargs)
+        return await self._complete(message_id, timeout)
+
+    async def add(self, dn, timeout=None, **kwargs):
+        message_id = self.connection.add(dn, **kwargs)
+        return await self._complete(message_id, timeout)
+
+    async def modify(self, dn, changes, timeout=None, controls=None):
+        message_id = self.connection.modify(dn, changes, controls=controls)
+        return await self._complete(message_id, timeout)
+
+    async def disconnect(self):
+        if not self.connection:
+            return
+        try:
+            if self.connection.unbind():
+                self.connected = False
+        except LDAPException as err:
+            self.connected = False
+            self._log_error(
+                "LDAP - Failed to unbind connection, exception: {}".format(err)
+            )
+
+
 def add_dn(connection, dn, **kwargs):
     return connection.add(dn, **kwargs)
 
@@ -8,3 +370,18 @@ def modify_dn(connection, dn, changes, controls=None):
 
 def search_for(connection, search_base, search_filter, **kwargs):
     return connection.search(search_base, search_filter, **kwargs)
+
+
+def paged_search_for(
+    connection, search_base, search_filter, page_size=500, raw=False, **kwargs
+):
+    """Yield the (dn, attributes) of every entry that matches, one page
+    of page_size entries is held in memory at a time. With `raw` the
+    attribute values are the bytes that the server returned.
+    """
+    attributes_key = "raw_attributes" if raw else "attributes"
+    for entry in connection.extend.standard.paged_search(
+        search_base, search_filter, paged_size=page_size, generator=True, **kwargs
+    ):
+        if entry.get("type") == "searchResEntry":
+            yield entry["dn"], entry[attributes_key]
@@ -0,0 +1,382 @@
+"""Export the entries that the hook manages to LDIF, and import them again.
+
+    ldap-hooks-ldif --config jupyterhub_config.py export entries.ldif
+    ldap-hooks-ldif --config jupyterhub_config.py import entries.ldif
+
+The export reads the entries below base_dn with the configured
+object_classes with a paged search, and writes their objectClass and
+object_attributes as they are read. The import adds the entries in
+batches over concurrent pooled connections.
+"""
+
+import argparse
+import base64
+import logging
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from ldap3 import ALL_ATTRIBUTES, SUBTREE
+from ldap3.core.exceptions import LDAPException
+from .bulk import FAILED, SKIPPED, Progress, load_config
+from .hooks import LDAP, new_server_pool, object_class_filter
+from .ldap import add_dn, paged_search_for
+from .pool import ServerUnavailable
+
+EXPORTED = "exported"
+ADDED = "added"
+LDIF_LINE_LENGTH = 76
+# The result of an add whose parent has not been added yet
+NO_SUCH_OBJECT = "noSuchObject"
+ENTRY_ALREADY_EXISTS = "entryAlreadyExists"
+
+
+class UnsupportedLDIF(ValueError):
+    """The LDIF stream uses a feature that read_ldif does not support."""
+
+
+def is_safe_string(value):
+    """Whether `value` is an RFC 2849 SAFE-STRING that can be written
+    without base64 encoding.
+    """
+    if not value:
+        return True
+    if value[0] in b" :<" or value[-1:] == b" ":
+        return False
+    return all(0 < char < 128 and char not in (10, 13) for char in value)
+
+
+def ldif_line(name, value):
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    if is_safe_string(value):
+        return "{}: {}".format(name, value.decode("ascii"))
+    return "{}:: {}".format(name, base64.b64encode(value).decode("ascii"))
+
+
+def fold(line):
+    """Fold `line` into lines of at most LDIF_LINE_LENGTH characters."""
+    yield line[:LDIF_LINE_LENGTH]
+    step = LDIF_LINE_LENGTH - 1
+    for start in range(LDIF_LINE_LENGTH, len(line), step):
+        end = start + step
+        yield " " + line[start:end]
+
+
+def format_ldif_entry(dn, attributes):
+    lines = [ldif_line("dn", dn)]
+    for name, values in attributes.items():
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        lines.extend(ldif_line(name, value) for value in values)
+    return "".join(folded + "\n" for line in lines for folded in fold(line))
+
+
+def read_ldif(stream):
+    """Yield the (dn, attributes) of the content records of an LDIF stream,
+    one record at a time. Base64 encoded values are returned as bytes,
+    values that refer to a URL and change records other than add raise
+    UnsupportedLDIF.
+    """
+    record = []
+
+    def parse(lines):
+        dn, attributes = None, {}
+        for line in lines:
+            name, _, value = line.partition(":")
+            if value.startswith(":"):
+                value = base64.b64decode(value[1:].strip())
+            elif value.startswith("<"):
+                raise UnsupportedLDIF(
+                    "the value of {} refers to the URL: {}, which is not "
+                    "supported, inline the value instead".format(
+                        name, value[1:].strip()
+                    )
+                )
+            else:
+                # A SAFE-STRING does not start with a space
+                value = value.lstrip(" ")
+            if name.lower() == "dn":
+                dn = value.decode("utf-8") if isinstance(value, bytes) else value
+            elif name.lower() == "changetype":
+                if value.strip().lower() != "add":
+                    raise UnsupportedLDIF(
+                        "the record of {} has changetype: {}, only content and "
+                        "add records are supported".format(dn, value.strip())
+                    )
+            else:
+                attributes.setdefault(name, []).append(value)
+        return dn, attributes
+
+    for line in stream:
+        line = line.rstrip("\r\n")
+        if line.startswith(" ") and record:
+            record[-1] += line[1:]
+        elif line.startswith("#"):
+            continue
+        elif not line:
+            if record:
+                dn, attributes = parse(record)
+                if dn is not None:
+                    yield dn, attributes
+                record = []
+        elif not record and line.lower().startswith("version:"):
+            continue
+        else:
+            record.append(line)
+    if record:
+        dn, attributes = parse(record)
+        if dn is not None:
+            yield dn, attributes
+
+
+def managed_attributes(instance):
+    """The attributes of the entries that the hook creates."""
+    if not instance.object_attributes:
+        return ALL_ATTRIBUTES
+    return ["objectClass"] + sorted(instance.object_attributes)
+
+
+def export_ldif(
+    instance,
+    stream,
+    logger=None,
+    page_size=500,
+    all_attributes=False,
+    report_interval=10.0,
+):
+    """Write the entries that the hook manages to `stream` as LDIF."""
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    progress = Progress(
+        logger, interval=report_interval, statuses=(EXPORTED,), unit="entries"
+    )
+    attributes = ALL_ATTRIBUTES if all_attributes else managed_attributes(instance)
+    pool = new_server_pool(instance, logger)
+    try:
+        conn_manager = pool.reader()
+        stream.write("version: 1\n\n")
+        for dn, entry_attributes in paged_search_for(
+            conn_manager.get_connection(),
+            instance.base_dn,
+            object_class_filter(instance.object_classes),
+            page_size=page_size,
+            raw=True,
+            search_scope=SUBTREE,
+            attributes=attributes,
+        ):
+            stream.write(format_ldif_entry(dn, entry_attributes) + "\n")
+            progress.add(EXPORTED)
+        pool.record_success()
+    except (ServerUnavailable, LDAPException):
+        pool.record_failure(pool.current)
+        raise
+    finally:
+        pool.disconnect()
+    progress.report()
+    return progress
+
+
+def add_entries(instance, logger, entries):
+    """Add a batch of entries over a single pooled connection. Returns the
+    outcome of each entry, the ones whose parent does not exist yet are
+    returned to be retried.
+    """
+    outcomes, retry = {ADDED: 0, SKIPPED: 0, FAILED: 0}, []
+    pool = new_server_pool(instance, logger)
+    try:
+        conn_manager = pool.writer()
+        connection = conn_manager.get_connection()
+        for dn, attributes in entries:
+            attributes = dict(attributes)
+            object_class = attributes.pop("objectClass", None)
+            if add_dn(connection, dn, object_class=object_class, attributes=attributes):
+                outcomes[ADDED] += 1
+                continue
+            description = connection.result.get("description")
+            if description == ENTRY_ALREADY_EXISTS:
+                outcomes[SKIPPED] += 1
+            elif description == NO_SUCH_OBJECT:
+                retry.append((dn, dict(attributes, objectClass=object_class)))
+            else:
+                logger.error(
+                    "LDAP - failed to add {} err: {}".format(dn, connection.result)
+                )
+                outcomes[FAILED] += 1
+        pool.record_success()
+    except (ServerUnavailable, LDAPException) as err:
+        pool.record_failure(pool.current)
+        logger.error("LDAP - failed to add a batch, exception: {}".format(err))
+        outcomes[FAILED] += len(entries) - sum(outcomes.values()) - len(retry)
+    finally:
+        pool.disconnect()
+    return outcomes, retry
+
+
+def batches(entries, batch_size):
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def retry_entries(instance, logger, retry, progress):
+    """Add the `retry` entries again until a round adds none of them,
+    returns the entries whose parent still does not exist.
+    """
+    while retry:
+        outcomes, still_missing = add_entries(instance, logger, retry)
+        for status, count in outcomes.items():
+            progress.add(status, count)
+        if len(still_missing) == len(retry):
+            return still_missing
+        retry = still_missing
+    return []
+
+
+def fail_missing_parents(logger, entries, progress):
+    for dn, _ in entries:
+        logger.error("LDAP - the parent of {} does not exist".format(dn))
+    progress.add(FAILED, len(entries))
+
+
+def import_ldif(
+    instance,
+    entries,
+    logger=None,
+    workers=8,
+    batch_size=100,
+    report_interval=10.0,
+    max_retry=10000,
+):
+    """Add the (dn, attributes) `entries` in batches of batch_size over
+    `workers` concurrent connections. Entries that already exist are
+    skipped, and entries that were read before their parent are retried
+    once the batches read so far have been added. Once max_retry or more
+    such entries are held, the ones whose parent is still missing fail,
+    E.g. those of a file that lists a deep tree children first, such that
+    the backlog stays bounded.
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    progress = Progress(
+        logger,
+        interval=report_interval,
+        statuses=(ADDED, FAILED, SKIPPED),
+        unit="entries",
+    )
+    retry = []
+
+    def finish(future):
+        outcomes, batch_retry = future.result()
+        for status, count in outcomes.items():
+            progress.add(status, count)
+        retry.extend(batch_retry)
+
+    pending = set()
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="ldap-ldif"
+    ) as executor:
+        for batch in batches(entries, batch_size):
+            # Bound the number of entries that are read ahead
+            if len(pending) >= workers * 2:
+                completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    finish(future)
+            if len(retry) >= max_retry:
+                # Retry once the parents that were read so far are added
+                for future in pending:
+                    finish(future)
+                pending = set()
+                retry[:] = retry_entries(instance, logger, retry, progress)
+                if len(retry) >= max_retry:
+                    fail_missing_parents(logger, retry, progress)
+                    retry[:] = []
+            pending.add(executor.submit(add_entries, instance, logger, batch))
+        for future in pending:
+            finish(future)
+
+    # Parents are added by now, the order of the retries is kept
+    fail_missing_parents(
+        logger, retry_entries(instance, logger, retry, progress), progress
+    )
+    progress.report()
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export or import the LDAP entries that the hook manages."
+    )
+    parser.add_argument(
+        "--config",
+        required=True,
+        help="The jupyterhub_config.py that defines the LDAP settings",
+    )
+    parser.add_argument("--report-interval", type=float, default=10.0)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export")
+    export.add_argument("ldif", help="The LDIF file to write, - for stdout")
+    export.add_argument("--page-size", type=int, default=500)
+    export.add_argument(
+        "--all-attributes",
+        action="store_true",
+        help="Export every attribute rather than those of object_attributes",
+    )
+    load = commands.add_parser("import")
+    load.add_argument("ldif", help="The LDIF file to read, - for stdin")
+    load.add_argument("--workers", type=int, default=8)
+    load.add_argument("--batch-size", type=int, default=100)
+    load.add_argument(
+        "--max-retry",
+        type=int,
+        default=10000,
+        help="The largest number of entries that are held until their parent "
+        "is added",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    logger = logging.getLogger("ldap_hooks.ldif")
+    instance = LDAP(config=load_config(args.config))
+
+    if args.command == "export":
+        stream = sys.stdout if args.ldif == "-" else open(args.ldif, "w")
+        try:
+            export_ldif(
+                instance,
+                stream,
+                logger=logger,
+                page_size=args.page_size,
+                all_attributes=args.all_attributes,
+                report_interval=args.report_interval,
+            )
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        return 0
+
+    stream = sys.stdin if args.ldif == "-" else open(args.ldif, "r")
+    try:
+        progress = import_ldif(
+            instance,
+            read_ldif(stream),
+            logger=logger,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            report_interval=args.report_interval,
+            max_retry=args.max_retry,
+        )
+    except UnsupportedLDIF as err:
+        logger.error("LDAP - failed to read: {}, {}".format(args.ldif, err))
+        return 1
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return 1 if progress.counts[FAILED] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
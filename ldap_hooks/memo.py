@@ -0,0 +1,112 @@
+import hashlib
+import json
+import threading
+from .cache import EntryCache, encode_value
+from .constants import ENTRY_CACHE_SETTINGS, OPERATIONAL_SETTINGS
+
+# The operational attributes that identify the version of an entry,
+# in the order of preference
+ENTRY_VERSION_ATTRIBUTES = ("entryCSN", "modifyTimestamp")
+# The settings that the pre-provisioning at login overrides on its own
+# instance, they don't change the result that it memoizes for the spawn
+PRE_PROVISION_SETTINGS = ("memoize_results", "deferred_modifications")
+
+
+def config_fingerprint(instance):
+    """A digest of the LDAP settings of `instance`, such that a memoized
+    result is discarded when the configuration changes. The
+    OPERATIONAL_SETTINGS and PRE_PROVISION_SETTINGS are left out, as they
+    don't change the result.
+    """
+    return settings_digest(
+        instance,
+        [
+            name
+            for name in type(instance).class_own_traits()
+            if name not in OPERATIONAL_SETTINGS and name not in PRE_PROVISION_SETTINGS
+        ],
+    )
+
+
+def entry_cache_scope(instance):
+    """A digest of the ENTRY_CACHE_SETTINGS of `instance`, which scopes the
+    rows of the PersistentEntryCache, such that a Hub whose settings changed
+    misses on the rows of the Hubs that share the database with it.
+    """
+    return settings_digest(instance, ENTRY_CACHE_SETTINGS)
+
+
+def settings_digest(instance, names):
+    values = {name: getattr(instance, name) for name in sorted(names)}
+    encoded = json.dumps(values, sort_keys=True, default=repr)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def entry_version(attributes):
+    """The entryCSN or modifyTimestamp of an entry, None if the server
+    returned neither. It is encoded as the PersistentEntryCache stores it,
+    such that the version of an entry that was read from it matches.
+    """
+    for attr in ENTRY_VERSION_ATTRIBUTES:
+        if attr in attributes and attributes[attr]:
+            value = attributes[attr]
+            if isinstance(value, (list, tuple)):
+                value = value[0]
+            return encode_value(value)
+    return None
+
+
+class MemoizedResult:
+    """The resolved result of the hook for a user, along with what it
+    was derived from.
+    """
+
+    __slots__ = (
+        "fingerprint",
+        "ldap_data",
+        "dn",
+        "version",
+        "dynamic_attributes",
+        "spawner_attributes",
+    )
+
+    def __init__(
+        self,
+        fingerprint,
+        ldap_data,
+        dn,
+        version,
+        dynamic_attributes,
+        spawner_attributes,
+    ):
+        self.fingerprint = fingerprint
+        self.ldap_data = ldap_data
+        self.dn = dn
+        self.version = version
+        self.dynamic_attributes = dynamic_attributes
+        self.spawner_attributes = spawner_attributes
+
+    def matches(self, fingerprint, ldap_data):
+        return self.fingerprint == fingerprint and self.ldap_data == ldap_data
+
+
+_result_memo = None
+_result_memo_lock = threading.Lock()
+
+
+def get_result_memo(max_size=10000):
+    """Return the process wide memo of hook results, keyed by user name."""
+    global _result_memo
+    with _result_memo_lock:
+        if _result_memo is None:
+            _result_memo = EntryCache(max_size=max_size)
+        else:
+            _result_memo.max_size = max_size
+        return _result_memo
+
+
+def clear_result_memo():
+    """Discard every memoized result, if the memo has been created."""
+    with _result_memo_lock:
+        if _result_memo is not None:
+            _result_memo.clear()
@@ -0,0 +1,312 @@
+import datetime
+import threading
+import time
+from ldap3 import SUBTREE
+from ldap3.core.exceptions import LDAPException
+from .entry import compact_entry
+from .ldap import paged_search_for
+from .pool import ServerUnavailable
+
+
+def format_generalized_time(value):
+    """Format a modifyTimestamp value as an LDAP GeneralizedTime string."""
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        return value.strftime("%Y%m%d%H%M%SZ")
+    return str(value)
+
+
+def normalize_value(value):
+    return str(value).lower()
+
+
+class DirectoryMirror:
+    """An in-memory copy of the entries below base_dn that match the
+    search_filter, indexed by DN and by the values of index_attributes.
+
+    The mirror is filled by a paged full sync, and kept current by delta
+    searches for entries with a newer modifyTimestamp than the last sync.
+    Since deletions are not visible to delta searches, a deleted entry is
+    mirrored until it is discarded, or until the full sync that is repeated
+    every full_sync_interval seconds.
+    """
+
+    def __init__(
+        self,
+        base_dn,
+        search_filter,
+        attributes,
+        index_attributes,
+        page_size=500,
+        logger=None,
+    ):
+        self.base_dn = base_dn
+        self.search_filter = search_filter
+        self.attributes = list(attributes)
+        self.index_attributes = [attr.lower() for attr in index_attributes]
+        self.page_size = page_size
+        self.logger = logger
+        self.entries = {}
+        self.indexes = {attr: {} for attr in self.index_attributes}
+        self.last_modified = None
+        self.synced_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_ready(self):
+        return self.synced_at is not None
+
+    def _search_attributes(self):
+        return self.attributes + ["modifyTimestamp"]
+
+    def _paged_entries(self, conn_manager, search_filter):
+        return paged_search_for(
+            conn_manager.get_connection(),
+            self.base_dn,
+            search_filter,
+            page_size=self.page_size,
+            search_scope=SUBTREE,
+            attributes=self._search_attributes(),
+        )
+
+    def _add(self, entries, indexes, dn, attributes):
+        key = dn.lower()
+        previous = entries.get(key)
+        if previous is not None:
+            self._unindex(indexes, key, previous[1])
+        entries[key] = (dn, attributes)
+        for attr, index in indexes.items():
+            for value in self._values(attributes, attr):
+                index.setdefault(normalize_value(value), set()).add(key)
+
+    def _unindex(self, indexes, key, attributes):
+        for attr, index in indexes.items():
+            for value in self._values(attributes, attr):
+                dns = index.get(normalize_value(value))
+                if dns is not None:
+                    dns.discard(key)
+                    if not dns:
+                        del index[normalize_value(value)]
+
+    @staticmethod
+    def _values(attributes, attr):
+        if attr not in attributes:
+            return []
+        values = attributes[attr]
+        if isinstance(values, (list, tuple, set)):
+            return values
+        return [values]
+
+    def _track_modified(self, attributes, last_modified):
+        modified = self._values(attributes, "modifytimestamp")
+        if modified:
+            modified = format_generalized_time(modified[0])
+            if last_modified is None or modified > last_modified:
+                return modified
+        return last_modified
+
+    def full_sync(self, conn_manager):
+        """Replace the mirror with every matching entry of the directory."""
+        entries, indexes = {}, {attr: {} for attr in self.index_attributes}
+        last_modified = None
+        for dn, attributes in self._paged_entries(conn_manager, self.search_filter):
+            attributes = compact_entry(dn, attributes)
+            last_modified = self._track_modified(attributes, last_modified)
+            self._add(entries, indexes, dn, attributes)
+
+        with self._lock:
+            self.entries, self.indexes = entries, indexes
+            self.last_modified = last_modified
+            self.synced_at = time.monotonic()
+        if self.logger is not None:
+            self.logger.info(
+                "LDAP - directory mirror synced {} entries of {}".format(
+                    len(entries), self.base_dn
+                )
+            )
+        return len(entries)
+
+    def delta_sync(self, conn_manager):
+        """Update the entries that have been modified since the last sync."""
+        if self.last_modified is None:
+            return self.full_sync(conn_manager)
+
+        search_filter = "(&{}(modifyTimestamp>={}))".format(
+            self.search_filter, self.last_modified
+        )
+        updated = 0
+        for dn, attributes in self._paged_entries(conn_manager, search_filter):
+            attributes = compact_entry(dn, attributes)
+            with self._lock:
+                self.last_modified = self._track_modified(
+                    attributes, self.last_modified
+                )
+                self._add(self.entries, self.indexes, dn, attributes)
+            updated += 1
+
+        with self._lock:
+            self.synced_at = time.monotonic()
+        if updated and self.logger is not None:
+            self.logger.debug(
+                "LDAP - directory mirror updated {} entries".format(updated)
+            )
+        return updated
+
+    def get(self, dn):
+        with self._lock:
+            entry = self.entries.get(dn.lower())
+        if entry is None:
+            return None
+        return entry[1]
+
+    def discard(self, dn):
+        """Remove the entry at `dn`, E.g. once it is known to be deleted
+        from the directory before the next full sync.
+        """
+        key = dn.lower()
+        with self._lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self._unindex(self.indexes, key, entry[1])
+        return entry is not None
+
+    def lookup(self, ldap_dict, unique_attributes, dn):
+        """Find the single mirrored entry that the existing entry search
+        of the hook would return, None if there is no unambiguous match.
+
+        With unique_attributes the entry is matched by their values in
+        `ldap_dict`, otherwise by the `dn` that the hook would create.
+        """
+        found = self.find(ldap_dict, unique_attributes, dn)
+        if found is None:
+            return None
+        return found[1]
+
+    def find(self, ldap_dict, unique_attributes, dn):
+        """The (dn, attributes) of the entry that lookup returns, or None."""
+        if not self.is_ready():
+            return None
+
+        if not unique_attributes:
+            with self._lock:
+                return self.entries.get(dn.lower())
+
+        keys = [
+            (attr.lower(), normalize_value(ldap_dict[attr]))
+            for attr in unique_attributes
+            if attr in ldap_dict
+        ]
+        if not keys:
+            return None
+
+        with self._lock:
+            candidates = None
+            for attr, value in keys:
+                index = self.indexes.get(attr)
+                if index is None:
+                    return None
+                dns = index.get(value, set())
+                candidates = dns if candidates is None else candidates & dns
+            if not candidates or len(candidates) != 1:
+                return None
+            return self.entries[next(iter(candidates))]
+
+    def start(self, pool_factory, sync_interval=60.0, full_sync_interval=3600.0):
+        """Sync the mirror in a daemon thread, `pool_factory` returns
+        a new ServerPool to read the directory from.
+        """
+        if self._thread is not None:
+            return self._thread
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(pool_factory, sync_interval, full_sync_interval),
+            name="ldap-directory-mirror",
+            daemon=True,
+        )
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, pool_factory, sync_interval, full_sync_interval):
+        full_synced_at = None
+        while not self._stop.is_set():
+            pool = pool_factory()
+            try:
+                conn_manager = pool.reader()
+                now = time.monotonic()
+                if full_synced_at is None or now - full_synced_at >= full_sync_interval:
+                    self.full_sync(conn_manager)
+                    full_synced_at = now
+                else:
+                    self.delta_sync(conn_manager)
+                pool.record_success()
+            except (ServerUnavailable, LDAPException) as err:
+                pool.record_failure(pool.current)
+                if self.logger is not None:
+                    self.logger.error(
+                        "LDAP - directory mirror failed to sync, "
+                        "exception: {}".format(err)
+                    )
+            finally:
+                pool.disconnect()
+            self._stop.wait(sync_interval)
+
+
+_directory_mirror = None
+_directory_mirror_lock = threading.Lock()
+
+
+def get_directory_mirror():
+    return _directory_mirror
+
+
+def start_directory_mirror(
+    pool_factory,
+    base_dn,
+    search_filter,
+    attributes,
+    index_attributes,
+    page_size=500,
+    sync_interval=60.0,
+    full_sync_interval=3600.0,
+    logger=None,
+):
+    """Return the process wide directory mirror, it is created and
+    its sync thread started on the first call.
+    """
+    global _directory_mirror
+    with _directory_mirror_lock:
+        if _directory_mirror is None:
+            _directory_mirror = DirectoryMirror(
+                base_dn,
+                search_filter,
+                attributes,
+                index_attributes,
+                page_size=page_size,
+                logger=logger,
+            )
+            _directory_mirror.start(
+                pool_factory,
+                sync_interval=sync_interval,
+                full_sync_interval=full_sync_interval,
+            )
+        return _directory_mirror
+
+
+def stop_directory_mirror():
+    """Stop the sync thread of the directory mirror and discard it, such
+    that the next start_directory_mirror starts a new one.
+    """
+    global _directory_mirror
+    with _directory_mirror_lock:
+        mirror, _directory_mirror = _directory_mirror, None
+    if mirror is not None:
+        mirror.stop()
+    return mirror is not None
@@ -0,0 +1,485 @@
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from ldap3.core.exceptions import LDAPException
+from .breaker import get_circuit_breaker
+from .constants import CONSUMER, PROVIDER, SERVER_ROLES
+from .ldap import ConnectionManager, search_for
+
+
+# Weight of the latest latency sample in the moving average
+EWMA_ALPHA = 0.3
+# Number of recent latency samples kept per server for percentiles
+LATENCY_SAMPLES = 100
+# Minimum number of samples before a percentile is trusted
+MIN_PERCENTILE_SAMPLES = 10
+HEDGE_WORKERS = 8
+
+
+class ServerUnavailable(Exception):
+    """Raised when none of the servers that can serve an operation
+    are reachable, or their circuit breakers are open.
+    """
+
+    def __init__(self, role, urls):
+        self.role = role
+        self.urls = urls
+        super().__init__("no reachable {} server out of: {}".format(role, urls))
+
+
+def parse_servers(url):
+    """Turn the LDAP.url setting into a list of (url, role) tuples.
+
+    A single url string is the provider. In a list, plain strings are
+    providers as well, and dicts define their role explicitly,
+    E.g. {'url': 'ldap://consumer1', 'role': CONSUMER}
+    """
+    if isinstance(url, str):
+        url = [url]
+    if not isinstance(url, (list, tuple)) or not url:
+        raise ValueError("url must be a non empty string or list of servers")
+
+    servers = []
+    for server in url:
+        if isinstance(server, str):
+            servers.append((server, PROVIDER))
+            continue
+        if not isinstance(server, dict) or "url" not in server:
+            raise ValueError(
+                "server: {} must be a url string or a dict "
+                "with a 'url' key".format(server)
+            )
+        role = server.get("role", PROVIDER)
+        if role not in SERVER_ROLES:
+            raise ValueError(
+                "Illegal role: {} of server: {} must be one of: {}".format(
+                    role, server["url"], SERVER_ROLES
+                )
+            )
+        servers.append((server["url"], role))
+
+    if not any(role == PROVIDER for _, role in servers):
+        raise ValueError("at least one server must have the role: {}".format(PROVIDER))
+    return servers
+
+
+class LatencyTracker:
+    """Exponentially weighted moving average of the operation latency
+    of each server url, along with a window of the most recent samples.
+    """
+
+    def __init__(self, alpha=EWMA_ALPHA, samples=LATENCY_SAMPLES):
+        self.alpha = alpha
+        self.samples = samples
+        self._averages = {}
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, url, seconds):
+        with self._lock:
+            average = self._averages.get(url)
+            if average is None:
+                self._averages[url] = seconds
+            else:
+                self._averages[url] = self.alpha * seconds + (1 - self.alpha) * average
+            if url not in self._samples:
+                self._samples[url] = deque(maxlen=self.samples)
+            self._samples[url].append(seconds)
+
+    def percentile(self, url, percent):
+        """The `percent` percentile of the recent latencies of `url`,
+        None if too few samples have been recorded.
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(url, ()))
+        if len(samples) < MIN_PERCENTILE_SAMPLES:
+            return None
+        index = math.ceil(percent / 100.0 * len(samples)) - 1
+        return samples[min(max(index, 0), len(samples) - 1)]
+
+    def estimate(self, url):
+        """The average latency of `url`, servers without any samples are
+        estimated at 0 such that they are measured first.
+        """
+        with self._lock:
+            return self._averages.get(url, 0.0)
+
+
+_latency_tracker = LatencyTracker()
+
+
+def get_latency_tracker():
+    return _latency_tracker
+
+
+class IdleConnections:
+    """Bound connections that are kept open between hook invocations,
+    keyed by the server url and the user that they are bound as.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def checkout(self, key, max_idle_time=None):
+        """Take an idle connection of `key`, None if there is none
+        that is still open and younger than max_idle_time seconds.
+        """
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    return None
+                conn_manager, idle_since = idle.pop()
+            connection = conn_manager.get_connection()
+            expired = (
+                max_idle_time is not None and self.clock() - idle_since > max_idle_time
+            )
+            if expired or connection is None or connection.closed:
+                conn_manager.disconnect()
+                continue
+            return conn_manager
+
+    def checkin(self, key, conn_manager, max_size):
+        """Keep `conn_manager` open for a subsequent invocation,
+        it is disconnected if max_size connections are idle already.
+        """
+        with self._lock:
+            idle = self._idle.setdefault(key, deque())
+            if len(idle) < max_size:
+                idle.append((conn_manager, self.clock()))
+                return True
+        conn_manager.disconnect()
+        return False
+
+    def size(self, key):
+        with self._lock:
+            return len(self._idle.get(key, ()))
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn_manager, _ in connections:
+                conn_manager.disconnect()
+
+
+_idle_connections = IdleConnections()
+
+
+def get_idle_connections():
+    return _idle_connections
+
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+
+def get_hedge_executor():
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=HEDGE_WORKERS, thread_name_prefix="ldap-hedge"
+            )
+        return _hedge_executor
+
+
+class ServerPool:
+    """Routes the operations of a single hook invocation across the
+    configured servers.
+
+    Writes are pinned to the provider. Reads go to the healthy consumer
+    with the lowest average latency, with the provider as the fallback.
+    Once a write has been issued, every subsequent read of the same pool
+    goes to the provider as well, such that the invocation reads its
+    own writes.
+    """
+
+    def __init__(
+        self,
+        url,
+        logger=None,
+        deadline=None,
+        connect_timeout=None,
+        receive_timeout=None,
+        failure_threshold=5,
+        cooldown=30.0,
+        hedge_percentile=None,
+        hedge_min_delay=0.0,
+        max_idle=0,
+        max_idle_time=None,
+        **connection_args
+    ):
+        self.servers = parse_servers(url)
+        self.logger = logger
+        self.deadline = deadline
+        self.connect_timeout = connect_timeout
+        self.receive_timeout = receive_timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.max_idle = max_idle
+        self.max_idle_time = max_idle_time
+        self.connection_args = connection_args
+        self.latency = get_latency_tracker()
+        self.idle = get_idle_connections()
+        self.managers = {}
+        # The urls whose connection was taken from the idle connections,
+        # and has not completed an operation since
+        self.reused = set()
+        self.failed = set()
+        self.written = False
+        self.current = None
+
+    def breaker(self, url):
+        return get_circuit_breaker(
+            url, failure_threshold=self.failure_threshold, cooldown=self.cooldown
+        )
+
+    def idle_key(self, url):
+        return (url, self.connection_args.get("user"))
+
+    def open_connection(self, url):
+        """Open and bind a new connection to `url`,
+        None if it failed.
+        """
+        connect_timeout, receive_timeout = self.connect_timeout, self.receive_timeout
+        if self.deadline is not None:
+            self.deadline.step("connect to {}".format(url))
+            connect_timeout = self.deadline.operation_timeout(connect_timeout)
+            receive_timeout = self.deadline.operation_timeout(receive_timeout)
+
+        conn_manager = ConnectionManager(
+            url,
+            logger=self.logger,
+            receive_timeout=receive_timeout,
+            **self.connection_args
+        )
+        conn_manager.connect(connect_timeout=connect_timeout)
+        if not conn_manager.is_connected():
+            return None
+        return conn_manager
+
+    def _connect(self, url):
+        if url in self.managers:
+            return self.managers[url]
+        if url in self.failed or not self.breaker(url).allow_request():
+            return None
+
+        conn_manager = None
+        if self.max_idle:
+            conn_manager = self.idle.checkout(
+                self.idle_key(url), max_idle_time=self.max_idle_time
+            )
+            if conn_manager is not None:
+                self.reused.add(url)
+        if conn_manager is None:
+            conn_manager = self.open_connection(url)
+        if conn_manager is None:
+            self.failed.add(url)
+            self.breaker(url).record_failure()
+            return None
+        self.managers[url] = conn_manager
+        return conn_manager
+
+    def _first_connected(self, urls, role):
+        for url in urls:
+            conn_manager = self._connect(url)
+            if conn_manager is not None:
+                self.current = conn_manager
+                return conn_manager
+        raise ServerUnavailable(role, urls)
+
+    def providers(self):
+        return [url for url, role in self.servers if role == PROVIDER]
+
+    def consumers(self):
+        return [url for url, role in self.servers if role == CONSUMER]
+
+    def writer(self):
+        """The connection to the provider, raises ServerUnavailable
+        if none is reachable.
+        """
+        self.written = True
+        return self._first_connected(self.providers(), PROVIDER)
+
+    def read_order(self):
+        consumers = sorted(self.consumers(), key=self.latency.estimate)
+        return consumers + self.providers()
+
+    def reader(self):
+        """The connection that the next read should use,
+        raises ServerUnavailable if no server is reachable.
+        """
+        if self.written:
+            return self.writer()
+        return self._first_connected(self.read_order(), "read")
+
+    def hedge_delay(self, url):
+        """How long a read on `url` may take before it is hedged."""
+        delay = self.latency.percentile(url, self.hedge_percentile)
+        if delay is None:
+            return self.hedge_min_delay
+        return max(delay, self.hedge_min_delay)
+
+    def _hedge_reader(self, primary):
+        """A second connection to hedge a read on `primary` with,
+        None if no other replica is reachable.
+        """
+        for url in self.read_order():
+            if url == primary.url:
+                continue
+            conn_manager = self._connect(url)
+            if conn_manager is not None:
+                return conn_manager
+        return None
+
+    def _timed_search(self, conn_manager, search_base, search_filter, **kwargs):
+        with self.measure(conn_manager):
+            return search_for(
+                conn_manager.get_connection(), search_base, search_filter, **kwargs
+            )
+
+    def _reused_search(self, conn_manager, search_base, search_filter, **kwargs):
+        """Search via the reused `conn_manager`, if the search fails the
+        server is assumed to have dropped the connection while it was idle,
+        and the search is retried once on a new connection.
+        """
+        url = conn_manager.url
+        self.reused.discard(url)
+        try:
+            return conn_manager, self._timed_search(
+                conn_manager, search_base, search_filter, **kwargs
+            )
+        except LDAPException as err:
+            if self.logger is not None:
+                self.logger.debug(
+                    "LDAP - reused connection to: {} failed, reconnecting: {}".format(
+                        url, err
+                    )
+                )
+        conn_manager.disconnect()
+        fresh = self.open_connection(url)
+        if fresh is None:
+            self.managers.pop(url, None)
+            raise ServerUnavailable("read", [url])
+        fresh.set_operation_timeout(conn_manager.operation_timeout)
+        self.managers[url] = fresh
+        self.current = fresh
+        return fresh, self._timed_search(fresh, search_base, search_filter, **kwargs)
+
+    def search(self, conn_manager, search_base, search_filter, **kwargs):
+        """Search via `conn_manager`, and if hedging is enabled and the
+        answer takes longer than the hedge delay, issue the same search
+        to a second replica as well. The first answer wins and the loser
+        is abandoned. Returns the connection that answered and the result
+        of the search.
+
+        Reads that are pinned to the provider are never hedged, and
+        neither is the first search on a reused connection, which is
+        retried on a new connection instead if it fails.
+        """
+        if conn_manager.url in self.reused:
+            return self._reused_search(
+                conn_manager, search_base, search_filter, **kwargs
+            )
+        if not self.hedge_percentile or self.written:
+            return conn_manager, self._timed_search(
+                conn_manager, search_base, search_filter, **kwargs
+            )
+
+        executor = get_hedge_executor()
+        futures = {
+            executor.submit(
+                self._timed_search, conn_manager, search_base, search_filter, **kwargs
+            ): conn_manager
+        }
+        done, _ = wait(futures, timeout=self.hedge_delay(conn_manager.url))
+        if not done:
+            hedge_manager = self._hedge_reader(conn_manager)
+            if hedge_manager is not None:
+                if self.logger is not None:
+                    self.logger.debug(
+                        "LDAP - hedging search: {} on {} with {}".format(
+                            search_filter, conn_manager.url, hedge_manager.url
+                        )
+                    )
+                hedge_manager.set_operation_timeout(conn_manager.operation_timeout)
+                hedge_future = executor.submit(
+                    self._timed_search,
+                    hedge_manager,
+                    search_base,
+                    search_filter,
+                    **kwargs
+                )
+                futures[hedge_future] = hedge_manager
+
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    self.record_failure(futures[future])
+                    continue
+                for loser in pending:
+                    self._abandon(futures[loser], loser)
+                self.current = futures[future]
+                return self.current, future.result()
+        raise error
+
+    def _abandon(self, conn_manager, future):
+        """Stop using the connection of a search that lost a hedge race,
+        it is closed as soon as its pending search returns. The outcome of
+        the search is recorded on the breaker of its server, which also
+        concludes a half-open trial that the search was.
+        """
+        self.managers.pop(conn_manager.url, None)
+        self.failed.add(conn_manager.url)
+        breaker = self.breaker(conn_manager.url)
+
+        def finish(future):
+            if future.exception() is None:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            conn_manager.disconnect()
+
+        future.add_done_callback(finish)
+
+    @contextmanager
+    def measure(self, conn_manager):
+        """Record the latency of the operation in the with block."""
+        started = time.monotonic()
+        yield
+        self.latency.record(conn_manager.url, time.monotonic() - started)
+
+    def record_failure(self, conn_manager):
+        if conn_manager is None:
+            return
+        self.failed.add(conn_manager.url)
+        if self.managers.pop(conn_manager.url, None) is not None:
+            conn_manager.disconnect()
+        self.breaker(conn_manager.url).record_failure()
+
+    def record_success(self):
+        for url in self.managers:
+            self.breaker(url).record_success()
+
+    def disconnect(self):
+        """Release the connections of the pool, healthy connections are
+        kept open for subsequent invocations up to max_idle per server.
+        """
+        for url, conn_manager in self.managers.items():
+            if self.max_idle and conn_manager.is_connected():
+                self.idle.checkin(self.idle_key(url), conn_manager, self.max_idle)
+            else:
+                conn_manager.disconnect()
+        self.managers = {}
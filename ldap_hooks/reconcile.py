@@ -0,0 +1,336 @@
+"""Find the JupyterHub users whose LDAP entry is missing, duplicated or has
+drifted from the configured object_attributes.
+
+    ldap-hooks-reconcile --config jupyterhub_config.py --users users.jsonl
+
+The entries below base_dn are read with a paged search one page at a time,
+and joined against the users by the unique_object_attributes, or by the
+DN that the hook would create. The findings are written as JSON lines as
+they are found, only the users are kept in memory.
+"""
+
+import argparse
+import copy
+import itertools
+import json
+import logging
+import os
+import sys
+import urllib.request
+from ldap3 import ALL_ATTRIBUTES, MODIFY_REPLACE, SUBTREE
+from ldap3.core.exceptions import LDAPException
+from .bulk import (
+    FAILED,
+    PROVISIONED,
+    bulk_provision,
+    guess_format,
+    load_config,
+    read_records,
+)
+from .hooks import (
+    LDAP,
+    LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY,
+    LDAP_SEARCH_ATTRIBUTE_QUERY,
+    SPAWNER_ATTRIBUTE,
+    SPAWNER_SUBMIT_DATA,
+    SPAWNER_USER_ATTRIBUTE,
+    LoginSpawner,
+    entry_cache_key,
+    get_interpolated_dynamic_attributes,
+    get_submit_data,
+    new_server_pool,
+    object_class_filter,
+    prepare_submit_data,
+)
+from .ldap import modify_dn, paged_search_for
+from .mirror import normalize_value
+from .pool import ServerUnavailable
+from .utils import recursive_format
+
+MISSING = "missing"
+DUPLICATE = "duplicate"
+DRIFTED = "drifted"
+REPAIRED = "repaired"
+REPAIR_FAILED = "repair_failed"
+
+
+def read_hub_users(hub_api_url, token, page_size=200):
+    """Yield the users of the JupyterHub REST API at `hub_api_url`,
+    E.g. http://127.0.0.1:8081/hub/api. The token requires the
+    admin:auth_state scope for the auth_state of the users to be included.
+    """
+    offset = 0
+    while True:
+        request = urllib.request.Request(
+            "{}/users?include_stopped_servers&offset={}&limit={}".format(
+                hub_api_url.rstrip("/"), offset, page_size
+            ),
+            headers={
+                "Authorization": "token {}".format(token),
+                "Accept": "application/jupyterhub-pagination+json",
+            },
+        )
+        with urllib.request.urlopen(request) as response:
+            page = json.load(response)
+        users = page["items"] if isinstance(page, dict) else page
+        for user in users:
+            yield {"name": user["name"], "auth_state": user.get("auth_state")}
+        if isinstance(page, dict) and page.get("_pagination", {}).get("next"):
+            offset = page["_pagination"]["next"]["offset"]
+        else:
+            return
+
+
+class ExpectedUser:
+    """The entry that the hook expects of a user."""
+
+    __slots__ = ("record", "ldap_data", "ldap_dict", "dn", "key", "found")
+
+    def __init__(self, record, ldap_data, ldap_dict, dn, key):
+        self.record = record
+        self.ldap_data = ldap_data
+        self.ldap_dict = ldap_dict
+        self.dn = dn
+        self.key = key
+        self.found = []
+
+
+def user_key(instance, ldap_data, ldap_dict):
+    if instance.unique_object_attributes:
+        key = tuple(
+            (attr.lower(), normalize_value(ldap_dict[attr]))
+            for attr in instance.unique_object_attributes
+            if attr in ldap_dict
+        )
+        return key or None
+    return entry_cache_key(instance, ldap_data).lower()
+
+
+def entry_keys(instance, dn, attributes):
+    """The keys that the users of the entry would have."""
+    if not instance.unique_object_attributes:
+        return [dn.lower()]
+    values = []
+    for attr in instance.unique_object_attributes:
+        value = attributes.get(attr)
+        if value in (None, [], ()):
+            continue
+        if not isinstance(value, (list, tuple, set)):
+            value = [value]
+        values.append([(attr.lower(), normalize_value(item)) for item in value])
+    return [tuple(key) for key in itertools.product(*values)] if values else []
+
+
+def expected_users(instance, records, logger):
+    """Index the users of `records` by the key of their expected entry."""
+    users = {}
+    for record in records:
+        spawner = LoginSpawner(record, logger)
+        ldap_data = get_submit_data(spawner, instance)
+        if not ldap_data:
+            continue
+        ldap_data, ldap_dict = prepare_submit_data(spawner, instance, ldap_data)
+        key = user_key(instance, ldap_data, ldap_dict)
+        if key is None:
+            continue
+        users[key] = ExpectedUser(
+            record,
+            ldap_data,
+            ldap_dict,
+            entry_cache_key(instance, ldap_data),
+            key,
+        )
+    return users
+
+
+def drifted_attributes(instance, logger, user, attributes):
+    """The object_attributes of the entry that differ from the values that
+    the configured templates render to. Templates that can't be fully
+    rendered are skipped.
+    """
+    spawner = LoginSpawner(user.record, logger)
+    sources = {
+        LDAP_SEARCH_ATTRIBUTE_QUERY: attributes,
+        LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY: attributes,
+        SPAWNER_SUBMIT_DATA: user.ldap_dict,
+        SPAWNER_ATTRIBUTE: spawner,
+        SPAWNER_USER_ATTRIBUTE: spawner.user,
+    }
+    dynamic_attributes = get_interpolated_dynamic_attributes(
+        logger, sources, instance.dynamic_attributes
+    )
+    expected = copy.deepcopy(instance.object_attributes)
+    recursive_format(expected, dynamic_attributes or {})
+
+    drifted = {}
+    for attr, value in expected.items():
+        if "{" in value:
+            continue
+        actual = attributes.get(attr)
+        actual_values = actual if isinstance(actual, (list, tuple, set)) else [actual]
+        if value not in [str(item) for item in actual_values if item is not None]:
+            drifted[attr] = {"expected": value, "actual": actual}
+    return drifted
+
+
+def reconcile(
+    instance,
+    records,
+    report,
+    logger=None,
+    page_size=500,
+    repair=False,
+    batch_size=100,
+    workers=8,
+):
+    """Join the entries of the directory against the user `records` and
+    write the findings to `report` as JSON lines. With `repair` drifted
+    attributes are replaced in batches, and missing entries are provisioned.
+    Returns the number of findings of each kind.
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    counts = {MISSING: 0, DUPLICATE: 0, DRIFTED: 0, REPAIRED: 0, REPAIR_FAILED: 0}
+
+    def emit(status, **finding):
+        counts[status] += 1
+        finding["status"] = status
+        report.write(json.dumps(finding, default=str) + "\n")
+
+    users = expected_users(instance, records, logger)
+    pool = new_server_pool(instance, logger)
+    try:
+        conn_manager = pool.reader()
+        repairs = []
+        for dn, attributes in paged_search_for(
+            conn_manager.get_connection(),
+            instance.base_dn,
+            object_class_filter(instance.object_classes),
+            page_size=page_size,
+            search_scope=SUBTREE,
+            attributes=ALL_ATTRIBUTES,
+        ):
+            for key in entry_keys(instance, dn, attributes):
+                user = users.get(key)
+                if user is None:
+                    continue
+                user.found.append(dn)
+                if len(user.found) > 1:
+                    emit(DUPLICATE, user=user.record["name"], dns=user.found)
+                    continue
+                drifted = drifted_attributes(instance, logger, user, attributes)
+                if drifted:
+                    emit(DRIFTED, user=user.record["name"], dn=dn, attributes=drifted)
+                    if repair:
+                        repairs.append((dn, drifted))
+            if len(repairs) >= batch_size:
+                repair_entries(pool, repairs, emit, logger)
+                repairs = []
+        if repairs:
+            repair_entries(pool, repairs, emit, logger)
+        pool.record_success()
+    except (ServerUnavailable, LDAPException) as err:
+        pool.record_failure(pool.current)
+        logger.error("LDAP - failed to reconcile, exception: {}".format(err))
+        raise
+    finally:
+        pool.disconnect()
+
+    missing = []
+    for user in users.values():
+        if not user.found:
+            emit(MISSING, user=user.record["name"], dn=user.dn)
+            missing.append(user.record)
+    if repair and missing:
+        progress = bulk_provision(
+            missing, config=instance.config, workers=workers, logger=logger
+        )
+        counts[REPAIRED] += progress.counts[PROVISIONED]
+        counts[REPAIR_FAILED] += progress.counts[FAILED]
+    return counts
+
+
+def repair_entries(pool, repairs, emit, logger):
+    """Replace the drifted attributes of a batch of entries over a
+    single connection of the provider.
+    """
+    connection = pool.writer().get_connection()
+    for dn, drifted in repairs:
+        changes = {
+            attr: [(MODIFY_REPLACE, [values["expected"]])]
+            for attr, values in drifted.items()
+        }
+        if modify_dn(connection, dn, changes):
+            emit(REPAIRED, dn=dn, attributes=sorted(drifted))
+        else:
+            logger.error(
+                "LDAP - failed to repair: {}, result: {}".format(dn, connection.result)
+            )
+            emit(REPAIR_FAILED, dn=dn, attributes=sorted(drifted))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Report the JupyterHub users whose LDAP entry is missing, "
+        "duplicated or has drifted from the configuration."
+    )
+    parser.add_argument(
+        "--config",
+        required=True,
+        help="The jupyterhub_config.py that defines the LDAP settings",
+    )
+    users = parser.add_mutually_exclusive_group(required=True)
+    users.add_argument(
+        "--users", help="CSV, JSON or JSONL file of user records, - for stdin"
+    )
+    users.add_argument(
+        "--hub-api-url",
+        help="Read the users from the JupyterHub REST API, "
+        "with the token of the JUPYTERHUB_API_TOKEN environment variable",
+    )
+    parser.add_argument("--format", default=None)
+    parser.add_argument("--output", default="-", help="JSONL report, - for stdout")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--repair", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    logger = logging.getLogger("ldap_hooks.reconcile")
+    instance = LDAP(config=load_config(args.config))
+
+    stream = None
+    if args.hub_api_url:
+        records = read_hub_users(args.hub_api_url, os.environ["JUPYTERHUB_API_TOKEN"])
+    elif args.users == "-":
+        records = read_records(sys.stdin, args.format or "jsonl")
+    else:
+        stream = open(args.users, "r", newline="")
+        records = read_records(stream, args.format or guess_format(args.users))
+
+    report = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        counts = reconcile(
+            instance,
+            records,
+            report,
+            logger=logger,
+            page_size=args.page_size,
+            repair=args.repair,
+            batch_size=args.batch_size,
+            workers=args.workers,
+        )
+    finally:
+        if stream is not None:
+            stream.close()
+        if report is not sys.stdout:
+            report.close()
+    logger.info(
+        ", ".join("{} {}".format(count, status) for status, count in counts.items())
+    )
+    return 1 if counts[MISSING] or counts[DUPLICATE] or counts[DRIFTED] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""Records the calls of setup_ldap_entry_hook to an append-only JSONL file,
+such that ldap-hooks-replay can replay them. Each line has the time of the
+call, the pseudonymized user name, submitted object and the spawner and user
+attributes that the dynamic_attributes read, the branch that was taken,
+whether the entry was provisioned, its duration and the timings of the steps
+of its LDAP operations.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+# The branches that a call of the hook can take
+REMOTE_BROKER = "broker"
+REMOTE_SERVICE = "service"
+INVALID = "invalid"
+MEMOIZED = "memoized"
+MIRROR = "mirror"
+CACHE = "cache"
+STALE_CACHE = "stale_cache"
+UNAVAILABLE_CACHE = "unavailable_cache"
+UNAVAILABLE = "unavailable"
+EXISTING = "existing"
+CREATED = "created"
+
+# The attribute=value pairs of a submitted DN string
+DN_VALUE = re.compile(r"([A-Za-z][\w.-]*=)([^/+,;=]+)")
+
+_process_key = os.urandom(32)
+_recording = ContextVar("ldap_hooks_recording", default=None)
+
+
+def pseudonym(key, value):
+    return hmac.new(key, str(value).encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+
+
+def sanitize(key, value):
+    """Replace the strings in `value` by their pseudonyms, the attribute
+    names of a DN string and the keys of a dict are kept, such that the
+    sanitized value is prepared in the same way.
+    """
+    if isinstance(value, str):
+        if "=" not in value:
+            return pseudonym(key, value)
+        return DN_VALUE.sub(
+            lambda match: match.group(1) + pseudonym(key, match.group(2)), value
+        )
+    if isinstance(value, dict):
+        return {name: sanitize(key, item) for name, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [sanitize(key, item) for item in value]
+    return value
+
+
+def note_branch(branch):
+    """Note the branch that the recorded call of the hook took, if any."""
+    recording = _recording.get()
+    if recording is not None:
+        recording.branch = branch
+
+
+def note_deadline(deadline):
+    """Note the Deadline whose steps time the LDAP operations of the
+    recorded call of the hook, if any.
+    """
+    recording = _recording.get()
+    if recording is not None:
+        recording.deadline = deadline
+
+
+def step_timings(deadline, finished):
+    """The seconds that were spent in each step of `deadline`, the last
+    step ends `finished` seconds into it.
+    """
+    ends = [entered for _, entered in deadline.steps[1:]] + [finished]
+    return [
+        [name, round(end - entered, 6)]
+        for (name, entered), end in zip(deadline.steps, ends)
+    ]
+
+
+class Recording:
+    """The inputs, branch and timings of a single call of the hook."""
+
+    def __init__(self, name, submit=None, spawner=None, user=None):
+        self.name = name
+        self.submit = submit
+        self.spawner = spawner
+        self.user = user
+        self.time = time.time()
+        self.started = time.monotonic()
+        self.branch = None
+        self.deadline = None
+        self.provisioned = None
+        self.duration = None
+        self.steps = []
+
+    async def run(self, provision, spawner, instance):
+        """Await provision(spawner, instance) while the branch and the
+        deadline that it notes are recorded.
+        """
+        token = _recording.set(self)
+        try:
+            self.provisioned = await provision(spawner, instance)
+            return self.provisioned
+        finally:
+            _recording.reset(token)
+            self.duration = time.monotonic() - self.started
+            if self.deadline is not None:
+                self.steps = step_timings(
+                    self.deadline, self.deadline.clock() - self.deadline.started
+                )
+
+    def record(self):
+        record = {
+            "time": round(self.time, 3),
+            "name": self.name,
+            "branch": self.branch,
+            "provisioned": self.provisioned,
+            "duration": round(self.duration, 6),
+            "steps": self.steps,
+        }
+        if self.submit is not None:
+            record["submit"] = self.submit
+        if self.spawner:
+            record["spawner"] = self.spawner
+        if self.user:
+            record["user"] = self.user
+        return record
+
+
+class HookRecorder:
+    """Appends the records of the hook to the JSONL file at `path`."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, separators=(",", ":"), default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a") as stream:
+                stream.write(line)
+
+
+_hook_recorder = None
+_hook_recorder_lock = threading.Lock()
+
+
+def get_hook_recorder(path):
+    """Return the process wide recorder of the file at `path`."""
+    global _hook_recorder
+    with _hook_recorder_lock:
+        if _hook_recorder is None or _hook_recorder.path != path:
+            _hook_recorder = HookRecorder(path)
+        return _hook_recorder
+
+
+def recorded_inputs(spawner, instance):
+    """The pseudonymized user name, submitted object, and spawner and user
+    attributes of `spawner`, as spawn_inputs takes them.
+    """
+    from .spawn import spawn_inputs
+
+    key = instance.record_key.encode("utf-8") if instance.record_key else _process_key
+    inputs = spawn_inputs(spawner, instance)
+    return (
+        pseudonym(key, inputs["name"]),
+        sanitize(key, inputs.get("submit")),
+        sanitize(key, inputs["spawner"]),
+        sanitize(key, inputs["user"]),
+    )
+
+
+async def record_hook(spawner, instance, provision):
+    """Await provision(spawner, instance) and append its record to the
+    record_path file, returns whether the entry was provisioned.
+    """
+    recording = Recording(*recorded_inputs(spawner, instance))
+    try:
+        return await recording.run(provision, spawner, instance)
+    finally:
+        try:
+            get_hook_recorder(instance.record_path).write(recording.record())
+        except OSError as err:
+            spawner.log.error(
+                "LDAP - failed to record the hook to: {}, exception: {}".format(
+                    instance.record_path, err
+                )
+            )
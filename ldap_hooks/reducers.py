@@ -0,0 +1,96 @@
+REDUCE_FIRST = "first"
+REDUCE_MAX = "max"
+REDUCE_MIN = "min"
+REDUCE_COUNT = "count"
+REDUCE_COLLECT = "collect"
+
+QUERY_REDUCERS = (REDUCE_FIRST, REDUCE_MAX, REDUCE_MIN, REDUCE_COUNT, REDUCE_COLLECT)
+
+# The attribute name that refers to the DN of an entry
+DN_ATTRIBUTE = "dn"
+
+
+def entry_values(dn, attributes, attribute):
+    if attribute.lower() == DN_ATTRIBUTE:
+        return [dn]
+    values = attributes.get(attribute)
+    if values is None:
+        return []
+    if isinstance(values, (list, tuple, set)):
+        return list(values)
+    return [values]
+
+
+class Reducer:
+    """Folds the values of an attribute of every entry into a single value,
+    one entry at a time.
+    """
+
+    __slots__ = ("name", "attribute", "reducer", "value", "_seen")
+
+    def __init__(self, name, attribute, reducer):
+        if reducer not in QUERY_REDUCERS:
+            raise ValueError(
+                "Illegal reducer: {} must be one of: {}".format(reducer, QUERY_REDUCERS)
+            )
+        self.name = name
+        self.attribute = attribute
+        self.reducer = reducer
+        self.value = None
+        self._seen = None
+        if reducer == REDUCE_COUNT:
+            self.value = 0
+        elif reducer == REDUCE_COLLECT:
+            self.value, self._seen = [], set()
+
+    def add(self, dn, attributes):
+        values = entry_values(dn, attributes, self.attribute)
+        if not values:
+            return
+        if self.reducer == REDUCE_COUNT:
+            self.value += 1
+        elif self.reducer == REDUCE_FIRST:
+            if self.value is None:
+                self.value = values[0]
+        elif self.reducer == REDUCE_MAX:
+            largest = max(values)
+            if self.value is None or largest > self.value:
+                self.value = largest
+        elif self.reducer == REDUCE_MIN:
+            smallest = min(values)
+            if self.value is None or smallest < self.value:
+                self.value = smallest
+        elif self.reducer == REDUCE_COLLECT:
+            for value in values:
+                if value not in self._seen:
+                    self._seen.add(value)
+                    self.value.append(value)
+
+
+def parse_reducers(reducers):
+    """Turn the reducers of a query into Reducers. Each reducer is either
+    declared as {attribute: reducer}, or as
+    {name: {'reducer': reducer, 'attribute': attribute}} to store the
+    result of the attribute under another name.
+    """
+    parsed = []
+    for name, reducer in reducers.items():
+        if isinstance(reducer, dict):
+            parsed.append(
+                Reducer(name, reducer.get("attribute", name), reducer.get("reducer"))
+            )
+        else:
+            parsed.append(Reducer(name, name, reducer))
+    return parsed
+
+
+def reduce_entries(entries, reducers):
+    """Reduce the (dn, attributes) `entries` with `reducers`, returns the
+    reduced value of each reducer that found a value.
+    """
+    for dn, attributes in entries:
+        for reducer in reducers:
+            reducer.add(dn, attributes)
+    return {
+        reducer.name: reducer.value for reducer in reducers if reducer.value is not None
+    }
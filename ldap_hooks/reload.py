@@ -0,0 +1,281 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from tornado.web import HTTPError, RequestHandler
+from traitlets import TraitError, TraitType, Tuple
+from traitlets.config.loader import JSONFileConfigLoader, PyFileConfigLoader
+from .cache import clear_entry_cache, get_schema_cache
+from .config import LDAP, settings_lock
+from .constants import ENTRY_CACHE_SETTINGS, OPERATIONAL_SETTINGS
+from .memo import clear_result_memo
+from .utils import token_matches
+
+# The settings that the connections to the servers are opened and bound with
+CONNECTION_SETTINGS = ("url", "user", "password", "ssl_cert_path")
+# The settings that the objectClasses of the servers are cached by
+SCHEMA_SETTINGS = ("url",)
+# The settings that the directory mirror is started with
+MIRROR_SETTINGS = CONNECTION_SETTINGS + (
+    "base_dn",
+    "object_classes",
+    "unique_object_attributes",
+    "dynamic_attributes",
+    "directory_mirror",
+    "directory_mirror_page_size",
+    "directory_mirror_sync_interval",
+    "directory_mirror_full_sync_interval",
+)
+
+CONNECTIONS = "connections"
+SCHEMA = "schema"
+ENTRIES = "entries"
+RESULTS = "results"
+MIRROR = "mirror"
+
+# The number of seconds between each check of a watched config file
+WATCH_INTERVAL = 5.0
+
+
+def current_settings():
+    """The settings that are assigned to the LDAP class, and the default
+    value of those that are not.
+    """
+    settings = {}
+    for name, trait in LDAP.class_own_traits().items():
+        value = LDAP.__dict__.get(name, trait)
+        settings[name] = trait.default_value if isinstance(value, TraitType) else value
+    return settings
+
+
+def validate_settings(settings):
+    """Validate `settings` by the traits of the LDAP class, returns the
+    validated values. Raises ValueError if any of them is unknown or invalid.
+    """
+    traits = LDAP.class_own_traits()
+    instance = LDAP()
+    validated = {}
+    for name, value in settings.items():
+        if name not in traits:
+            raise ValueError("unknown LDAP setting: {}".format(name))
+        trait = traits[name]
+        if value is None and trait.allow_none:
+            validated[name] = None
+            continue
+        if isinstance(trait, Tuple) and isinstance(value, list):
+            # JSON has no tuples
+            value = tuple(value)
+        try:
+            validated[name] = trait.validate(instance, value)
+        except TraitError as err:
+            raise ValueError("invalid value of LDAP.{}: {}".format(name, err))
+    return validated
+
+
+def invalidate_caches(changed):
+    """Invalidate the caches whose inputs are among the `changed` settings,
+    returns the names of the invalidated caches.
+    """
+    changed = set(changed)
+    invalidated = []
+    # Nothing is pooled or mirrored before the modules have been imported
+    pool = sys.modules.get(__package__ + ".pool")
+    mirror = sys.modules.get(__package__ + ".mirror")
+    if changed & set(CONNECTION_SETTINGS) and pool is not None:
+        pool.get_idle_connections().clear()
+        invalidated.append(CONNECTIONS)
+    if changed & set(SCHEMA_SETTINGS):
+        get_schema_cache().clear()
+        invalidated.append(SCHEMA)
+    if changed & set(ENTRY_CACHE_SETTINGS):
+        clear_entry_cache()
+        invalidated.append(ENTRIES)
+    if changed - set(OPERATIONAL_SETTINGS):
+        clear_result_memo()
+        invalidated.append(RESULTS)
+    if changed & set(MIRROR_SETTINGS) and mirror is not None:
+        if mirror.stop_directory_mirror():
+            invalidated.append(MIRROR)
+    return invalidated
+
+
+_reload_status = {
+    "generation": 0,
+    "reloaded_at": None,
+    "source": None,
+    "changed": [],
+    "invalidated": [],
+    "error": None,
+}
+_reload_status_lock = threading.Lock()
+
+
+def record_reload(source, changed=None, invalidated=None, error=None):
+    with _reload_status_lock:
+        if error is None:
+            _reload_status["generation"] += 1
+            _reload_status["reloaded_at"] = time.time()
+            _reload_status["changed"] = list(changed)
+            _reload_status["invalidated"] = list(invalidated)
+        _reload_status["source"] = source
+        _reload_status["error"] = error
+
+
+def config_reload_status():
+    """The outcome of the latest reload of the settings."""
+    with _reload_status_lock:
+        return dict(_reload_status)
+
+
+def reload_settings(settings, logger=None, source="api"):
+    """Validate `settings` and assign them to the LDAP class at once, the
+    hooks that start afterwards use them. Settings that are not given keep
+    their value. Returns the names of the changed settings and of the
+    caches that were invalidated because of them.
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    validated = validate_settings(settings)
+    with settings_lock:
+        current = current_settings()
+        changed = sorted(
+            name for name, value in validated.items() if current[name] != value
+        )
+        for name in changed:
+            setattr(LDAP, name, validated[name])
+    invalidated = invalidate_caches(changed)
+    record_reload(source, changed, invalidated)
+    logger.info(
+        "LDAP - reloaded the settings of: {}, changed: {}, invalidated: {}".format(
+            source, changed, invalidated
+        )
+    )
+    return {"changed": changed, "invalidated": invalidated}
+
+
+def load_config_file(path):
+    """The LDAP settings of the traitlets config file at `path`, E.g. a
+    .py file that sets c.LDAP.url, or a .json file with an "LDAP" object.
+    """
+    directory, filename = os.path.split(os.path.abspath(path))
+    if filename.endswith(".json"):
+        loader = JSONFileConfigLoader(filename, path=directory)
+    else:
+        loader = PyFileConfigLoader(filename, path=directory)
+    return dict(loader.load_config().LDAP)
+
+
+def reload_config_file(path, logger=None):
+    return reload_settings(load_config_file(path), logger=logger, source=path)
+
+
+class ConfigWatcher:
+    """Reloads the LDAP settings of a config file whenever its
+    modification time or size changes.
+    """
+
+    def __init__(self, path, interval=WATCH_INTERVAL, logger=None):
+        self.path = path
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self._stamp = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self):
+        """Reload the config file if it changed since the last check.
+        Returns the result of the reload, None if the file did not change
+        or could not be reloaded, in which case the settings are kept.
+        """
+        stamp = self.stamp()
+        if stamp is None or stamp == self._stamp:
+            return None
+        self._stamp = stamp
+        try:
+            return reload_config_file(self.path, logger=self.logger)
+        except Exception as err:
+            self.logger.error(
+                "LDAP - failed to reload the config file: {}, exception: {}".format(
+                    self.path, err
+                )
+            )
+            record_reload(self.path, error=str(err))
+            return None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="ldap-config-watcher", daemon=True
+        )
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+
+_config_watcher = None
+_config_watcher_lock = threading.Lock()
+
+
+def watch_config(path, interval=WATCH_INTERVAL, logger=None):
+    """Load the LDAP settings of the config file at `path`, and reload
+    them in the background whenever the file changes. Can be called from
+    the jupyterhub_config.py, it returns the process wide watcher.
+    """
+    global _config_watcher
+    with _config_watcher_lock:
+        if _config_watcher is None:
+            _config_watcher = ConfigWatcher(path, interval=interval, logger=logger)
+            _config_watcher.check()
+            _config_watcher.start()
+        return _config_watcher
+
+
+class ConfigReloadHandler(RequestHandler):
+    """Reloads the LDAP settings, E.g. via
+    c.JupyterHub.extra_handlers = [(r"/ldap/reload", ConfigReloadHandler)]
+
+    A POST of a JSON object of settings applies them, an empty POST reloads
+    the watched config file. A GET serves config_reload_status as JSON.
+    The requests must present the config_reload_token.
+    """
+
+    def prepare(self):
+        token = LDAP().config_reload_token
+        if not token_matches(self.request.headers.get("Authorization"), token):
+            raise HTTPError(403)
+
+    def get(self):
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(config_reload_status()))
+
+    def post(self):
+        self.set_header("Content-Type", "application/json")
+        try:
+            if self.request.body.strip():
+                settings = json.loads(self.request.body)
+                if not isinstance(settings, dict):
+                    raise ValueError("the settings must be a JSON object")
+                result = reload_settings(settings, source="api")
+            elif _config_watcher is not None:
+                result = reload_config_file(_config_watcher.path)
+            else:
+                raise ValueError("no config file is watched")
+        except ValueError as err:
+            self.set_status(400)
+            self.write(json.dumps({"error": str(err)}))
+            return
+        self.write(json.dumps(result))
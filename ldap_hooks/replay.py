@@ -0,0 +1,248 @@
+"""Replay the calls of setup_ldap_entry_hook that were recorded to the
+record_path file, E.g. against a local LDAP server that stands in for the
+directory, to benchmark a change with the traffic of a real day of spawns.
+
+    ldap-hooks-replay --config jupyterhub_config.py --url ldap://127.0.0.1 \\
+        --speed 60 ldap-hooks.jsonl
+
+The calls are started at their recorded inter-arrival times divided by
+--speed, or all at once with a --speed of 0, each on one of --workers
+threads such that the blocking LDAP operations of the calls overlap as
+those of the Hub's spawns do, and the branches and timings of the replay
+are reported next to the recorded ones.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import sys
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .record import Recording, get_hook_recorder
+
+REPORT_PERCENTILES = (50, 95, 99)
+# The largest number of replayed calls that run at the same time
+REPLAY_WORKERS = 32
+
+# A recorded call, the Recording of its replay and the number of seconds
+# that the replay was started behind its schedule
+Replayed = namedtuple("Replayed", ["record", "recording", "lag"])
+
+
+def read_recording(stream, logger=None):
+    """The records of the JSONL `stream`, the lines that are not a record
+    are logged and skipped.
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if "name" not in record:
+                raise ValueError("the record has no name")
+        except ValueError as err:
+            logger.error(
+                "LDAP - skipping line {} of the recording: {}".format(number, err)
+            )
+            continue
+        yield record
+
+
+def percentile(samples, percent):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    index = math.ceil(percent / 100.0 * len(samples)) - 1
+    return samples[min(max(index, 0), len(samples) - 1)]
+
+
+def replay_spawner(record, instance, logger):
+    from .spawn import InputSpawner
+
+    inputs = {
+        "name": record["name"],
+        "spawner": record.get("spawner"),
+        "user": record.get("user"),
+    }
+    if "submit" in record:
+        inputs["submit"] = record["submit"]
+    return InputSpawner(inputs, logger, instance.submit_spawner_attribute)
+
+
+async def replay_record(record, provision, due, logger, clock=time.monotonic):
+    """Replay `record` with provision(spawner, instance), it was due to
+    start at the `clock` time `due`.
+    """
+    from .config import LDAP
+
+    lag = max(clock() - due, 0)
+    instance = LDAP()
+    spawner = replay_spawner(record, instance, logger)
+    recording = Recording(
+        record["name"], record.get("submit"), record.get("spawner"), record.get("user")
+    )
+    try:
+        await recording.run(provision, spawner, instance)
+    except Exception as err:
+        logger.error(
+            "LDAP - replay of: {} failed, exception: {}".format(record["name"], err)
+        )
+    if instance.record_path:
+        get_hook_recorder(instance.record_path).write(recording.record())
+    return Replayed(record, recording, lag)
+
+
+def replay_in_thread(record, provision, due, logger, clock):
+    """Replay `record` on an event loop of the calling worker thread, as
+    the in-process provisioning blocks the loop that it runs on.
+    """
+    return asyncio.run(replay_record(record, provision, due, logger, clock))
+
+
+async def replay(
+    records,
+    provision=None,
+    speed=1.0,
+    logger=None,
+    clock=time.monotonic,
+    workers=REPLAY_WORKERS,
+):
+    """Replay `records` with provision(spawner, instance), which is the
+    in-process or remote provisioning of the hook by default. Each call runs
+    on one of `workers` threads, such that the blocking calls overlap.
+    Returns the Replayed calls.
+    """
+    if provision is None:
+        from .hooks import provision_entry as provision
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    # The records are appended as the calls finish
+    records = sorted(records, key=lambda record: record.get("time") or 0)
+    if not records:
+        return []
+    first = records[0].get("time") or 0
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ldap-replay")
+    started = clock()
+    tasks = []
+    try:
+        for record in records:
+            due = started
+            if speed:
+                due += ((record.get("time") or first) - first) / speed
+            delay = due - clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(
+                loop.run_in_executor(
+                    executor, replay_in_thread, record, provision, due, logger, clock
+                )
+            )
+        return list(await asyncio.gather(*tasks))
+    finally:
+        executor.shutdown(wait=False)
+
+
+def summarize(replayed):
+    """The counts of the branches and the percentiles of the durations of
+    the recorded calls and of their replay.
+    """
+    recorded = [call.record for call in replayed]
+    recordings = [call.recording for call in replayed]
+    summary = {"calls": len(replayed)}
+    for label, durations, branches, provisioned in (
+        (
+            "recorded",
+            [record.get("duration") or 0 for record in recorded],
+            [record.get("branch") for record in recorded],
+            [record.get("provisioned") for record in recorded],
+        ),
+        (
+            "replayed",
+            [recording.duration for recording in recordings],
+            [recording.branch for recording in recordings],
+            [recording.provisioned for recording in recordings],
+        ),
+    ):
+        summary[label] = {
+            "provisioned": sum(1 for value in provisioned if value),
+            "branches": dict(Counter(branch or "none" for branch in branches)),
+            "duration": {
+                "p{}".format(percent): percentile(durations, percent)
+                for percent in REPORT_PERCENTILES
+            },
+        }
+        summary[label]["duration"]["max"] = max(durations) if durations else None
+    summary["replayed"]["lag"] = {
+        "max": max((call.lag for call in replayed), default=None)
+    }
+    summary["changed_branches"] = sum(
+        1 for call in replayed if call.record.get("branch") != call.recording.branch
+    )
+    return summary
+
+
+def main(argv=None):
+    from .reload import reload_config_file, reload_settings
+
+    parser = argparse.ArgumentParser(
+        description="Replay the recorded calls of setup_ldap_entry_hook."
+    )
+    parser.add_argument("recording", help="The JSONL file of record_path, - for stdin")
+    parser.add_argument(
+        "--config",
+        required=True,
+        help="The jupyterhub_config.py that defines the LDAP settings",
+    )
+    parser.add_argument(
+        "--url",
+        default=None,
+        help="The LDAP server to replay against instead of the configured url",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="The factor that the recorded inter-arrival times are sped up by, "
+        "0 starts every call at once",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=REPLAY_WORKERS,
+        help="The largest number of replayed calls that run at the same time",
+    )
+    parser.add_argument(
+        "--record",
+        default=None,
+        help="The JSONL file that the replayed calls are recorded to",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    logger = logging.getLogger("ldap_hooks.replay")
+    reload_config_file(args.config, logger=logger)
+    overrides = {"record_path": args.record}
+    if args.url:
+        overrides["url"] = args.url
+    reload_settings(overrides, logger=logger, source="replay")
+
+    if args.recording == "-":
+        records = list(read_recording(sys.stdin, logger))
+    else:
+        with open(args.recording) as stream:
+            records = list(read_recording(stream, logger))
+    replayed = asyncio.run(
+        replay(records, speed=args.speed, logger=logger, workers=args.workers)
+    )
+    print(json.dumps(summarize(replayed), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
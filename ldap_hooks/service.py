@@ -0,0 +1,306 @@
+"""An HTTP service that provisions the LDAP entries of the Hub, E.g. as a
+JupyterHub managed service, such that ldap3 and the blocking LDAP operations
+run outside of the Hub's event loop, and the service scales on its own.
+
+    ldap-hooks-service --config jupyterhub_config.py --url http://127.0.0.1:10101
+
+A POST of {"inputs": ...} to /provision answers with "provisioned" and the
+set_spawner_attributes as "attributes", a GET of /status with the counts of
+the service. The requests must present the token of the service.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlparse
+from tornado.web import Application, HTTPError, RequestHandler
+from .spawn import apply_provision_result, remote_timeout, spawn_inputs
+from .utils import token_matches
+
+# The largest number of requests that are dispatched together
+SERVICE_BATCH_SIZE = 32
+# The number of seconds that a request waits for others to join its batch
+SERVICE_BATCH_WINDOW = 0.01
+# The number of entries that the service provisions concurrently
+SERVICE_WORKERS = 8
+
+
+def inputs_key(inputs):
+    """The key that identical inputs are coalesced by."""
+    return json.dumps(inputs, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class ProvisionBatcher:
+    """Collects the inputs that are submitted within batch_window seconds,
+    or until batch_size of them are pending, and dispatches them together to
+    the workers that call `provision`. Inputs that are identical to pending
+    or running ones are coalesced with them and share their result.
+
+    Must be used from the thread that runs the event loop.
+    """
+
+    def __init__(
+        self,
+        provision,
+        batch_size=SERVICE_BATCH_SIZE,
+        batch_window=SERVICE_BATCH_WINDOW,
+        workers=SERVICE_WORKERS,
+        logger=None,
+    ):
+        self.provision = provision
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.logger = logger or logging.getLogger(__name__)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="ldap-provision"
+        )
+        self._pending = {}
+        self._running = {}
+        self._flush_handle = None
+        self._counts = {
+            "requests": 0,
+            "coalesced": 0,
+            "batches": 0,
+            "provisioned": 0,
+            "failed": 0,
+            "errors": 0,
+        }
+        self.started_at = time.time()
+
+    def status(self):
+        status = dict(self._counts)
+        status["pending"] = len(self._pending)
+        status["running"] = len(self._running)
+        status["uptime"] = time.time() - self.started_at
+        return status
+
+    def submit(self, inputs):
+        """Returns a future of the (provisioned, attributes) of `inputs`."""
+        self._counts["requests"] += 1
+        key = inputs_key(inputs)
+        if key in self._pending:
+            self._counts["coalesced"] += 1
+            return self._pending[key][1]
+        if key in self._running:
+            self._counts["coalesced"] += 1
+            return self._running[key]
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[key] = (inputs, future)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self.flush)
+        return future
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        self._counts["batches"] += 1
+        loop = asyncio.get_running_loop()
+        for key, (inputs, future) in batch.items():
+            self._running[key] = future
+            task = loop.run_in_executor(self.executor, self.provision, inputs)
+            task.add_done_callback(partial(self._finish, key, future))
+
+    def _finish(self, key, future, task):
+        del self._running[key]
+        err = task.exception()
+        if err is not None:
+            self._counts["errors"] += 1
+            self.logger.error(
+                "LDAP - service failed to provision, exception: {}".format(err)
+            )
+            future.set_exception(err)
+            return
+        provisioned, attributes = task.result()
+        self._counts["provisioned" if provisioned else "failed"] += 1
+        future.set_result((provisioned, attributes))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class ServiceHandler(RequestHandler):
+    def initialize(self, batcher, token):
+        self.batcher = batcher
+        self.token = token
+
+    def prepare(self):
+        if not token_matches(self.request.headers.get("Authorization"), self.token):
+            raise HTTPError(403)
+        self.set_header("Content-Type", "application/json")
+
+
+class ProvisionHandler(ServiceHandler):
+    async def post(self):
+        try:
+            inputs = json.loads(self.request.body)["inputs"]
+            if not isinstance(inputs, dict) or "name" not in inputs:
+                raise ValueError("the inputs must be an object with a name")
+        except (ValueError, KeyError, TypeError) as err:
+            self.set_status(400)
+            self.write(json.dumps({"error": str(err)}))
+            return
+        try:
+            provisioned, attributes = await self.batcher.submit(inputs)
+        except Exception as err:
+            self.set_status(500)
+            self.write(json.dumps({"error": str(err)}))
+            return
+        self.write(
+            json.dumps(
+                {"provisioned": provisioned, "attributes": attributes}, default=str
+            )
+        )
+
+
+class StatusHandler(ServiceHandler):
+    def get(self):
+        self.write(json.dumps(self.batcher.status()))
+
+
+def make_app(batcher, token, prefix="/"):
+    """The tornado Application of the service, its endpoints are served at
+    the root and below `prefix`, E.g. the JUPYTERHUB_SERVICE_PREFIX, such
+    that they can be reached both directly and through the proxy.
+    """
+    options = {"batcher": batcher, "token": token}
+    bases = ["/"]
+    if prefix.strip("/"):
+        bases.append("/{}/".format(prefix.strip("/")))
+    handlers = []
+    for base in bases:
+        handlers.append((base + "provision", ProvisionHandler, options))
+        handlers.append((base + "status", StatusHandler, options))
+    return Application(handlers)
+
+
+async def provision_through_service(spawner, instance):
+    """Have the ldap-hooks-service at service_url provision the entry of
+    the spawner's user, and apply the set_spawner_attributes that it returns.
+    """
+    from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+
+    url = instance.service_url.rstrip("/") + "/provision"
+    headers = {"Content-Type": "application/json"}
+    if instance.service_token:
+        headers["Authorization"] = "token {}".format(instance.service_token)
+    body = json.dumps({"inputs": spawn_inputs(spawner, instance)}, default=str)
+    try:
+        response = await AsyncHTTPClient().fetch(
+            url,
+            method="POST",
+            body=body,
+            headers=headers,
+            request_timeout=remote_timeout(instance),
+        )
+        result = json.loads(response.body)
+    except (OSError, ValueError, HTTPClientError) as err:
+        spawner.log.error(
+            "LDAP - failed to reach the provisioning service at: {}, "
+            "exception: {!r}".format(url, err)
+        )
+        return False
+    return apply_provision_result(spawner, result, "the provisioning service")
+
+
+def make_provision(config=None, block_size=1, logger=None):
+    """The function that provisions the entry of some inputs, with the
+    settings of `config` and an IncrementAllocator shared by its calls.
+    """
+    from .bulk import IncrementAllocator
+    from .config import LDAP
+    from .spawn import provision_inputs
+
+    allocator = IncrementAllocator(block_size=block_size)
+    logger = logger or logging.getLogger(__name__)
+
+    def provision(inputs):
+        instance = LDAP(config=config) if config is not None else LDAP()
+        return provision_inputs(inputs, logger, instance=instance, allocator=allocator)
+
+    return provision
+
+
+def main(argv=None):
+    from .bulk import load_config
+
+    parser = argparse.ArgumentParser(
+        description="Provision LDAP entries over HTTP, E.g. as a JupyterHub service."
+    )
+    parser.add_argument(
+        "--config",
+        required=True,
+        help="The jupyterhub_config.py that defines the LDAP settings",
+    )
+    parser.add_argument(
+        "--url",
+        default=os.environ.get("JUPYTERHUB_SERVICE_URL"),
+        help="The URL to listen on, the JUPYTERHUB_SERVICE_URL by default",
+    )
+    parser.add_argument(
+        "--token",
+        default=os.environ.get("JUPYTERHUB_API_TOKEN"),
+        help="The token that requests must present, the JUPYTERHUB_API_TOKEN "
+        "by default",
+    )
+    parser.add_argument("--batch-size", type=int, default=SERVICE_BATCH_SIZE)
+    parser.add_argument("--batch-window", type=float, default=SERVICE_BATCH_WINDOW)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=1,
+        help="The number of uidNumbers that are reserved at a time",
+    )
+    args = parser.parse_args(argv)
+    if not args.url:
+        parser.error("--url or JUPYTERHUB_SERVICE_URL is required")
+    if not args.token:
+        parser.error("--token or JUPYTERHUB_API_TOKEN is required")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    logger = logging.getLogger("ldap_hooks.service")
+    url = urlparse(args.url)
+    provision = make_provision(
+        config=load_config(args.config), block_size=args.block_size, logger=logger
+    )
+
+    async def serve():
+        batcher = ProvisionBatcher(
+            provision,
+            batch_size=args.batch_size,
+            batch_window=args.batch_window,
+            workers=args.workers,
+            logger=logger,
+        )
+        app = make_app(
+            batcher, args.token, os.environ.get("JUPYTERHUB_SERVICE_PREFIX", "/")
+        )
+        app.listen(url.port or 80, address=url.hostname or "")
+        logger.info("LDAP - service listening on: {}".format(args.url))
+        try:
+            await asyncio.Event().wait()
+        finally:
+            batcher.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
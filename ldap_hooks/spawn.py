@@ -0,0 +1,138 @@
+"""The inputs that the hook takes from a spawner, such that the entry of
+its user can be provisioned by another process, E.g. the broker, which
+sends back the set_spawner_attributes that are applied to the spawner.
+"""
+
+from types import SimpleNamespace
+from .accessors import MissingSegment, attribute_accessor
+from .config import LDAP
+from .constants import SPAWNER_ATTRIBUTE, SPAWNER_USER_ATTRIBUTE
+from .record import REMOTE_BROKER, REMOTE_SERVICE, note_branch
+
+# The number of seconds that a spawn waits for the broker or the
+# provisioning service beyond the hook_timeout
+REMOTE_TIMEOUT_MARGIN = 5.0
+
+
+def update_spawner_attributes(spawner, spawner_attributes):
+    for spawner_attr, spawner_value in spawner_attributes.items():
+        if hasattr(spawner, spawner_attr):
+            attr = getattr(spawner, spawner_attr)
+            if isinstance(attr, dict):
+                attr.update(spawner_value)
+            if isinstance(attr, (list, set, tuple, str)):
+                setattr(spawner, spawner_attr, spawner_value)
+        else:
+            setattr(spawner, spawner_attr, spawner_value)
+
+
+def spawn_inputs(spawner, instance):
+    """The user name, the submitted object and the spawner and user
+    attributes that the dynamic_attributes of `instance` refer to.
+    """
+    inputs = {"name": spawner.user.name, "spawner": {}, "user": {}}
+    if instance.submit_spawner_attribute:
+        try:
+            inputs["submit"] = attribute_accessor(instance.submit_spawner_attribute)(
+                spawner
+            )
+        except MissingSegment:
+            # Reported by the process that provisions the entry
+            pass
+    for attr_key, attr_val in instance.dynamic_attributes.items():
+        if attr_val == SPAWNER_ATTRIBUTE:
+            source, target = spawner, inputs["spawner"]
+        elif attr_val == SPAWNER_USER_ATTRIBUTE:
+            source, target = spawner.user, inputs["user"]
+        else:
+            continue
+        try:
+            target[attr_key] = attribute_accessor(attr_key)(source)
+        except MissingSegment:
+            continue
+    return inputs
+
+
+def set_attribute(obj, path, value):
+    """Set the dotted attribute `path` of `obj` to `value`, the missing
+    objects along the path are created.
+    """
+    *parents, name = path.split(".")
+    for parent in parents:
+        if not hasattr(obj, parent):
+            setattr(obj, parent, SimpleNamespace())
+        obj = getattr(obj, parent)
+    setattr(obj, name, value)
+
+
+class InputSpawner:
+    """Stands in for the spawner that `inputs` were taken from by
+    spawn_inputs, the submitted object is found at the
+    submit_spawner_attribute path.
+    """
+
+    def __init__(self, inputs, log, submit_spawner_attribute=None):
+        self.log = log
+        self.name = ""
+        self.user = SimpleNamespace(name=inputs["name"])
+        for path, value in (inputs.get("user") or {}).items():
+            set_attribute(self.user, path, value)
+        for path, value in (inputs.get("spawner") or {}).items():
+            set_attribute(self, path, value)
+        if submit_spawner_attribute and "submit" in inputs:
+            set_attribute(self, submit_spawner_attribute, inputs["submit"])
+
+
+def provision_inputs(inputs, logger, instance=None, allocator=None):
+    """Provision the entry of the spawner that `inputs` were taken from.
+    Returns whether it was provisioned, and the set_spawner_attributes
+    that should be applied to the spawner.
+    """
+    from .hooks import setup_ldap_entry
+
+    if instance is None:
+        instance = LDAP()
+    spawner = InputSpawner(inputs, logger, instance.submit_spawner_attribute)
+    if not setup_ldap_entry(spawner, instance, allocator=allocator):
+        return False, {}
+    return True, {
+        name: getattr(spawner, name)
+        for name in instance.set_spawner_attributes
+        if hasattr(spawner, name)
+    }
+
+
+def remote_timeout(instance):
+    if instance.hook_timeout is None:
+        return None
+    return instance.hook_timeout + REMOTE_TIMEOUT_MARGIN
+
+
+def apply_provision_result(spawner, result, provider):
+    """Apply the set_spawner_attributes of the `result` that `provider`
+    returned for provision_inputs, returns whether it provisioned the entry.
+    """
+    if not result.get("provisioned"):
+        spawner.log.error(
+            "LDAP - {} did not provision: {}".format(provider, spawner.user.name)
+        )
+        return False
+    update_spawner_attributes(spawner, result.get("attributes") or {})
+    return True
+
+
+async def provision_remotely(spawner, instance):
+    """Provision the entry through the broker_socket or the service_url if
+    either is set. Returns whether it was provisioned, None if neither is set.
+    """
+    if instance.broker_socket:
+        from .broker import provision_through_broker
+
+        note_branch(REMOTE_BROKER)
+        return await provision_through_broker(spawner, instance)
+    if instance.service_url:
+        from .service import provision_through_service
+
+        note_branch(REMOTE_SERVICE)
+        return await provision_through_service(spawner, instance)
+    return None
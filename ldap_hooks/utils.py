@@ -1,3 +1,6 @@
+import hmac
+
+
 def recursive_format(input, value):
     if isinstance(input, list):
         for item_index, item_value in enumerate(input):
@@ -17,3 +20,13 @@ def recursive_format(input, value):
             recursive_format(input_value, value)
     if hasattr(input, "__dict__"):
         recursive_format(input.__dict__, value)
+
+
+def token_matches(authorization, token):
+    """Whether the `authorization` header of a request presents `token`,
+    as in 'Authorization: token <token>'. Never if `token` is not set.
+    """
+    scheme, _, presented = (authorization or "").partition(" ")
+    if not token or scheme.lower() != "token":
+        return False
+    return hmac.compare_digest(presented.strip().encode(), token.encode())
@@ -0,0 +1,424 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from ldap3 import MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
+from ldap3.core.exceptions import LDAPException
+from .constants import BLOCK, DROP_NEWEST, DROP_OLDEST, OVERFLOW_POLICIES
+from .ldap import modify_dn
+from .pool import ServerUnavailable
+
+try:
+    from prometheus_client import Counter, Gauge
+except ImportError:
+    Counter = Gauge = None
+
+
+MODIFY_ACTIONS = (MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE)
+
+WRITTEN = "written"
+MERGED = "merged"
+RETRIED = "retried"
+DROPPED = "dropped"
+FAILED = "failed"
+
+WRITE_OUTCOMES = (WRITTEN, MERGED, RETRIED, DROPPED, FAILED)
+
+# Results that a retry of the same modification can't change
+PERMANENT_RESULTS = (
+    "noSuchObject",
+    "noSuchAttribute",
+    "attributeOrValueExists",
+    "undefinedAttributeType",
+    "invalidAttributeSyntax",
+    "objectClassViolation",
+    "insufficientAccessRights",
+)
+
+if Gauge is not None:
+    WRITE_BEHIND_QUEUE_DEPTH = Gauge(
+        "ldap_hooks_write_behind_queue_depth",
+        "Number of deferred LDAP modifications that are waiting to be written",
+    )
+    WRITE_BEHIND_WRITES = Counter(
+        "ldap_hooks_write_behind_writes",
+        "Deferred LDAP modifications by outcome",
+        ["outcome"],
+    )
+else:
+    WRITE_BEHIND_QUEUE_DEPTH = None
+    WRITE_BEHIND_WRITES = None
+
+
+def running_event_loop():
+    """Whether the calling thread runs an event loop, E.g. the Hub's."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def normalize_changes(changes):
+    """Turn the ldap3 `changes` of a modify into the form
+    {attr: [(action, [values])]}.
+    """
+    normalized = {}
+    for attr, operations in changes.items():
+        if isinstance(operations, tuple) and operations[0] in MODIFY_ACTIONS:
+            operations = [operations]
+        normalized[attr] = []
+        for action, values in operations:
+            if action not in MODIFY_ACTIONS:
+                raise ValueError(
+                    "Illegal modify action: {} must be one of: {}".format(
+                        action, MODIFY_ACTIONS
+                    )
+                )
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            normalized[attr].append((action, list(values)))
+    return normalized
+
+
+def merge_changes(changes, newer):
+    """Merge the `newer` changes of a DN into the `changes` before them.
+
+    A replace of an attribute supersedes every change of it before,
+    consecutive adds or deletes of values of an attribute are combined.
+    """
+    merged = {attr: list(operations) for attr, operations in changes.items()}
+    names = {attr.lower(): attr for attr in merged}
+    for attr, operations in newer.items():
+        attr = names.setdefault(attr.lower(), attr)
+        current = merged.setdefault(attr, [])
+        for action, values in operations:
+            if action == MODIFY_REPLACE:
+                current[:] = [(action, list(values))]
+                continue
+            if current and values:
+                last_action, last_values = current[-1]
+                # A delete without values removes the attribute
+                if last_action == action and last_values:
+                    current[-1] = (
+                        action,
+                        last_values + [v for v in values if v not in last_values],
+                    )
+                    continue
+            current.append((action, list(values)))
+    return merged
+
+
+class DeferredWrite:
+    """The pending modifications of a single DN."""
+
+    __slots__ = ("dn", "changes", "attempts", "not_before")
+
+    def __init__(self, dn, changes, attempts=0, not_before=0.0):
+        self.dn = dn
+        self.changes = changes
+        self.attempts = attempts
+        self.not_before = not_before
+
+
+class WriteBehindQueue:
+    """Writes deferred modifications to the provider in the background.
+
+    Modifications are queued per DN, where the modifications of a DN that
+    is already queued are merged into a single modify. A worker thread
+    writes the queued DNs in batches of batch_size over a single
+    connection, at least every flush_interval seconds. Failed writes are
+    retried up to max_retries times with an exponential backoff.
+
+    The queue holds at most max_size DNs, a modification of another DN is
+    then handled by the overflow_policy. DROP_NEWEST drops it, DROP_OLDEST
+    drops the oldest queued DN instead, and BLOCK waits for up to
+    block_timeout seconds for room before it drops it. A thread that runs an
+    event loop, E.g. the hook on the Hub's, is never blocked, BLOCK drops the
+    newest modification there.
+    """
+
+    def __init__(
+        self,
+        pool_factory,
+        max_size=10000,
+        batch_size=50,
+        flush_interval=1.0,
+        max_retries=5,
+        retry_backoff=1.0,
+        max_backoff=60.0,
+        overflow_policy=DROP_NEWEST,
+        block_timeout=1.0,
+        logger=None,
+        clock=time.monotonic,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(
+                "Illegal overflow_policy: {} must be one of: {}".format(
+                    overflow_policy, OVERFLOW_POLICIES
+                )
+            )
+        self.pool_factory = pool_factory
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.logger = logger or logging.getLogger(__name__)
+        self.clock = clock
+        self.counts = {outcome: 0 for outcome in WRITE_OUTCOMES}
+        self.in_flight = 0
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._drain_until = None
+        self._thread = None
+
+    def __len__(self):
+        with self._condition:
+            return len(self._pending)
+
+    def _count(self, outcome, count=1):
+        with self._condition:
+            self.counts[outcome] += count
+        if WRITE_BEHIND_WRITES is not None:
+            WRITE_BEHIND_WRITES.labels(outcome=outcome).inc(count)
+
+    def _report_depth(self):
+        if WRITE_BEHIND_QUEUE_DEPTH is not None:
+            WRITE_BEHIND_QUEUE_DEPTH.set(len(self._pending) + self.in_flight)
+
+    def _make_room(self):
+        """Whether there is room for another DN, per the overflow_policy.
+        Called with the condition held.
+        """
+        if len(self._pending) < self.max_size:
+            return True
+        if self.overflow_policy == DROP_OLDEST:
+            _, dropped = self._pending.popitem(last=False)
+            self.logger.warning(
+                "LDAP - write-behind queue is full, dropped the "
+                "modifications of: {}".format(dropped.dn)
+            )
+            self._count(DROPPED)
+            return True
+        if self.overflow_policy == BLOCK and not running_event_loop():
+            self._condition.wait_for(
+                lambda: len(self._pending) < self.max_size or self._closed,
+                timeout=self.block_timeout,
+            )
+            return len(self._pending) < self.max_size and not self._closed
+        return False
+
+    def put(self, dn, changes):
+        """Queue the ldap3 `changes` of `dn`, returns whether they were
+        queued rather than dropped.
+        """
+        changes = normalize_changes(changes)
+        key = dn.lower()
+        with self._condition:
+            if self._closed:
+                self.logger.warning(
+                    "LDAP - write-behind queue is closed, dropped the "
+                    "modifications of: {}".format(dn)
+                )
+                self._count(DROPPED)
+                return False
+            queued = self._pending.get(key)
+            if queued is not None:
+                queued.changes = merge_changes(queued.changes, changes)
+                self._count(MERGED)
+                return True
+            if not self._make_room():
+                self.logger.warning(
+                    "LDAP - write-behind queue is full, dropped the "
+                    "modifications of: {}".format(dn)
+                )
+                self._count(DROPPED)
+                return False
+            queued = self._pending.get(key)
+            if queued is not None:
+                # Queued by another thread while blocked for room
+                queued.changes = merge_changes(queued.changes, changes)
+                self._count(MERGED)
+                return True
+            self._pending[key] = DeferredWrite(dn, changes)
+            self._report_depth()
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+        return True
+
+    def _take(self):
+        """Take the next batch of writes that are due, called with
+        the condition held.
+        """
+        now = self.clock()
+        draining = self._drain_until is not None
+        batch = []
+        for key, write in self._pending.items():
+            if draining or write.not_before <= now:
+                batch.append(key)
+                if len(batch) >= self.batch_size:
+                    break
+        writes = [self._pending.pop(key) for key in batch]
+        self.in_flight = len(writes)
+        return writes
+
+    def _requeue(self, write, reason):
+        write.attempts += 1
+        if write.attempts > self.max_retries:
+            self.logger.error(
+                "LDAP - gave up writing the deferred modifications of: {} "
+                "after {} attempts: {}".format(write.dn, write.attempts, reason)
+            )
+            self._count(FAILED)
+            return
+        backoff = min(self.max_backoff, self.retry_backoff * 2 ** (write.attempts - 1))
+        write.not_before = self.clock() + backoff
+        key = write.dn.lower()
+        with self._condition:
+            queued = self._pending.get(key)
+            if queued is not None:
+                # Keep the order of the modifications of the DN
+                write.changes = merge_changes(write.changes, queued.changes)
+            elif len(self._pending) >= self.max_size:
+                self.logger.error(
+                    "LDAP - write-behind queue is full, dropped the retry "
+                    "of: {}".format(write.dn)
+                )
+                self._count(DROPPED)
+                return
+            self._pending[key] = write
+        self._count(RETRIED)
+
+    def write_batch(self, writes):
+        """Write a batch of deferred writes over a single connection
+        to the provider, the failed writes are queued to be retried.
+        """
+        written = 0
+        pool = self.pool_factory()
+        try:
+            connection = pool.writer().get_connection()
+            for write in writes:
+                if modify_dn(connection, write.dn, write.changes):
+                    self._count(WRITTEN)
+                elif connection.result.get("description") in PERMANENT_RESULTS:
+                    self.logger.error(
+                        "LDAP - failed to write the deferred modifications "
+                        "of: {}, result: {}".format(write.dn, connection.result)
+                    )
+                    self._count(FAILED)
+                else:
+                    self._requeue(write, connection.result)
+                written += 1
+            pool.record_success()
+        except (ServerUnavailable, LDAPException) as err:
+            pool.record_failure(pool.current)
+            self.logger.warning(
+                "LDAP - failed to write {} deferred modifications, "
+                "exception: {}".format(len(writes) - written, err)
+            )
+            for write in writes[written:]:
+                self._requeue(write, err)
+        finally:
+            pool.disconnect()
+
+    def _due(self):
+        if self._drain_until is not None:
+            return bool(self._pending)
+        now = self.clock()
+        due = sum(1 for write in self._pending.values() if write.not_before <= now)
+        return due >= self.batch_size
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._due():
+                    self._condition.wait(self.flush_interval)
+                if self._drain_until is not None and (
+                    not self._pending or self.clock() >= self._drain_until
+                ):
+                    return
+                writes = self._take()
+                self._report_depth()
+            if writes:
+                self.write_batch(writes)
+            with self._condition:
+                self.in_flight = 0
+                self._report_depth()
+                self._condition.notify_all()
+
+    def start(self):
+        if self._thread is not None:
+            return self._thread
+        self._thread = threading.Thread(
+            target=self._run, name="ldap-write-behind", daemon=True
+        )
+        self._thread.start()
+        return self._thread
+
+    def drain(self, timeout=10.0):
+        """Stop accepting modifications and write the queued ones, waiting
+        for at most `timeout` seconds. Returns the number of DNs whose
+        modifications were not written.
+        """
+        with self._condition:
+            self._closed = True
+            self._drain_until = self.clock() + timeout
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._condition:
+            lost = len(self._pending)
+        if lost:
+            self.logger.error(
+                "LDAP - write-behind queue was drained with {} DNs "
+                "left unwritten".format(lost)
+            )
+        return lost
+
+    def status(self):
+        with self._condition:
+            status = {
+                "depth": len(self._pending),
+                "in_flight": self.in_flight,
+                "max_size": self.max_size,
+                "overflow_policy": self.overflow_policy,
+            }
+            status.update(self.counts)
+            return status
+
+
+_write_behind_queue = None
+_write_behind_queue_lock = threading.Lock()
+
+
+def get_write_behind_queue():
+    return _write_behind_queue
+
+
+def start_write_behind_queue(pool_factory, drain_timeout=10.0, **settings):
+    """Return the process wide write-behind queue, it is created and its
+    worker started on the first call. The queue is drained when the Hub
+    process exits.
+    """
+    global _write_behind_queue
+    with _write_behind_queue_lock:
+        if _write_behind_queue is None:
+            _write_behind_queue = WriteBehindQueue(pool_factory, **settings)
+            _write_behind_queue.start()
+            atexit.register(_write_behind_queue.drain, drain_timeout)
+        return _write_behind_queue
+
+
+def write_behind_status():
+    """The status of the write-behind queue, None if it was not started."""
+    queue = get_write_behind_queue()
+    if queue is None:
+        return None
+    return queue.status()
@@ -38,6 +38,16 @@ setup(
         "test": read_req("tests/requirements.txt"),
         "dev": read_req("requirements-dev.txt"),
     },
+    entry_points={
+        "console_scripts": [
+            "ldap-hooks-bulk-provision = ldap_hooks.bulk:main",
+            "ldap-hooks-reconcile = ldap_hooks.reconcile:main",
+            "ldap-hooks-ldif = ldap_hooks.ldif:main",
+            "ldap-hooks-broker = ldap_hooks.broker:main",
+            "ldap-hooks-service = ldap_hooks.service:main",
+            "ldap-hooks-replay = ldap_hooks.replay:main",
+        ]
+    },
     project_urls={"Source Code": "https://github.com/rasmunk/ldap_hooks"},
     classifiers=[
         "Intended Audience :: Developers",
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+import pytest
+from ldap_hooks.accessors import MissingSegment, attribute_accessor, key_accessor
+
+
+def test_attribute_accessor():
+    spawner = SimpleNamespace(user=SimpleNamespace(name="alice", data={}))
+    assert attribute_accessor("user.name")(spawner) == "alice"
+    # A falsy intermediate value is still followed
+    assert attribute_accessor("user.data")(spawner) == {}
+    assert attribute_accessor("user.name") is attribute_accessor("user.name")
+
+    with pytest.raises(MissingSegment) as err:
+        attribute_accessor("user.profile.dn")(spawner)
+    assert (err.value.segment, err.value.index) == ("profile", 1)
+
+
+def test_key_accessor():
+    data = {"User": {"DN": "/CN=alice"}, "DN": "/CN=other"}
+    assert key_accessor(("User", "DN"))(data) == "/CN=alice"
+
+    # The keys are not looked up in the outer dict once a level is missing
+    with pytest.raises(MissingSegment) as err:
+        key_accessor(("Person", "DN"))(data)
+    assert (err.value.segment, err.value.index) == ("Person", 0)
+    with pytest.raises(MissingSegment) as err:
+        key_accessor(("User", "DN", "CN"))(data)
+    assert (err.value.segment, err.value.index) == ("CN", 2)
+
+
+def test_hooks_wrappers():
+    from ldap_hooks import get_attr, rec_get_attr, tuple_dict_select
+
+    spawner = SimpleNamespace(user=SimpleNamespace(name="alice"))
+    assert get_attr(spawner, "user").name == "alice"
+    assert get_attr(spawner, "server") is False
+    assert rec_get_attr(spawner, "user.name") == "alice"
+    assert rec_get_attr(spawner, "user.data") is False
+    assert tuple_dict_select(("User", "DN"), {"User": {"DN": "/CN=a"}}) == "/CN=a"
+    with pytest.raises(KeyError):
+        tuple_dict_select(["Person"], {"User": {}})
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import pytest
+from ldap3 import MOCK_ASYNC, MODIFY_REPLACE
+from ldap3.core.exceptions import LDAPSessionTerminatedByServerError
+from ldap3.strategy.base import RESPONSE_COMPLETE
+from ldap_hooks.ldap import AsyncConnectionManager, ResponseFutures
+
+
+def test_concurrent_operations_share_a_connection():
+    async def run():
+        conn_manager = AsyncConnectionManager("mock", client_strategy=MOCK_ASYNC)
+        await conn_manager.connect()
+        assert conn_manager.is_connected()
+        for name in ("alice", "bob"):
+            conn_manager.get_connection().strategy.add_entry(
+                "cn={},dc=example,dc=org".format(name),
+                {"objectClass": ["person"], "cn": name, "sn": name},
+            )
+        results = await asyncio.gather(
+            *[
+                conn_manager.search(
+                    "dc=example,dc=org", "(cn={})".format(name), attributes=["sn"]
+                )
+                for name in ("alice", "bob", "carol")
+            ]
+        )
+        modified = await conn_manager.modify(
+            "cn=alice,dc=example,dc=org", {"sn": [(MODIFY_REPLACE, ["Alice"])]}
+        )
+        await conn_manager.disconnect()
+        return results, modified
+
+    results, modified = asyncio.run(run())
+    assert len({result.message_id for result in results}) == 3
+    assert results[0].get_response_attributes() == {"sn": ["alice"]}
+    assert results[1].get_response_attributes() == {"sn": ["bob"]}
+    assert not results[2].success
+    assert modified.success
+
+
+class FakeStrategy:
+    def __init__(self):
+        self.async_lock = threading.Lock()
+        self._responses = {}
+
+    def set_event_for_message(self, message_id):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_response_futures_resolved_by_receiver():
+    async def run():
+        strategy = FakeStrategy()
+        futures = ResponseFutures(strategy, asyncio.get_running_loop())
+        pending, answered = futures.watch(1), futures.watch(2)
+
+        def receive():
+            with strategy.async_lock:
+                strategy._responses[2] = [{"type": "modifyResponse"}, RESPONSE_COMPLETE]
+            strategy.set_event_for_message(2)
+            strategy.close()
+
+        threading.Thread(target=receive).start()
+        assert await answered == 2
+        with pytest.raises(LDAPSessionTerminatedByServerError):
+            await pending
+
+    asyncio.run(run())
@@ -0,0 +1,57 @@
+from ldap_hooks.breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from .util import FakeClock
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker("ldap://test", failure_threshold=2, clock=FakeClock())
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+
+
+def test_breaker_half_open_trial():
+    clock = FakeClock()
+    breaker = CircuitBreaker(
+        "ldap://test", failure_threshold=1, cooldown=10.0, clock=clock
+    )
+    breaker.record_failure()
+    clock.now = 10.0
+    assert breaker.state == HALF_OPEN
+    # Only a single trial request is let through
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    clock.now = 20.0
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.status()["failures"] == 0
+
+
+def test_unrecorded_trial_expires():
+    clock = FakeClock()
+    breaker = CircuitBreaker(
+        "ldap://test", failure_threshold=1, cooldown=10.0, clock=clock
+    )
+    breaker.record_failure()
+    clock.now = 10.0
+    # The outcome of the trial is never recorded
+    assert breaker.allow_request()
+    clock.now = 19.0
+    assert not breaker.allow_request()
+    clock.now = 20.0
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_disabled_breaker():
+    breaker = CircuitBreaker("ldap://test", failure_threshold=0, clock=FakeClock())
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.allow_request()
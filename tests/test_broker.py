@@ -0,0 +1,117 @@
+import asyncio
+import io
+import logging
+import os
+import socketserver
+import stat
+import threading
+from types import SimpleNamespace
+import pytest
+from ldap_hooks import SPAWNER_ATTRIBUTE, SPAWNER_USER_ATTRIBUTE
+from ldap_hooks import spawn
+from ldap_hooks.broker import (
+    LDAPBroker,
+    encode_message,
+    provision_through_broker,
+    read_message,
+    request_broker,
+)
+from ldap_hooks.spawn import InputSpawner, spawn_inputs
+
+logger = logging.getLogger(__name__)
+
+
+def settings(**extra):
+    return SimpleNamespace(
+        submit_spawner_attribute="user.data",
+        dynamic_attributes={"uid": SPAWNER_USER_ATTRIBUTE, "port": SPAWNER_ATTRIBUTE},
+        hook_timeout=None,
+        **extra
+    )
+
+
+def new_spawner(name):
+    user = SimpleNamespace(name=name, uid=1000, data={"PersonDN": "/CN=" + name})
+    return SimpleNamespace(user=user, port=8888, log=logger, environment={"A": "1"})
+
+
+def test_spawn_inputs_round_trip():
+    inputs = spawn_inputs(new_spawner("alice"), settings())
+    assert inputs == {
+        "name": "alice",
+        "submit": {"PersonDN": "/CN=alice"},
+        "spawner": {"port": 8888},
+        "user": {"uid": 1000},
+    }
+    spawner = InputSpawner(inputs, logger, "user.data")
+    assert spawner.user.name == "alice"
+    assert spawner.user.data == {"PersonDN": "/CN=alice"}
+    assert (spawner.user.uid, spawner.port) == (1000, 8888)
+
+    assert read_message(io.BytesIO(encode_message(inputs))) == inputs
+    assert read_message(io.BytesIO(b"")) is None
+    with pytest.raises(ValueError):
+        read_message(io.BytesIO(encode_message(inputs)[:-1]))
+
+
+def test_broker_provisions_for_clients(tmp_path, monkeypatch):
+    def fake_provision_inputs(inputs, logger, instance=None, allocator=None):
+        if inputs["name"] == "mallory":
+            return False, {}
+        return True, {"environment": {"NB_UID": str(inputs["user"]["uid"])}}
+
+    monkeypatch.setattr(spawn, "provision_inputs", fake_provision_inputs)
+    path = str(tmp_path / "broker.sock")
+    broker = LDAPBroker(path, logger=logger)
+    broker.start()
+    threading.Thread(target=broker.server.serve_forever, daemon=True).start()
+    try:
+        spawners = [new_spawner("alice"), new_spawner("mallory")]
+
+        async def spawn_all():
+            return await asyncio.gather(
+                *[
+                    provision_through_broker(spawner, settings(broker_socket=path))
+                    for spawner in spawners
+                ]
+            )
+
+        assert asyncio.run(spawn_all()) == [True, False]
+        assert spawners[0].environment == {"A": "1", "NB_UID": "1000"}
+        assert spawners[1].environment == {"A": "1"}
+
+        status = asyncio.run(request_broker(path, {"op": "status"}))["status"]
+        assert (status["provisioned"], status["failed"]) == (1, 1)
+        assert not asyncio.run(request_broker(path, {"op": "unknown"}))["ok"]
+        # A second broker can't take over the socket of a running one
+        with pytest.raises(OSError):
+            LDAPBroker(path).remove_stale_socket()
+    finally:
+        broker.shutdown()
+        broker.close()
+
+    assert not asyncio.run(
+        provision_through_broker(new_spawner("alice"), settings(broker_socket=path))
+    )
+
+
+def test_broker_socket_is_bound_private(tmp_path, monkeypatch):
+    bound_modes = []
+    server_bind = socketserver.UnixStreamServer.server_bind
+
+    def recording_bind(server):
+        server_bind(server)
+        bound_modes.append(stat.S_IMODE(os.stat(server.server_address).st_mode))
+
+    monkeypatch.setattr(socketserver.UnixStreamServer, "server_bind", recording_bind)
+    path = str(tmp_path / "broker.sock")
+    broker = LDAPBroker(path, mode=0o660, logger=logger)
+    umask = os.umask(0o022)
+    try:
+        broker.start()
+        assert os.umask(0o022) == 0o022
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o660
+    finally:
+        os.umask(umask)
+        broker.close()
+    assert bound_modes == [0o600]
@@ -0,0 +1,127 @@
+import io
+import json
+import logging
+from ldap_hooks import INCREMENT_ATTRIBUTE
+from ldap_hooks.bulk import IncrementAllocator, read_records, read_state
+
+logger = logging.getLogger(__name__)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.changes = []
+
+    def modify(self, dn, changes, controls=None):
+        self.changes.append((dn, changes))
+        return True
+
+
+class FakeConnectionManager:
+    def __init__(self):
+        self.connection = FakeConnection()
+
+    def get_connection(self):
+        return self.connection
+
+
+class CounterConnection:
+    """A counter entry that another writer moves by `moves` after each
+    read, before the modify of the reservation.
+    """
+
+    def __init__(self, value, moves=0):
+        self.value = value
+        self.moves = moves
+        self.modifies = 0
+        self.response = []
+
+    def modify(self, dn, changes, controls=None):
+        self.modifies += 1
+        (_, [old]), (_, [new]) = changes["uidNumber"]
+        if old != self.value:
+            return False
+        self.value = new
+        return True
+
+    def search(self, search_base, search_filter, **kwargs):
+        self.response = [
+            {
+                "dn": search_base,
+                "type": "searchResEntry",
+                "attributes": {"uidNumber": [self.value]},
+            }
+        ]
+        self.value += self.moves
+        return True
+
+
+def test_read_records():
+    csv_records = "name,data.PersonDN\nalice,/CN=alice\nbob,\n"
+    assert list(read_records(io.StringIO(csv_records), "csv")) == [
+        {"name": "alice", "data": {"PersonDN": "/CN=alice"}},
+        {"name": "bob"},
+    ]
+    jsonl_records = '{"name": "alice"}\n\n{"name": "bob"}\n'
+    assert [r["name"] for r in read_records(io.StringIO(jsonl_records), "jsonl")] == [
+        "alice",
+        "bob",
+    ]
+
+
+def test_read_state(tmp_path):
+    path = tmp_path / "state.jsonl"
+    path.write_text(
+        json.dumps({"name": "alice", "status": "provisioned"})
+        + "\n"
+        + json.dumps({"name": "bob", "status": "failed"})
+        + '\n{"name": "car'
+    )
+    assert read_state(str(path)) == {"alice"}
+    assert read_state(str(tmp_path / "missing.jsonl")) == set()
+
+
+def test_increment_allocator_blocks():
+    allocator = IncrementAllocator(block_size=3)
+    conn_manager = FakeConnectionManager()
+    operation = {"action": INCREMENT_ATTRIBUTE, "modify_dn": "cn=uidNext"}
+    values = [
+        allocator.allocate(logger, conn_manager, operation, "uidNumber", 2000)
+        for _ in range(5)
+    ]
+    assert values == [2001, 2002, 2003, 2004, 2005]
+    # A single modify per block, the second one from our own reservation
+    changes = [change["uidNumber"] for _, change in conn_manager.connection.changes]
+    assert len(changes) == 2
+    assert changes[1][0][1] == [2003]
+    assert changes[1][1][1] == [2006]
+
+    # Each value is reserved on its own, past the values handed out already
+    allocator = IncrementAllocator(block_size=1)
+    values = [
+        allocator.allocate(logger, conn_manager, operation, "uidNumber", 2000)
+        for _ in range(2)
+    ]
+    assert values == [2001, 2002]
+
+
+def test_increment_allocator_rereads_a_moved_counter():
+    operation = {"action": INCREMENT_ATTRIBUTE, "modify_dn": "cn=uidNext"}
+    # The counter moved from the 2000 that was read before the reservation
+    conn_manager = FakeConnectionManager()
+    conn_manager.connection = CounterConnection(2010)
+    allocator = IncrementAllocator(block_size=3)
+    values = [
+        allocator.allocate(logger, conn_manager, operation, "uidNumber", 2000)
+        for _ in range(2)
+    ]
+    assert values == [2011, 2012]
+    assert conn_manager.connection.value == 2013
+    assert conn_manager.connection.modifies == 2
+
+    # A counter that keeps moving fails after the bounded attempts
+    conn_manager.connection = CounterConnection(2010, moves=1)
+    allocator = IncrementAllocator(block_size=3, attempts=3)
+    assert (
+        allocator.allocate(logger, conn_manager, operation, "uidNumber", 2000) is False
+    )
+    assert conn_manager.connection.modifies == 3
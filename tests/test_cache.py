@@ -0,0 +1,113 @@
+import datetime
+from ldap_hooks.cache import PersistentEntryCache
+from ldap_hooks.entry import CompactEntry
+from ldap_hooks.memo import entry_version
+from .util import FakeClock
+
+
+def test_persistent_entry_cache_survives_restart(tmp_path):
+    path = str(tmp_path / "entries.sqlite")
+    clock = FakeClock(1000.0)
+    cache = PersistentEntryCache(path, clock=clock)
+    entry = CompactEntry("uid=alice", {"uid": ["alice"], "uidNumber": 1000})
+    cache.set("uid=alice,dc=example,dc=org", entry)
+    cache.close()
+
+    # A new process starts with an empty memory tier
+    restarted = PersistentEntryCache(path, clock=clock)
+    cached = restarted.get("uid=alice,dc=example,dc=org", max_age=60)
+    assert cached["uid"] == ["alice"]
+    assert cached["uidNumber"] == 1000
+    assert cached.dn == "uid=alice"
+
+    # The age of an entry is kept across restarts
+    clock.now += 120
+    restarted.clear()
+    restarted.set("uid=bob,dc=example,dc=org", CompactEntry("uid=bob", {"uid": "bob"}))
+    restarted.close()
+    clock.now += 120
+    restarted = PersistentEntryCache(path, clock=clock)
+    assert restarted.get("uid=bob,dc=example,dc=org", max_age=60) is None
+    assert restarted.get("uid=bob,dc=example,dc=org", max_age=300)["uid"] == "bob"
+
+
+def test_persistent_entry_cache_shared(tmp_path):
+    path = str(tmp_path / "entries.sqlite")
+    first = PersistentEntryCache(path)
+    second = PersistentEntryCache(path)
+    first.set("uid=alice", CompactEntry("uid=alice", {"uid": ["alice"]}))
+    assert second.get("uid=alice")["uid"] == ["alice"]
+    second.delete("uid=alice")
+    assert first._load("uid=alice") is None
+
+
+def test_persistent_entry_cache_scopes(tmp_path):
+    path = str(tmp_path / "entries.sqlite")
+    first = PersistentEntryCache(path, scope="a")
+    second = PersistentEntryCache(path, scope="a")
+    first.set("uid=alice", CompactEntry("uid=alice", {"uid": ["alice"]}))
+    # Clearing the cache of one Hub keeps the rows of the others
+    first.clear()
+    assert "uid=alice" not in first
+    assert second.get("uid=alice")["uid"] == ["alice"]
+    assert first.get("uid=alice")["uid"] == ["alice"]
+
+    # A Hub whose settings changed misses on the rows of the old ones
+    second.set_scope("b")
+    assert "uid=alice" not in second
+    assert second.get("uid=alice") is None
+    second.set("uid=alice", CompactEntry("uid=alice", {"uid": ["alicia"]}))
+    assert PersistentEntryCache(path, scope="a").get("uid=alice")["uid"] == ["alice"]
+    assert PersistentEntryCache(path, scope="b").get("uid=alice")["uid"] == ["alicia"]
+
+
+def test_stale_while_revalidate():
+    from ldap_hooks import hooks
+    from ldap_hooks.cache import EntryCache
+
+    class Instance:
+        entry_cache_ttl = 60.0
+        entry_cache_hard_ttl = 600.0
+        entry_cache_max_age = 3600.0
+
+    clock = FakeClock(1000.0)
+    cache = EntryCache(clock=clock)
+    cache.set("uid=alice", CompactEntry("uid=alice", {"uid": "alice"}))
+
+    # Fresh within the soft TTL
+    attributes, stale = hooks.lookup_cached_entry(Instance, cache, "uid=alice")
+    assert attributes["uid"] == "alice" and not stale
+
+    # Served stale between the soft and the hard TTL
+    clock.now += 300
+    attributes, stale = hooks.lookup_cached_entry(Instance, cache, "uid=alice")
+    assert attributes["uid"] == "alice" and stale
+
+    # Past the hard TTL the spawn searches the directory
+    clock.now += 600
+    assert hooks.lookup_cached_entry(Instance, cache, "uid=alice") == (None, False)
+
+    # Unless the refresh failed, then up to entry_cache_max_age
+    hooks._revalidation_failures.add("uid=alice")
+    try:
+        attributes, stale = hooks.lookup_cached_entry(Instance, cache, "uid=alice")
+        assert attributes["uid"] == "alice" and stale
+        clock.now += 3600
+        assert hooks.lookup_cached_entry(Instance, cache, "uid=alice") == (None, False)
+    finally:
+        hooks._revalidation_failures.discard("uid=alice")
+
+
+def test_persistent_entry_version_round_trip(tmp_path):
+    path = str(tmp_path / "entries.sqlite")
+    modified = datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone.utc)
+    attributes = {"uid": ["alice"], "modifyTimestamp": modified}
+    cache = PersistentEntryCache(path)
+    cache.set("uid=alice", CompactEntry("uid=alice", attributes))
+    cache.close()
+
+    restarted = PersistentEntryCache(path)
+    cached = restarted.get("uid=alice")
+    assert cached["modifyTimestamp"] == modified.isoformat()
+    # The version read from the disk matches the one of the server
+    assert entry_version(cached) == entry_version(attributes)
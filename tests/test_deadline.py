@@ -0,0 +1,51 @@
+import pytest
+from ldap_hooks.deadline import Deadline, DeadlineExceeded
+from .util import FakeClock
+
+
+def test_disabled_deadline():
+    deadline = Deadline(None)
+    deadline.step("connect")
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    assert deadline.operation_timeout() is None
+    assert deadline.operation_timeout(5.0) == 5.0
+    assert deadline.time_limit() == 0
+    assert deadline.time_limit(3) == 3
+
+
+def test_deadline_limits_operations():
+    clock = FakeClock()
+    deadline = Deadline(10.0, clock=clock)
+    assert deadline.operation_timeout(5.0) == 5.0
+    clock.now = 7.5
+    assert deadline.operation_timeout(5.0) == 2.5
+    assert deadline.operation_timeout() == 2.5
+    assert deadline.time_limit() == 3
+    assert deadline.time_limit(1) == 1
+
+
+def test_deadline_exceeded_names_step():
+    clock = FakeClock()
+    deadline = Deadline(1.0, clock=clock)
+    deadline.step("connect")
+    clock.now = 1.5
+    with pytest.raises(DeadlineExceeded) as err:
+        deadline.step("existing entry search")
+    assert err.value.step == "existing entry search"
+    assert "existing entry search" in str(err.value)
+
+
+def test_child_deadline_shares_the_budget():
+    clock = FakeClock()
+    deadline = Deadline(10.0, clock=clock)
+    deadline.step("group membership modify")
+    clock.now = 4.0
+    child = deadline.child()
+    assert child.remaining() == 6.0
+    child.step("connect to ldap://provider")
+    assert [name for name, _ in child.steps] == ["connect to ldap://provider"]
+    assert [name for name, _ in deadline.steps] == ["group membership modify"]
+    clock.now = 11.0
+    with pytest.raises(DeadlineExceeded):
+        child.step("modify")
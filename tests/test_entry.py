@@ -0,0 +1,62 @@
+import logging
+import pickle
+import pytest
+from ldap_hooks.entry import CompactEntry, compact_entry
+from ldap_hooks.hooks import (
+    get_interpolated_dynamic_attributes,
+    LDAP_SEARCH_ATTRIBUTE_QUERY,
+    LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY,
+)
+
+
+def test_compact_entry_mapping():
+    entry = CompactEntry(
+        "uid=alice,dc=example,dc=org", {"uid": ["alice"], "uidNumber": 1000}
+    )
+    assert entry["uid"] == ["alice"]
+    assert entry["UIDNUMBER"] == 1000
+    assert "uidnumber" in entry
+    assert "mail" not in entry
+    assert list(entry) == ["uid", "uidNumber"]
+    assert len(entry) == 2
+    with pytest.raises(KeyError):
+        entry["mail"]
+    with pytest.raises(AttributeError):
+        entry.extra = True
+    assert compact_entry(entry.dn, entry) is entry
+    assert pickle.loads(pickle.dumps(entry)) == entry
+
+
+def test_compact_entry_shares_layout():
+    first = CompactEntry("uid=a", {"uid": ["a"], "uidNumber": 1})
+    second = CompactEntry("uid=b", {"uid": ["b"], "uidNumber": 2})
+    assert first._layout is second._layout
+    assert first.raw_attributes is None
+
+
+def test_compact_entry_interpolation():
+    entry = CompactEntry("uid=alice", {"uid": ["alice"], "uidNumber": 1000})
+    sources = {
+        LDAP_SEARCH_ATTRIBUTE_QUERY: entry,
+        LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY: entry,
+    }
+    dynamic_attributes = {
+        "uidNumber": LDAP_SEARCH_ATTRIBUTE_QUERY,
+        "uid": LDAP_FIRST_SEARCH_ATTRIBUTE_QUERY,
+    }
+    result = get_interpolated_dynamic_attributes(
+        logging.getLogger(__name__), sources, dynamic_attributes
+    )
+    assert result == {"uidNumber": 1000, "uid": "alice"}
+
+
+def test_compact_entry_renders_lists():
+    entry = CompactEntry("uid=alice", {"mail": ["a@x", "b@x"], "uid": ["alice"]})
+    sources = {LDAP_SEARCH_ATTRIBUTE_QUERY: entry}
+    result = get_interpolated_dynamic_attributes(
+        logging.getLogger(__name__), sources, {"mail": LDAP_SEARCH_ATTRIBUTE_QUERY}
+    )
+    assert "{mail}".format(**result) == "['a@x', 'b@x']"
+    # The cached values can't be changed through the returned list
+    entry["mail"].append("c@x")
+    assert entry["mail"] == ["a@x", "b@x"]
@@ -0,0 +1,79 @@
+import logging
+from ldap3 import MOCK_SYNC, OFFLINE_SLAPD_2_4, Connection, Server
+from ldap_hooks.groups import (
+    add_memberships,
+    existing_memberships,
+    format_group_memberships,
+    membership_searches,
+)
+
+MEMBERSHIPS = [
+    ("cn=students,ou=groups,dc=example,dc=org", "memberUid", "alice"),
+    ("cn=course(1),ou=groups,dc=example,dc=org", "memberUid", "alice"),
+    ("cn=all,ou=teams,dc=example,dc=org", "memberUid", "alice"),
+]
+
+
+def test_membership_searches():
+    assert membership_searches(MEMBERSHIPS) == [
+        (
+            "ou=groups,dc=example,dc=org",
+            "(|(&(cn=students)(memberUid=alice))"
+            "(&(cn=course\\281\\29)(memberUid=alice)))",
+        ),
+        ("ou=teams,dc=example,dc=org", "(|(&(cn=all)(memberUid=alice)))"),
+    ]
+    logger = logging.getLogger(__name__)
+    assert format_group_memberships(
+        logger, [{"group_dn": "cn=a", "attribute": "memberUid", "value": "alice"}]
+    ) == [("cn=a", "memberUid", "alice")]
+    assert (
+        format_group_memberships(
+            logger, [{"group_dn": "cn=a", "attribute": "memberUid", "value": "{uid}"}]
+        )
+        is None
+    )
+
+
+class FakePool:
+    current = None
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def writer(self):
+        return self
+
+    def get_connection(self):
+        return self.connection
+
+    def record_success(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+def test_add_missing_memberships():
+    server = Server("groups", get_info=OFFLINE_SLAPD_2_4)
+    connection = Connection(server, client_strategy=MOCK_SYNC)
+    for group_dn, _, _ in MEMBERSHIPS:
+        connection.strategy.add_entry(
+            group_dn, {"objectClass": ["posixGroup"], "memberUid": ["bob"]}
+        )
+    connection.bind()
+    logger = logging.getLogger(__name__)
+
+    assert existing_memberships(connection, MEMBERSHIPS) == set()
+    assert add_memberships(lambda: FakePool(connection), logger, MEMBERSHIPS[:2])
+    assert existing_memberships(connection, MEMBERSHIPS) == {
+        "cn=students,ou=groups,dc=example,dc=org",
+        "cn=course(1),ou=groups,dc=example,dc=org",
+    }
+    # A member that was added concurrently is not a failure
+    assert add_memberships(lambda: FakePool(connection), logger, MEMBERSHIPS[:1])
+    assert not add_memberships(
+        lambda: FakePool(connection),
+        logger,
+        [("cn=missing,ou=groups,dc=example,dc=org", "memberUid", "alice")],
+    )
@@ -0,0 +1,279 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+import pytest
+from ldap3 import MOCK_SYNC, OFFLINE_SLAPD_2_4, Connection, Server
+from ldap3.core.exceptions import LDAPSocketOpenError
+from ldap_hooks import (
+    INCREMENT_ATTRIBUTE,
+    LDAP,
+    LDAP_SEARCH_ATTRIBUTE_QUERY,
+    SPAWNER_SUBMIT_DATA,
+)
+from ldap_hooks import hooks, ldap
+from ldap_hooks.cache import clear_entry_cache
+from ldap_hooks.memo import clear_result_memo
+from ldap_hooks.pool import get_idle_connections
+from ldap_hooks.record import (
+    CACHE,
+    CREATED,
+    EXISTING,
+    MEMOIZED,
+    MIRROR,
+    STALE_CACHE,
+    UNAVAILABLE,
+    UNAVAILABLE_CACHE,
+    Recording,
+)
+from .test_mirror import new_mirror
+
+logger = logging.getLogger(__name__)
+
+ADMIN_DN = "cn=admin,dc=example,dc=org"
+COUNTER_DN = "cn=idNext,dc=example,dc=org"
+
+
+class Directory:
+    """A MOCK_SYNC directory whose connections record the search, add
+    and modify operations that they make.
+    """
+
+    def __init__(self):
+        self.server = Server("directory", get_info=OFFLINE_SLAPD_2_4)
+        self.connection = Connection(self.server, client_strategy=MOCK_SYNC)
+        self.connection.strategy.add_entry(ADMIN_DN, {"userPassword": "secret"})
+        self.connection.strategy.add_entry(
+            "cn=Subschema",
+            {
+                "objectClass": ["Subschema"],
+                "objectClasses": ["( 2.5.6.6 NAME 'person' )"],
+            },
+        )
+        self.connection.strategy.add_entry(
+            COUNTER_DN,
+            {"objectClass": ["device"], "uidNumber": [2000], "gidNumber": [3000]},
+        )
+        self.operations = []
+        self.down = False
+
+    def connect(self, server, **connection_args):
+        if self.down:
+            raise LDAPSocketOpenError("the directory is down")
+        connection_args.pop("receive_timeout", None)
+        return RecordingConnection(self, **connection_args)
+
+    def take(self):
+        operations, self.operations = self.operations, []
+        return operations
+
+
+class RecordingConnection(Connection):
+    def __init__(self, directory, **connection_args):
+        self.directory = directory
+        super().__init__(directory.server, client_strategy=MOCK_SYNC, **connection_args)
+        self.strategy.entries = directory.connection.strategy.entries
+
+    def search(self, search_base, search_filter, *args, **kwargs):
+        self.directory.operations.append(("search", search_base))
+        return super().search(search_base, search_filter, *args, **kwargs)
+
+    def add(self, dn, *args, **kwargs):
+        self.directory.operations.append(("add", dn))
+        return super().add(dn, *args, **kwargs)
+
+    def modify(self, dn, changes, *args, **kwargs):
+        self.directory.operations.append(("modify", dn, sorted(changes)))
+        return super().modify(dn, changes, *args, **kwargs)
+
+
+@pytest.fixture
+def directory(request, monkeypatch):
+    directory = Directory()
+    monkeypatch.setattr(ldap, "Connection", directory.connect)
+    for name, value in (
+        # The circuit breaker and schema cache of each test are its own
+        ("url", "ldap://{}".format(request.node.name)),
+        ("user", ADMIN_DN),
+        ("password", "secret"),
+        ("base_dn", "dc=example,dc=org"),
+        ("submit_spawner_attribute", "user.data"),
+        ("replace_object_with", {"/": "+"}),
+        ("object_classes", ["Person"]),
+        (
+            "dynamic_attributes",
+            {
+                "uid": SPAWNER_SUBMIT_DATA,
+                "uidNumber": LDAP_SEARCH_ATTRIBUTE_QUERY,
+                "gidNumber": LDAP_SEARCH_ATTRIBUTE_QUERY,
+            },
+        ),
+        (
+            "set_spawner_attributes",
+            {"environment": {"NB_UID": "{uidNumber}", "NB_GID": "{gidNumber}"}},
+        ),
+        ("object_attributes", {"uidNumber": "{uidNumber}", "gidNumber": "{gidNumber}"}),
+        (
+            "search_attribute_queries",
+            [
+                {
+                    "search_base": "dc=example,dc=org",
+                    "search_filter": "(cn=idNext)",
+                    "attributes": ["uidNumber", "gidNumber"],
+                }
+            ],
+        ),
+        (
+            "search_result_operations",
+            {
+                "uidNumber": {"action": INCREMENT_ATTRIBUTE, "modify_dn": COUNTER_DN},
+                "gidNumber": {"action": INCREMENT_ATTRIBUTE, "modify_dn": COUNTER_DN},
+            },
+        ),
+    ):
+        monkeypatch.setattr(LDAP, name, value)
+    clear_result_memo()
+    clear_entry_cache()
+    yield directory
+    clear_result_memo()
+    clear_entry_cache()
+    get_idle_connections().clear()
+
+
+def spawn(name):
+    """Run the hook for the user `name`, returns whether it provisioned the
+    entry, the environment that it set and the branch that it took.
+    """
+
+    async def provision(spawner, instance):
+        return hooks.setup_ldap_entry(spawner, instance)
+
+    user = SimpleNamespace(name=name, data="/uid={}".format(name))
+    spawner = SimpleNamespace(user=user, log=logger, environment={})
+    recording = Recording(name)
+    provisioned = asyncio.run(recording.run(provision, spawner, LDAP()))
+    return provisioned, spawner.environment, recording.branch
+
+
+def test_created_then_existing_entry(directory):
+    environment = {"NB_UID": "2001", "NB_GID": "3001"}
+    assert spawn("alice") == (True, environment, CREATED)
+    assert directory.take() == [
+        ("search", "cn=Subschema"),
+        ("search", "dc=example,dc=org"),
+        ("search", "dc=example,dc=org"),
+        # The increments of the counter entry are merged into one modify
+        ("modify", COUNTER_DN, ["gidNumber", "uidNumber"]),
+        ("add", "uid=alice,dc=example,dc=org"),
+        ("search", "dc=example,dc=org"),
+    ]
+    counter = directory.connection.strategy.entries[COUNTER_DN]
+    assert counter["uidNumber"] == [b"2001"] and counter["gidNumber"] == [b"3001"]
+
+    # The schema is cached, only the existing entry is searched for
+    assert spawn("alice") == (True, environment, EXISTING)
+    assert directory.take() == [("search", "dc=example,dc=org")]
+
+    assert spawn("bob") == (True, {"NB_UID": "2002", "NB_GID": "3002"}, CREATED)
+    assert [operation[0] for operation in directory.take()].count("modify") == 1
+
+
+def test_lookup_order(directory, monkeypatch):
+    mirror = new_mirror([])
+    mirror.full_sync(None)
+    monkeypatch.setattr(hooks, "ensure_directory_mirror", lambda *args: mirror)
+    monkeypatch.setattr(LDAP, "memoize_results", True)
+    monkeypatch.setattr(LDAP, "entry_cache_ttl", 60.0)
+    monkeypatch.setattr(LDAP, "entry_cache_hard_ttl", 3600.0)
+    revalidated = []
+    monkeypatch.setattr(
+        hooks,
+        "revalidate_entry_in_background",
+        lambda instance, logger, ldap_data, ldap_dict: revalidated.append(ldap_data),
+    )
+    environment = {"NB_UID": "2001", "NB_GID": "3001"}
+    assert spawn("alice") == (True, environment, CREATED)
+    directory.take()
+
+    # The memoized result is validated with a single base search
+    assert spawn("alice") == (True, environment, MEMOIZED)
+    assert directory.take() == [("search", "uid=alice,dc=example,dc=org")]
+
+    # Past the memo, the mirror answers without a connection
+    clear_result_memo()
+    mirror.directory = [
+        (
+            "uid=alice,dc=example,dc=org",
+            {"uid": ["alice"], "uidNumber": 2001, "gidNumber": 3001},
+        )
+    ]
+    mirror.full_sync(None)
+    monkeypatch.setattr(mirror, "attributes", ["uid", "uidNumber", "gidNumber"])
+    assert spawn("alice") == (True, environment, MIRROR)
+    assert directory.take() == []
+
+    # Past the mirror, the fresh and then the stale entry cache
+    clear_result_memo()
+    mirror.directory = []
+    mirror.full_sync(None)
+    assert spawn("alice") == (True, environment, CACHE)
+    assert directory.take() == []
+    clear_result_memo()
+    entry_cache = hooks.instance_entry_cache(LDAP())
+    key = "uid=alice,dc=example,dc=org"
+    attributes, age = entry_cache.get_with_age(key)
+    entry_cache.set(key, attributes, stored_at=entry_cache.clock() - age - 120)
+    assert spawn("alice") == (True, environment, STALE_CACHE)
+    assert directory.take() == []
+    assert revalidated == ["uid=alice"]
+
+    # Past the entry cache, the existing entry is searched for
+    clear_result_memo()
+    clear_entry_cache()
+    assert spawn("alice") == (True, environment, EXISTING)
+    assert directory.take() == [("search", "dc=example,dc=org")]
+
+
+def test_unavailable_directory(directory):
+    environment = {"NB_UID": "2001", "NB_GID": "3001"}
+    assert spawn("alice") == (True, environment, CREATED)
+    directory.take()
+
+    # The entry cache answers while no server can be reached
+    directory.down = True
+    get_idle_connections().clear()
+    assert spawn("alice") == (True, environment, UNAVAILABLE_CACHE)
+    assert spawn("bob") == (False, {}, UNAVAILABLE)
+    assert directory.take() == []
+
+
+def test_existing_entry_memberships(directory, monkeypatch):
+    group_dn = "cn=students,ou=groups,dc=example,dc=org"
+    directory.connection.strategy.add_entry(
+        group_dn, {"objectClass": ["posixGroup"], "memberUid": ["bob"]}
+    )
+    monkeypatch.setattr(
+        LDAP,
+        "group_memberships",
+        [{"group_dn": group_dn, "attribute": "memberUid", "value": "{uid}"}],
+    )
+    members = directory.connection.strategy.entries[group_dn]["memberUid"]
+    assert spawn("alice")[2] == CREATED
+    assert members == [b"bob", b"alice"]
+    directory.take()
+
+    # The existing entry is added to the group that it was removed from
+    members.remove(b"alice")
+    assert spawn("alice")[2] == EXISTING
+    assert directory.take() == [
+        ("search", "dc=example,dc=org"),
+        ("search", "ou=groups,dc=example,dc=org"),
+        ("modify", group_dn, ["memberUid"]),
+    ]
+    assert members == [b"bob", b"alice"]
+
+    # A single search finds that it is a member already
+    assert spawn("alice")[2] == EXISTING
+    assert directory.take() == [
+        ("search", "dc=example,dc=org"),
+        ("search", "ou=groups,dc=example,dc=org"),
+    ]
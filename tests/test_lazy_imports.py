@@ -0,0 +1,60 @@
+import subprocess
+import sys
+import pytest
+import ldap_hooks
+
+HEAVY_MODULES = ("ldap3", "pyasn1", "tornado", "traitlets")
+
+
+def imported_modules(statement):
+    """The HEAVY_MODULES that `statement` imports in a fresh interpreter."""
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            "import sys\n{}\nprint(' '.join(sorted(set("
+            "name.split('.')[0] for name in sys.modules))))".format(statement),
+        ],
+        universal_newlines=True,
+    )
+    return set(output.split()) & set(HEAVY_MODULES)
+
+
+def test_package_imports_lazily():
+    assert imported_modules("import ldap_hooks") == set()
+    assert (
+        imported_modules(
+            "from ldap_hooks import hello_hook, setup_ldap_entry_hook, "
+            "SPAWNER_SUBMIT_DATA, PROVIDER"
+        )
+        == set()
+    )
+    assert imported_modules("from ldap_hooks import LDAP") == {"traitlets"}
+    assert (
+        imported_modules(
+            "import ldap_hooks\nassert not hasattr(ldap_hooks, '__wrapped__')"
+        )
+        == set()
+    )
+    assert "ldap3" in imported_modules("from ldap_hooks import ConnectionManager")
+
+
+def test_lazy_names_resolve():
+    from ldap_hooks import hooks
+
+    assert ldap_hooks.LDAP is hooks.LDAP
+    assert ldap_hooks.search_for is hooks.search_for
+    assert "warm_up" in dir(ldap_hooks)
+    with pytest.raises(AttributeError):
+        ldap_hooks.missing_name
+
+
+def test_star_import_names():
+    from ldap_hooks import entrypoints, hooks
+
+    names = {}
+    exec("from ldap_hooks import *", names)
+    assert set(ldap_hooks.__all__) <= set(names)
+    assert names["LDAP"] is hooks.LDAP
+    assert names["PROVIDER"] == "provider"
+    assert hooks.setup_ldap_entry_hook is entrypoints.setup_ldap_entry_hook
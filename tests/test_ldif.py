@@ -0,0 +1,99 @@
+import io
+import pytest
+from ldap_hooks import ldif
+from ldap_hooks.bulk import FAILED
+from ldap_hooks.ldif import (
+    ADDED,
+    UnsupportedLDIF,
+    format_ldif_entry,
+    import_ldif,
+    is_safe_string,
+    read_ldif,
+)
+
+
+def test_ldif_round_trip():
+    attributes = {
+        "objectClass": [b"top", b"Person"],
+        "sn": [b"x" * 120],
+        "description": [" leading space ø".encode("utf-8")],
+        "cn": "alice",
+    }
+    ldif = "version: 1\n\n# A comment\n" + format_ldif_entry(
+        "cn=alice,dc=example,dc=org", attributes
+    )
+    assert all(len(line) <= 76 for line in ldif.splitlines())
+    [(dn, read)] = list(read_ldif(io.StringIO(ldif)))
+    assert dn == "cn=alice,dc=example,dc=org"
+    assert read["objectClass"] == ["top", "Person"]
+    assert read["sn"] == ["x" * 120]
+    assert read["description"] == [" leading space ø".encode("utf-8")]
+    assert read["cn"] == ["alice"]
+
+
+def test_is_safe_string():
+    assert is_safe_string(b"alice")
+    assert not is_safe_string(b":alice")
+    assert not is_safe_string(b"alice ")
+    assert not is_safe_string("ø".encode("utf-8"))
+
+
+def test_read_ldif_strips_fill():
+    ldif = "dn:   cn=alice,dc=org\nsn:    Smith\nuid::   YWxpY2U=\n"
+    [(dn, read)] = list(read_ldif(io.StringIO(ldif)))
+    assert dn == "cn=alice,dc=org"
+    assert read["sn"] == ["Smith"]
+    assert read["uid"] == [b"alice"]
+
+
+def test_read_ldif_rejects_urls():
+    ldif = "dn: cn=alice,dc=org\njpegPhoto:< file:///tmp/alice.jpg\n"
+    with pytest.raises(UnsupportedLDIF, match="file:///tmp/alice.jpg"):
+        list(read_ldif(io.StringIO(ldif)))
+
+
+def test_read_ldif_rejects_change_records():
+    ldif = "dn: cn=alice,dc=org\nchangetype: add\ncn: alice\n"
+    assert list(read_ldif(io.StringIO(ldif))) == [
+        ("cn=alice,dc=org", {"cn": ["alice"]})
+    ]
+    for changetype in ("modify", "delete", "moddn", "modrdn"):
+        ldif = "dn: cn=alice,dc=org\nchangetype: {}\n".format(changetype)
+        with pytest.raises(UnsupportedLDIF, match=changetype):
+            list(read_ldif(io.StringIO(ldif)))
+
+
+def test_import_ldif_bounds_the_retries(monkeypatch):
+    added = {"dc=org"}
+    largest = []
+
+    def add_entries(instance, logger, entries):
+        largest.append(len(entries))
+        retry = []
+        for dn, attributes in entries:
+            if dn.split(",", 1)[1] in added:
+                added.add(dn)
+            else:
+                retry.append((dn, attributes))
+        return {ADDED: len(entries) - len(retry)}, retry
+
+    monkeypatch.setattr(ldif, "add_entries", add_entries)
+    entries = [
+        ("cn=b,cn=a,dc=org", {}),
+        ("cn=a,dc=org", {}),
+        ("cn=y,cn=x,dc=org", {}),
+        ("cn=x,dc=org", {}),
+    ]
+    # The children are added once the backlog is full
+    progress = import_ldif(None, iter(entries), workers=1, batch_size=1, max_retry=2)
+    assert (progress.counts[ADDED], progress.counts[FAILED]) == (4, 0)
+    assert max(largest) == 2
+
+    # A tree that is listed children first fails beyond the backlog
+    added, largest[:] = {"dc=org"}, []
+    entries = [("cn=d,cn=c,cn=b,cn=a,dc=org", {}), ("cn=c,cn=b,cn=a,dc=org", {})]
+    entries += [("cn=b,cn=a,dc=org", {}), ("cn=a,dc=org", {})]
+    progress = import_ldif(None, iter(entries), workers=1, batch_size=1, max_retry=2)
+    assert progress.counts[ADDED] + progress.counts[FAILED] == 4
+    assert progress.counts[FAILED] >= 2
+    assert max(largest) <= 3
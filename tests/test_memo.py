@@ -0,0 +1,115 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+from ldap_hooks import LDAP
+from ldap_hooks.entry import CompactEntry
+from ldap_hooks.memo import MemoizedResult, config_fingerprint, entry_version
+
+
+def test_config_fingerprint_changes_with_config():
+    instance = LDAP(submit_spawner_attribute="user.data")
+    fingerprint = config_fingerprint(instance)
+    assert fingerprint == config_fingerprint(LDAP(submit_spawner_attribute="user.data"))
+    instance.base_dn = "dc=example,dc=org"
+    assert config_fingerprint(instance) != fingerprint
+    # The settings that the pre-provisioning overrides keep the fingerprint
+    instance.memoize_results = True
+    instance.deferred_modifications = []
+    assert config_fingerprint(instance) == config_fingerprint(
+        LDAP(submit_spawner_attribute="user.data", base_dn="dc=example,dc=org")
+    )
+
+
+def test_result_is_memoized_under_the_settings_of_the_hook(monkeypatch):
+    import logging
+    from ldap_hooks import hooks
+    from ldap_hooks.memo import get_result_memo
+    from .test_mirror import new_mirror
+
+    mirror = new_mirror([("uid=alice,dc=example,dc=org", {"uid": ["alice"]})])
+    mirror.full_sync(None)
+    monkeypatch.setattr(hooks, "ensure_directory_mirror", lambda *args: mirror)
+    for name, value in (
+        ("base_dn", "dc=example,dc=org"),
+        ("submit_spawner_attribute", "user.data"),
+        ("replace_object_with", {"/": "+"}),
+        ("unique_object_attributes", ["uid"]),
+        ("memoize_results", True),
+        ("set_spawner_attributes", {"environment": {"A": "1"}}),
+    ):
+        monkeypatch.setattr(LDAP, name, value)
+    instance = LDAP()
+    fingerprint = config_fingerprint(instance)
+    # The settings are reloaded while the hook runs
+    monkeypatch.setattr(LDAP, "set_spawner_attributes", {"environment": {"A": "2"}})
+    user = SimpleNamespace(name="alice", data="/uid=alice")
+    spawner = SimpleNamespace(
+        user=user, log=logging.getLogger(__name__), environment={}
+    )
+    assert hooks.setup_ldap_entry(spawner, instance)
+    assert spawner.environment == {"A": "1"}
+    memoized = get_result_memo(instance.entry_cache_size).get("alice")
+    assert memoized.matches(fingerprint, "uid=alice")
+    assert not memoized.matches(config_fingerprint(LDAP()), "uid=alice")
+
+
+def test_entry_version():
+    assert entry_version({"uid": "alice"}) is None
+    entry = CompactEntry(
+        "uid=alice",
+        {"modifyTimestamp": ["20240101000000Z"], "entryCSN": ["20240101#000001"]},
+    )
+    assert entry_version(entry) == "20240101#000001"
+    assert entry_version({"modifyTimestamp": "20240101000000Z"}) == "20240101000000Z"
+
+
+def test_memoized_result_matches():
+    memoized = MemoizedResult("abc", "cn=alice", "cn=alice,dc=org", None, {}, {})
+    assert memoized.matches("abc", "cn=alice")
+    assert not memoized.matches("def", "cn=alice")
+    assert not memoized.matches("abc", "cn=bob")
+
+
+def test_login_spawner():
+    import logging
+    from ldap_hooks.hooks import LoginSpawner, rec_get_attr, wait_for_pre_provisioning
+
+    spawner = LoginSpawner(
+        {"name": "alice", "auth_state": {"data": {"PersonDN": "/CN=alice"}}},
+        logging.getLogger(__name__),
+    )
+    assert spawner.user.name == "alice"
+    assert rec_get_attr(spawner, "user.data") == {"PersonDN": "/CN=alice"}
+    assert not asyncio.run(wait_for_pre_provisioning("nobody", 0))
+
+
+def test_pre_provisioning_is_started_once_and_consumed(monkeypatch):
+    import logging
+    from ldap_hooks import hooks
+
+    release = threading.Event()
+    calls = []
+
+    def pre_provision(authentication, log):
+        calls.append(authentication["name"])
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr(hooks, "pre_provision", pre_provision)
+    monkeypatch.setattr(hooks, "_pre_provisioning", {})
+    authenticator = SimpleNamespace(log=logging.getLogger(__name__))
+    for _ in range(3):
+        hooks.pre_provision_hook(authenticator, None, {"name": "alice"})
+
+    async def wait():
+        # The event loop keeps running while the pre-provisioning does
+        waiting = asyncio.ensure_future(hooks.wait_for_pre_provisioning("alice", 5))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        release.set()
+        return await waiting
+
+    assert asyncio.run(wait())
+    assert calls == ["alice"]
+    assert hooks._pre_provisioning == {}
+    assert not asyncio.run(hooks.wait_for_pre_provisioning("alice", 0))
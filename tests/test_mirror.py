@@ -0,0 +1,143 @@
+import datetime
+import logging
+from types import SimpleNamespace
+from ldap_hooks import LDAP, LDAP_SEARCH_ATTRIBUTE_QUERY
+from ldap_hooks.mirror import DirectoryMirror, format_generalized_time
+
+
+class FakeMirror(DirectoryMirror):
+    def __init__(self, entries, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.directory = entries
+        self.filters = []
+
+    def _paged_entries(self, conn_manager, search_filter):
+        self.filters.append(search_filter)
+        for dn, attributes in self.directory:
+            yield dn, attributes
+
+
+def new_mirror(entries):
+    return FakeMirror(
+        entries,
+        "dc=example,dc=org",
+        "(objectclass=Person)",
+        ["uid", "uidNumber"],
+        ["uid"],
+    )
+
+
+def test_mirror_lookup():
+    mirror = new_mirror(
+        [
+            ("cn=a,dc=example,dc=org", {"uid": ["alice"], "uidNumber": 1}),
+            ("cn=b,dc=example,dc=org", {"uid": ["bob"], "uidNumber": 2}),
+        ]
+    )
+    assert mirror.lookup({"uid": "alice"}, ["uid"], "cn=a,dc=example,dc=org") is None
+    mirror.full_sync(None)
+    assert len(mirror) == 2
+    assert mirror.lookup({"uid": "Alice"}, ["uid"], None)["uidNumber"] == 1
+    assert mirror.lookup({"uid": "carol"}, ["uid"], None) is None
+    # Without unique attributes the entry is found by its dn
+    assert mirror.lookup({}, [], "CN=b,dc=example,dc=org")["uidNumber"] == 2
+
+
+def test_mirror_delta_sync():
+    modified = datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+    mirror = new_mirror(
+        [
+            (
+                "cn=a,dc=example,dc=org",
+                {"uid": ["alice"], "uidNumber": 1, "modifyTimestamp": modified},
+            )
+        ]
+    )
+    mirror.full_sync(None)
+    assert mirror.last_modified == "20240102030405Z"
+
+    mirror.directory = [
+        (
+            "cn=a,dc=example,dc=org",
+            {"uid": ["alicia"], "uidNumber": 1, "modifyTimestamp": modified},
+        )
+    ]
+    assert mirror.delta_sync(None) == 1
+    assert mirror.filters[-1] == (
+        "(&(objectclass=Person)(modifyTimestamp>=20240102030405Z))"
+    )
+    # The index follows the modified value
+    assert mirror.lookup({"uid": "alice"}, ["uid"], None) is None
+    assert mirror.lookup({"uid": "alicia"}, ["uid"], None)["uidNumber"] == 1
+
+
+def test_mirror_deleted_entry():
+    modified = datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+    alice = (
+        "cn=a,dc=example,dc=org",
+        {"uid": ["alice"], "uidNumber": 1, "modifyTimestamp": modified},
+    )
+    bob = (
+        "cn=b,dc=example,dc=org",
+        {"uid": ["bob"], "uidNumber": 2, "modifyTimestamp": modified},
+    )
+    mirror = new_mirror([alice, bob])
+    mirror.full_sync(None)
+
+    # A delta sync does not see that alice was deleted
+    mirror.directory = [bob]
+    mirror.delta_sync(None)
+    assert mirror.find({"uid": "alice"}, ["uid"], None)[0] == alice[0]
+
+    # Until the hook discards it, once its confirmation search failed
+    assert mirror.discard("CN=a,dc=example,dc=org")
+    assert not mirror.discard("cn=a,dc=example,dc=org")
+    assert mirror.lookup({"uid": "alice"}, ["uid"], None) is None
+    assert mirror.lookup({}, [], "cn=a,dc=example,dc=org") is None
+    assert "alice" not in mirror.indexes["uid"]
+    assert mirror.lookup({"uid": "bob"}, ["uid"], None)["uidNumber"] == 2
+
+    # Or the next full sync replaces the mirror
+    mirror.directory = [alice, bob]
+    mirror.full_sync(None)
+    mirror.directory = [bob]
+    mirror.full_sync(None)
+    assert mirror.lookup({"uid": "alice"}, ["uid"], None) is None
+    assert len(mirror) == 1
+
+
+def test_mirror_hit_makes_no_connection(monkeypatch):
+    from ldap_hooks import hooks
+
+    mirror = new_mirror(
+        [("uid=alice,dc=example,dc=org", {"uid": ["alice"], "uidNumber": 1})]
+    )
+    mirror.full_sync(None)
+    connections = []
+    monkeypatch.setattr(hooks, "ensure_directory_mirror", lambda *args: mirror)
+    monkeypatch.setattr(
+        hooks, "new_server_pool", lambda *args, **kwargs: connections.append(args)
+    )
+    monkeypatch.setattr(
+        LDAP, "set_spawner_attributes", {"environment": {"NB_UID": "{uidNumber}"}}
+    )
+    instance = LDAP(
+        base_dn="dc=example,dc=org",
+        submit_spawner_attribute="user.data",
+        replace_object_with={"/": "+"},
+        unique_object_attributes=["uid"],
+        dynamic_attributes={"uidNumber": LDAP_SEARCH_ATTRIBUTE_QUERY},
+    )
+    user = SimpleNamespace(name="alice", data="/uid=alice")
+    spawner = SimpleNamespace(
+        user=user, log=logging.getLogger(__name__), environment={}
+    )
+    assert hooks.setup_ldap_entry(spawner, instance)
+    assert spawner.environment == {"NB_UID": "1"}
+    assert connections == []
+
+
+def test_format_generalized_time():
+    value = datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+    assert format_generalized_time(value) == "20240102030405Z"
+    assert format_generalized_time("20240102030405Z") == "20240102030405Z"
@@ -0,0 +1,69 @@
+import logging
+from ldap3 import MODIFY_ADD, MODIFY_DELETE
+from ldap_hooks.hooks import INCREMENT_ATTRIBUTE, perform_search_result_operations
+
+
+class FakeConnection:
+    def __init__(self, success=True):
+        self.success = success
+        self.modified = []
+
+    def modify(self, dn, changes, controls=None):
+        self.modified.append((dn, changes))
+        return self.success
+
+
+class FakeConnManager:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def get_connection(self):
+        return self.connection
+
+
+def test_operations_of_a_dn_are_merged():
+    logger = logging.getLogger(__name__)
+    connection = FakeConnection()
+    id_next = {"action": INCREMENT_ATTRIBUTE, "modify_dn": "cn=idNext,dc=example"}
+    group_next = {"action": INCREMENT_ATTRIBUTE, "modify_dn": "cn=groupNext,dc=example"}
+    values = perform_search_result_operations(
+        logger,
+        FakeConnManager(connection),
+        "dc=example",
+        [
+            (id_next, "uidNumber", 1000),
+            (dict(id_next, modify_dn="CN=idNext,dc=example"), "gidNumber", 2000),
+            (group_next, "gidNumber2", 3000),
+        ],
+    )
+    assert values == {"uidNumber": 1001, "gidNumber": 2001, "gidNumber2": 3001}
+    assert connection.modified == [
+        (
+            "cn=idNext,dc=example",
+            {
+                "uidNumber": [(MODIFY_DELETE, [1000]), (MODIFY_ADD, [1001])],
+                "gidNumber": [(MODIFY_DELETE, [2000]), (MODIFY_ADD, [2001])],
+            },
+        ),
+        (
+            "cn=groupNext,dc=example",
+            {"gidNumber2": [(MODIFY_DELETE, [3000]), (MODIFY_ADD, [3001])]},
+        ),
+    ]
+
+    # A conflicting modify fails every operation of the entry
+    assert not perform_search_result_operations(
+        logger,
+        FakeConnManager(FakeConnection(success=False)),
+        "dc=example",
+        [(id_next, "uidNumber", 1000), (id_next, "gidNumber", 2000)],
+    )
+    # Invalid operations are rejected before anything is modified
+    connection = FakeConnection()
+    assert not perform_search_result_operations(
+        logger,
+        FakeConnManager(connection),
+        "dc=example",
+        [(id_next, "uidNumber", 1000), (id_next, "gidNumber", "2000")],
+    )
+    assert connection.modified == []
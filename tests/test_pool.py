@@ -0,0 +1,212 @@
+import threading
+import time
+import pytest
+from ldap3.core.exceptions import LDAPSocketReceiveError
+from ldap_hooks import pool as pool_module
+from ldap_hooks.breaker import CLOSED, get_circuit_breaker
+from ldap_hooks.pool import (
+    IdleConnections,
+    parse_servers,
+    LatencyTracker,
+    ServerPool,
+    PROVIDER,
+    CONSUMER,
+)
+from .util import FakeClock
+
+
+def test_parse_servers():
+    assert parse_servers("openldap") == [("openldap", PROVIDER)]
+    assert parse_servers(["ldap://a", {"url": "ldap://b", "role": CONSUMER}]) == [
+        ("ldap://a", PROVIDER),
+        ("ldap://b", CONSUMER),
+    ]
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        [],
+        [{"url": "ldap://b", "role": CONSUMER}],
+        [{"url": "ldap://b", "role": "replica"}],
+        [{"role": PROVIDER}],
+    ],
+)
+def test_parse_servers_invalid(url):
+    with pytest.raises(ValueError):
+        parse_servers(url)
+
+
+def test_latency_tracker_ewma():
+    tracker = LatencyTracker(alpha=0.5)
+    assert tracker.estimate("ldap://a") == 0.0
+    tracker.record("ldap://a", 1.0)
+    tracker.record("ldap://a", 3.0)
+    assert tracker.estimate("ldap://a") == 2.0
+
+
+def test_pool_orders_consumers_by_latency():
+    pool = ServerPool(
+        [
+            "ldap://order-provider",
+            {"url": "ldap://order-slow", "role": CONSUMER},
+            {"url": "ldap://order-fast", "role": CONSUMER},
+        ]
+    )
+    pool.latency = LatencyTracker()
+    pool.latency.record("ldap://order-slow", 2.0)
+    pool.latency.record("ldap://order-fast", 0.1)
+    assert pool.read_order() == [
+        "ldap://order-fast",
+        "ldap://order-slow",
+        "ldap://order-provider",
+    ]
+    pool.open_connection = FakeConnectionManager
+    assert pool.reader().url == "ldap://order-fast"
+
+
+def test_pool_reads_own_writes():
+    pool = ServerPool(
+        ["ldap://pinned-provider", {"url": "ldap://pinned-consumer", "role": CONSUMER}]
+    )
+    pool.latency = LatencyTracker()
+    pool.open_connection = FakeConnectionManager
+    assert pool.reader().url == "ldap://pinned-consumer"
+    assert pool.writer().url == "ldap://pinned-provider"
+    # Every read after the write goes to the provider
+    assert pool.reader().url == "ldap://pinned-provider"
+    assert pool.reader() is pool.writer()
+
+
+def test_latency_tracker_percentile():
+    tracker = LatencyTracker()
+    for _ in range(5):
+        tracker.record("ldap://a", 0.1)
+    # Too few samples to trust a percentile
+    assert tracker.percentile("ldap://a", 95.0) is None
+    for sample in range(1, 101):
+        tracker.record("ldap://a", sample / 100.0)
+    assert tracker.percentile("ldap://a", 95.0) == 0.95
+    assert tracker.percentile("ldap://a", 50.0) == 0.5
+
+
+def test_pool_hedge_delay():
+    pool = ServerPool("ldap://provider", hedge_percentile=90.0, hedge_min_delay=0.2)
+    pool.latency = LatencyTracker()
+    assert pool.hedge_delay("ldap://provider") == 0.2
+    for sample in range(1, 11):
+        pool.latency.record("ldap://provider", float(sample))
+    assert pool.hedge_delay("ldap://provider") == 9.0
+
+
+class FakeConnection:
+    def __init__(self, url=None):
+        self.url = url
+        self.closed = False
+        self.dropped = False
+
+
+class FakeConnectionManager:
+    def __init__(self, url="ldap://a"):
+        self.url = url
+        self.connection = FakeConnection(url)
+        self.operation_timeout = None
+
+    def get_connection(self):
+        return self.connection
+
+    def set_operation_timeout(self, timeout):
+        self.operation_timeout = timeout
+
+    def is_connected(self):
+        return not self.connection.closed
+
+    def disconnect(self):
+        self.connection.closed = True
+
+
+def test_idle_connections_reuse():
+    clock = FakeClock()
+    idle = IdleConnections(clock=clock)
+    key = ("ldap://a", "cn=admin")
+    first, second = FakeConnectionManager(), FakeConnectionManager()
+    assert idle.checkin(key, first, max_size=1)
+    # Beyond max_size the connection is closed instead
+    assert not idle.checkin(key, second, max_size=1)
+    assert second.connection.closed
+    assert idle.checkout(key) is first
+    assert idle.checkout(key) is None
+
+
+def test_idle_connections_expire():
+    clock = FakeClock()
+    idle = IdleConnections(clock=clock)
+    key = ("ldap://a", "cn=admin")
+    conn_manager = FakeConnectionManager()
+    idle.checkin(key, conn_manager, max_size=2)
+    clock.now = 301.0
+    assert idle.checkout(key, max_idle_time=300.0) is None
+    assert conn_manager.connection.closed
+
+
+def test_hedged_search_abandons_slow_trial(monkeypatch):
+    slow, fast = "ldap://hedge-consumer", "ldap://hedge-provider"
+    release = threading.Event()
+
+    def fake_search_for(connection, search_base, search_filter, **kwargs):
+        if connection.url == slow:
+            release.wait(5)
+        return connection.url
+
+    monkeypatch.setattr(pool_module, "search_for", fake_search_for)
+    pool = ServerPool(
+        [fast, {"url": slow, "role": CONSUMER}],
+        failure_threshold=1,
+        cooldown=0.05,
+        hedge_percentile=90.0,
+        hedge_min_delay=0.01,
+    )
+    pool.latency = LatencyTracker()
+    pool.open_connection = FakeConnectionManager
+    breaker = get_circuit_breaker(slow, failure_threshold=1, cooldown=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    # The read on the consumer is the trial of its half-open breaker
+    conn_manager = pool.reader()
+    assert conn_manager.url == slow and breaker.trial_in_progress
+    winner, result = pool.search(conn_manager, "dc=example", "(uid=alice)")
+    assert (winner.url, result) == (fast, fast)
+    assert slow not in pool.managers
+
+    release.set()
+    for _ in range(100):
+        if conn_manager.connection.closed:
+            break
+        time.sleep(0.01)
+    assert conn_manager.connection.closed
+    assert breaker.state == CLOSED and breaker.allow_request()
+
+
+def test_dropped_idle_connection_is_replaced(monkeypatch):
+    url = "ldap://dropped"
+
+    def fake_search_for(connection, search_base, search_filter, **kwargs):
+        if connection.dropped:
+            raise LDAPSocketReceiveError("connection reset by peer")
+        return True
+
+    monkeypatch.setattr(pool_module, "search_for", fake_search_for)
+    pool = ServerPool(url, max_idle=1)
+    pool.idle = IdleConnections()
+    pool.open_connection = FakeConnectionManager
+    dropped = FakeConnectionManager(url)
+    dropped.connection.dropped = True
+    pool.idle.checkin(pool.idle_key(url), dropped, 1)
+
+    conn_manager = pool.reader()
+    assert conn_manager is dropped
+    conn_manager, success = pool.search(conn_manager, "dc=example", "(uid=alice)")
+    assert success and conn_manager is not dropped
+    assert dropped.connection.closed
+    assert pool.managers[url] is conn_manager and url not in pool.reused
@@ -0,0 +1,64 @@
+import logging
+from ldap_hooks import LDAP, SPAWNER_SUBMIT_DATA
+from ldap_hooks.reconcile import (
+    ExpectedUser,
+    drifted_attributes,
+    entry_keys,
+    expected_users,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def new_instance(**settings):
+    return LDAP(
+        base_dn="dc=example,dc=org",
+        submit_spawner_attribute="user.data",
+        submit_spawner_attribute_keys=("PersonDN",),
+        replace_object_with={"/": "+"},
+        **settings
+    )
+
+
+def test_join_by_unique_attributes():
+    instance = new_instance(unique_object_attributes=["CN"])
+    users = expected_users(
+        instance,
+        [
+            {"name": "alice", "data": {"PersonDN": "/sn=Surname/CN=Alice"}},
+            {"name": "nodata"},
+        ],
+        logger,
+    )
+    assert list(users) == [(("cn", "alice"),)]
+    keys = entry_keys(instance, "cn=alice,dc=example,dc=org", {"CN": ["alice"]})
+    assert keys == [(("cn", "alice"),)]
+    assert entry_keys(instance, "cn=x,dc=example,dc=org", {"sn": ["x"]}) == []
+
+
+def test_join_by_dn():
+    instance = new_instance()
+    users = expected_users(
+        instance,
+        [{"name": "alice", "data": {"PersonDN": "/sn=Surname/CN=alice"}}],
+        logger,
+    )
+    dn = "sn=Surname+CN=alice,dc=example,dc=org"
+    assert list(users) == entry_keys(instance, dn, {})
+
+
+def test_drifted_attributes():
+    instance = new_instance(
+        dynamic_attributes={"CN": SPAWNER_SUBMIT_DATA},
+        object_attributes={"homeDirectory": "/home/{CN}", "gecos": "{missing}"},
+    )
+    user = ExpectedUser(
+        {"name": "alice"}, "CN=alice", {"CN": "alice"}, "CN=alice,dc=org", None
+    )
+    assert (
+        drifted_attributes(instance, logger, user, {"homeDirectory": "/home/alice"})
+        == {}
+    )
+    assert drifted_attributes(instance, logger, user, {"homeDirectory": "/tmp"}) == {
+        "homeDirectory": {"expected": "/home/alice", "actual": "/tmp"}
+    }
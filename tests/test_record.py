@@ -0,0 +1,157 @@
+import asyncio
+import io
+import json
+import logging
+import threading
+from types import SimpleNamespace
+from ldap_hooks import LDAP, SPAWNER_ATTRIBUTE, SPAWNER_USER_ATTRIBUTE
+from ldap_hooks.deadline import Deadline
+from ldap_hooks.hooks import get_interpolated_dynamic_attributes
+from ldap_hooks.record import (
+    CREATED,
+    EXISTING,
+    note_branch,
+    note_deadline,
+    record_hook,
+    sanitize,
+)
+from ldap_hooks.replay import read_recording, replay, summarize
+
+logger = logging.getLogger(__name__)
+
+
+def settings(path):
+    return SimpleNamespace(
+        record_path=str(path),
+        record_key="secret",
+        submit_spawner_attribute="user.data",
+        dynamic_attributes={},
+    )
+
+
+def new_spawner(name):
+    user = SimpleNamespace(name=name, data={"PersonDN": "/O=NA/CN=" + name})
+    return SimpleNamespace(user=user, log=logger)
+
+
+def test_sanitize_keeps_structure():
+    sanitized = sanitize(b"key", {"PersonDN": "/O=NA/CN=User Name", "Ids": [1, "a"]})
+    assert sanitized["PersonDN"].startswith("/O=")
+    assert "/CN=" in sanitized["PersonDN"]
+    assert "User Name" not in sanitized["PersonDN"]
+    assert sanitized["Ids"][0] == 1 and sanitized["Ids"][1] != "a"
+    assert sanitize(b"key", "/CN=a") == sanitize(b"key", "/CN=a")
+    assert sanitize(b"key", "/CN=a") != sanitize(b"other", "/CN=a")
+
+
+def test_record_and_replay(tmp_path, monkeypatch):
+    monkeypatch.setattr(LDAP, "submit_spawner_attribute", "user.data")
+    monkeypatch.setattr(LDAP, "record_path", None)
+    path = tmp_path / "hook.jsonl"
+
+    async def provision(spawner, instance):
+        deadline = Deadline(None)
+        note_deadline(deadline)
+        deadline.step("existing entry search")
+        if spawner.user.name in created:
+            note_branch(EXISTING)
+        else:
+            note_branch(CREATED)
+            deadline.step("add entry")
+            created.add(spawner.user.name)
+        return True
+
+    async def record_all():
+        for name in ("alice", "bob", "alice"):
+            spawner = new_spawner(name)
+            assert await record_hook(spawner, settings(path), provision)
+
+    created = set()
+    asyncio.run(record_all())
+    records = list(read_recording(io.StringIO(path.read_text() + "not json\n")))
+    assert [record["branch"] for record in records] == [CREATED, CREATED, EXISTING]
+    assert records[0]["name"] == records[2]["name"] != "alice"
+    assert "alice" not in json.dumps(records)
+    assert [name for name, _ in records[0]["steps"]] == [
+        "existing entry search",
+        "add entry",
+    ]
+
+    # Replay a recorded day of 100 seconds in about 0.1 seconds
+    for offset, record in enumerate(records):
+        record["time"] = offset * 50.0
+    created = set()
+    replayed = asyncio.run(replay(reversed(records), provision=provision, speed=1000))
+    assert [call.record for call in replayed] == records
+    summary = summarize(replayed)
+    assert summary["calls"] == 3 and summary["changed_branches"] == 0
+    assert summary["replayed"]["branches"] == {CREATED: 2, EXISTING: 1}
+    assert summary["replayed"]["provisioned"] == 3
+    assert summary["replayed"]["lag"]["max"] < 1
+
+
+def test_replayed_calls_overlap(monkeypatch):
+    monkeypatch.setattr(LDAP, "submit_spawner_attribute", "user.data")
+    monkeypatch.setattr(LDAP, "record_path", None)
+    # The calls block their thread, they only meet if they run concurrently
+    barrier = threading.Barrier(3, timeout=5)
+
+    async def provision(spawner, instance):
+        note_branch(EXISTING)
+        barrier.wait()
+        return True
+
+    records = [{"name": name, "time": 0} for name in ("a", "b", "c")]
+    replayed = asyncio.run(replay(records, provision=provision, speed=0, workers=3))
+    assert [call.recording.provisioned for call in replayed] == [True, True, True]
+    assert [call.recording.branch for call in replayed] == [EXISTING] * 3
+
+
+def test_record_and_replay_spawner_attributes(tmp_path, monkeypatch):
+    dynamic_attributes = {
+        "email": SPAWNER_USER_ATTRIBUTE,
+        "uid_number": SPAWNER_USER_ATTRIBUTE,
+        "server_name": SPAWNER_ATTRIBUTE,
+    }
+    monkeypatch.setattr(LDAP, "submit_spawner_attribute", "user.data")
+    monkeypatch.setattr(LDAP, "dynamic_attributes", dynamic_attributes)
+    monkeypatch.setattr(LDAP, "record_path", None)
+    path = tmp_path / "hook.jsonl"
+    rendered = []
+
+    async def provision(spawner, instance):
+        sources = {
+            SPAWNER_ATTRIBUTE: spawner,
+            SPAWNER_USER_ATTRIBUTE: spawner.user,
+        }
+        rendered.append(
+            get_interpolated_dynamic_attributes(
+                logger, sources, instance.dynamic_attributes
+            )
+        )
+        note_branch(CREATED)
+        return True
+
+    spawner = new_spawner("alice")
+    spawner.server_name = "gpu"
+    spawner.user.email = "alice@example.org"
+    spawner.user.uid_number = 2001
+    hook_settings = settings(path)
+    hook_settings.dynamic_attributes = dynamic_attributes
+    assert asyncio.run(record_hook(spawner, hook_settings, provision))
+    [record] = list(read_recording(io.StringIO(path.read_text())))
+    assert "alice@example.org" not in json.dumps(record)
+    assert "gpu" not in json.dumps(record)
+    assert record["user"]["uid_number"] == 2001
+    assert set(record["user"]) == {"email", "uid_number"}
+    assert set(record["spawner"]) == {"server_name"}
+
+    # The replay renders the dynamic attributes from the recorded values
+    [replayed] = asyncio.run(replay([record], provision=provision, speed=0))
+    assert replayed.recording.provisioned
+    assert rendered[1] == {
+        "email": record["user"]["email"],
+        "uid_number": 2001,
+        "server_name": record["spawner"]["server_name"],
+    }
+    assert replayed.recording.record()["user"] == record["user"]
@@ -0,0 +1,92 @@
+import logging
+from ldap3 import MOCK_SYNC, OFFLINE_SLAPD_2_4, Connection, Server
+from ldap_hooks.hooks import paged_search_attribute_query
+from ldap_hooks.reducers import parse_reducers, reduce_entries
+
+
+def test_reduce_entries():
+    entries = [
+        ("cn=a,ou=groups", {"cn": ["a"], "gidNumber": 7, "memberUid": ["x", "y"]}),
+        ("cn=b,ou=groups", {"cn": ["b"], "gidNumber": 3, "memberUid": ["y", "z"]}),
+        ("cn=c,ou=groups", {"cn": ["c"]}),
+    ]
+    reducers = parse_reducers(
+        {
+            "gidNumber": "max",
+            "lowest": {"reducer": "min", "attribute": "gidNumber"},
+            "groups": {"reducer": "count", "attribute": "dn"},
+            "numbered": {"reducer": "count", "attribute": "gidNumber"},
+            "members": {"reducer": "collect", "attribute": "memberUid"},
+            "cn": "first",
+            "missing": "max",
+        }
+    )
+    assert reduce_entries(iter(entries), reducers) == {
+        "gidNumber": 7,
+        "lowest": 3,
+        "groups": 3,
+        "numbered": 2,
+        "members": ["x", "y", "z"],
+        "cn": "a",
+    }
+
+
+class FakeConnManager:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def get_connection(self):
+        return self.connection
+
+    def get_result(self):
+        return self.connection.result
+
+
+def test_paged_search_attribute_query():
+    server = Server("paged", get_info=OFFLINE_SLAPD_2_4)
+    connection = Connection(server, client_strategy=MOCK_SYNC)
+    for uid_number in range(1000, 1025):
+        connection.strategy.add_entry(
+            "cn=u{},ou=people,dc=example,dc=org".format(uid_number),
+            {"objectClass": ["person"], "sn": "u", "uidNumber": uid_number},
+        )
+    connection.bind()
+    logger = logging.getLogger(__name__)
+
+    def query(**extra):
+        query = {
+            "search_base": "ou=people,dc=example,dc=org",
+            "search_filter": "(objectClass=person)",
+            "attributes": ["uidNumber"],
+        }
+        query.update(extra)
+        return query
+
+    attributes = paged_search_attribute_query(
+        logger,
+        FakeConnManager(connection),
+        query(),
+        10,
+        {"uidNumber": "max", "people": {"reducer": "count", "attribute": "dn"}},
+    )
+    assert attributes == {"uidNumber": 1024, "people": 25}
+    # Without reducers a query must find a single entry
+    assert (
+        paged_search_attribute_query(
+            logger, FakeConnManager(connection), query(), 10, None
+        )
+        is None
+    )
+    assert paged_search_attribute_query(
+        logger,
+        FakeConnManager(connection),
+        query(search_filter="(uidNumber=1003)"),
+        10,
+        None,
+    ) == {"uidNumber": 1003}
+    assert (
+        paged_search_attribute_query(
+            logger, FakeConnManager(connection), query(), 10, {"uidNumber": "median"}
+        )
+        is None
+    )
@@ -0,0 +1,90 @@
+import json
+import logging
+import pytest
+from ldap_hooks import LDAP
+from ldap_hooks.cache import get_entry_cache, get_schema_cache
+from ldap_hooks.memo import get_result_memo
+from ldap_hooks.pool import get_idle_connections
+from ldap_hooks.reload import (
+    CONNECTIONS,
+    ENTRIES,
+    RESULTS,
+    SCHEMA,
+    ConfigWatcher,
+    config_reload_status,
+    reload_settings,
+)
+
+
+class FakeConnectionManager:
+    disconnected = False
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    # Restore the settings that the tests reload
+    for name in ("url", "base_dn", "hook_timeout", "submit_spawner_attribute_keys"):
+        monkeypatch.setattr(LDAP, name, getattr(LDAP(), name))
+
+
+def fill_caches():
+    conn_manager = FakeConnectionManager()
+    get_idle_connections().checkin(("ldap://a", None), conn_manager, 1)
+    get_schema_cache().set("ldap://a", ["person"])
+    get_entry_cache().set("cn=alice", {"cn": ["alice"]})
+    get_result_memo().set("alice", "result")
+    return conn_manager
+
+
+def test_reload_invalidates_changed_inputs(settings):
+    reload_settings({"url": "ldap://a", "base_dn": "dc=a"})
+    running = LDAP()
+    conn_manager = fill_caches()
+
+    result = reload_settings({"hook_timeout": 5.0, "base_dn": "dc=a"})
+    assert result == {"changed": ["hook_timeout"], "invalidated": []}
+    assert LDAP().hook_timeout == 5.0
+    assert get_entry_cache().get("cn=alice") is not None
+    assert get_result_memo().get("alice") == "result"
+
+    result = reload_settings({"base_dn": "dc=b", "submit_spawner_attribute_keys": []})
+    assert result["invalidated"] == [ENTRIES, RESULTS]
+    assert get_entry_cache().get("cn=alice") is None
+    assert get_result_memo().get("alice") is None
+    assert get_schema_cache().get("ldap://a") == ["person"]
+    assert not conn_manager.disconnected
+
+    result = reload_settings({"url": "ldap://b"})
+    assert result["invalidated"] == [CONNECTIONS, SCHEMA, ENTRIES, RESULTS]
+    assert conn_manager.disconnected
+    assert get_schema_cache().get("ldap://a") is None
+    # A hook that was running keeps the settings that it started with
+    assert (running.url, running.base_dn) == ("ldap://a", "dc=a")
+    assert config_reload_status()["changed"] == ["url"]
+
+    with pytest.raises(ValueError):
+        reload_settings({"hook_timeout": "soon"})
+    with pytest.raises(ValueError):
+        reload_settings({"no_such_setting": 1})
+    assert LDAP().hook_timeout == 5.0
+
+
+def test_config_watcher(settings, tmp_path):
+    path = tmp_path / "ldap_config.json"
+    path.write_text(json.dumps({"LDAP": {"url": "ldap://a", "base_dn": "dc=a"}}))
+    watcher = ConfigWatcher(str(path), logger=logging.getLogger(__name__))
+    assert watcher.check()["changed"] == ["base_dn", "url"]
+    assert watcher.check() is None
+
+    path.write_text(json.dumps({"LDAP": {"base_dn": ["not", "a", "string"]}}))
+    assert watcher.check() is None
+    assert LDAP().base_dn == "dc=a"
+    assert config_reload_status()["error"]
+
+    py_path = tmp_path / "ldap_config.py"
+    py_path.write_text("c.LDAP.base_dn = 'dc=b'\n")
+    assert ConfigWatcher(str(py_path)).check()["changed"] == ["base_dn"]
+    assert LDAP().base_dn == "dc=b"
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import threading
+from types import SimpleNamespace
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from ldap_hooks import SPAWNER_USER_ATTRIBUTE
+from ldap_hooks.service import ProvisionBatcher, make_app, provision_through_service
+
+logger = logging.getLogger(__name__)
+
+
+def settings(**extra):
+    return SimpleNamespace(
+        submit_spawner_attribute="user.data",
+        dynamic_attributes={"uid": SPAWNER_USER_ATTRIBUTE},
+        hook_timeout=None,
+        **extra
+    )
+
+
+def new_spawner(name):
+    user = SimpleNamespace(name=name, uid=1000, data={"PersonDN": "/CN=" + name})
+    return SimpleNamespace(user=user, log=logger, environment={"A": "1"})
+
+
+def test_batcher_coalesces_identical_inputs():
+    calls = []
+    release = threading.Event()
+
+    def provision(inputs):
+        calls.append(inputs["name"])
+        release.wait(5)
+        return True, {"environment": {"USER": inputs["name"]}}
+
+    async def submit_all():
+        batcher = ProvisionBatcher(provision, batch_size=2, batch_window=0.01)
+        first = [batcher.submit({"name": name}) for name in ("a", "a", "b")]
+        # A request for inputs that are already running joins them
+        await asyncio.sleep(0.05)
+        first.append(batcher.submit({"name": "b"}))
+        release.set()
+        results = await asyncio.gather(*first)
+        batcher.close()
+        return results, batcher.status()
+
+    results, status = asyncio.run(submit_all())
+    assert sorted(calls) == ["a", "b"]
+    assert [attributes["environment"]["USER"] for _, attributes in results] == [
+        "a",
+        "a",
+        "b",
+        "b",
+    ]
+    assert (status["requests"], status["coalesced"]) == (4, 2)
+    assert (status["batches"], status["provisioned"], status["running"]) == (1, 2, 0)
+
+
+def test_service_provisions_for_hook():
+    def provision(inputs):
+        if inputs["name"] == "mallory":
+            return False, {}
+        return True, {"environment": {"NB_UID": str(inputs["user"]["uid"])}}
+
+    async def spawn_all():
+        batcher = ProvisionBatcher(provision)
+        sockets = bind_sockets(0, "127.0.0.1")
+        server = HTTPServer(make_app(batcher, "secret", "/services/ldap/"))
+        server.add_sockets(sockets)
+        url = "http://127.0.0.1:{}/services/ldap".format(sockets[0].getsockname()[1])
+        spawners = [new_spawner("alice"), new_spawner("mallory"), new_spawner("eve")]
+        tokens = ["secret", "secret", "wrong"]
+        try:
+            return spawners, await asyncio.gather(
+                *[
+                    provision_through_service(
+                        spawner, settings(service_url=url, service_token=token)
+                    )
+                    for spawner, token in zip(spawners, tokens)
+                ]
+            )
+        finally:
+            server.stop()
+            batcher.close()
+
+    spawners, results = asyncio.run(spawn_all())
+    assert results == [True, False, False]
+    assert spawners[0].environment == {"A": "1", "NB_UID": "1000"}
+    assert spawners[1].environment == {"A": "1"}
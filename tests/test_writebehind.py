@@ -0,0 +1,149 @@
+import asyncio
+import time
+from ldap3 import MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
+from ldap_hooks.pool import ServerUnavailable
+from ldap_hooks.writebehind import (
+    BLOCK,
+    DROP_OLDEST,
+    WriteBehindQueue,
+    merge_changes,
+    normalize_changes,
+)
+from .util import FakeClock
+
+
+class FakeConnection:
+    def __init__(self, results):
+        self.results = results
+        self.modified = []
+        self.result = {}
+
+    def modify(self, dn, changes, controls=None):
+        success, description = self.results.pop(0) if self.results else (True, "")
+        self.result = {"description": description}
+        if success:
+            self.modified.append((dn, changes))
+        return success
+
+
+class FakePool:
+    current = None
+
+    def __init__(self, connection, available=True):
+        self.connection = connection
+        self.available = available
+
+    def writer(self):
+        if not self.available:
+            raise ServerUnavailable("provider", ["ldap://provider"])
+        return self
+
+    def get_connection(self):
+        return self.connection
+
+    def record_success(self):
+        pass
+
+    def record_failure(self, conn_manager):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+def test_merge_changes():
+    changes = normalize_changes({"memberUid": (MODIFY_ADD, "alice")})
+    changes = merge_changes(
+        changes,
+        normalize_changes(
+            {
+                "memberuid": [(MODIFY_ADD, ["bob", "alice"])],
+                "description": [(MODIFY_REPLACE, ["first"])],
+            }
+        ),
+    )
+    assert changes == {
+        "memberUid": [(MODIFY_ADD, ["alice", "bob"])],
+        "description": [(MODIFY_REPLACE, ["first"])],
+    }
+    changes = merge_changes(
+        changes,
+        {
+            "description": [(MODIFY_REPLACE, ["second"])],
+            "memberUid": [(MODIFY_DELETE, ["bob"])],
+        },
+    )
+    # The last replace wins, and the add and delete are kept in order
+    assert changes == {
+        "memberUid": [(MODIFY_ADD, ["alice", "bob"]), (MODIFY_DELETE, ["bob"])],
+        "description": [(MODIFY_REPLACE, ["second"])],
+    }
+
+
+def test_overflow_policies():
+    connection = FakeConnection([])
+    queue = WriteBehindQueue(lambda: FakePool(connection), max_size=2)
+    assert queue.put("uid=a", {"sn": (MODIFY_REPLACE, "a")})
+    assert queue.put("uid=b", {"sn": (MODIFY_REPLACE, "b")})
+    # Merged into a queued DN while the queue is full
+    assert queue.put("uid=a", {"sn": (MODIFY_REPLACE, "c")})
+    assert not queue.put("uid=c", {"sn": (MODIFY_REPLACE, "c")})
+    assert queue.status()["dropped"] == 1
+
+    queue = WriteBehindQueue(
+        lambda: FakePool(connection), max_size=2, overflow_policy=DROP_OLDEST
+    )
+    for dn in ("uid=a", "uid=b", "uid=c"):
+        assert queue.put(dn, {"sn": (MODIFY_REPLACE, dn)})
+    assert [write.dn for write in queue._pending.values()] == ["uid=b", "uid=c"]
+
+    queue = WriteBehindQueue(
+        lambda: FakePool(connection),
+        max_size=1,
+        overflow_policy=BLOCK,
+        block_timeout=0.01,
+    )
+    assert queue.put("uid=a", {"sn": (MODIFY_REPLACE, "a")})
+    assert not queue.put("uid=b", {"sn": (MODIFY_REPLACE, "b")})
+
+    # The hook on an event loop is never blocked for room
+    queue.block_timeout = 60.0
+    started = time.monotonic()
+
+    async def put_from_hook():
+        return queue.put("uid=c", {"sn": (MODIFY_REPLACE, "c")})
+
+    assert not asyncio.run(put_from_hook())
+    assert time.monotonic() - started < 5
+
+
+def test_retry_with_backoff_and_drain():
+    clock = FakeClock(1000.0)
+    connection = FakeConnection([(False, "busy"), (True, "")])
+    pool = FakePool(connection, available=False)
+    queue = WriteBehindQueue(
+        lambda: pool, retry_backoff=2.0, max_retries=3, clock=clock
+    )
+    queue.put("uid=alice", {"sn": (MODIFY_REPLACE, "first")})
+
+    # The provider is unavailable
+    queue.write_batch(queue._take())
+    assert queue._pending["uid=alice"].not_before == clock.now + 2.0
+    assert queue._take() == []
+
+    # A busy result is retried with a doubled backoff
+    pool.available = True
+    clock.now += 2.0
+    queue.write_batch(queue._take())
+    assert queue._pending["uid=alice"].not_before == clock.now + 4.0
+
+    # Modifications queued meanwhile are merged after the failed ones
+    queue.put("uid=alice", {"sn": (MODIFY_REPLACE, "second")})
+    queue.start()
+    assert queue.drain(timeout=5.0) == 0
+    assert connection.modified == [
+        ("uid=alice", {"sn": [(MODIFY_REPLACE, ["second"])]})
+    ]
+    assert queue.status()["written"] == 1
+    assert queue.status()["retried"] == 2
+    assert not queue.put("uid=bob", {"sn": (MODIFY_REPLACE, "late")})
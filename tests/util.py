@@ -114,3 +114,13 @@ def get_container_env(container, env_key=None):
 
 def get_container_user(container):
     return get_container_env(container, env_key="JUPYTERHUB_USER")
+
+
+class FakeClock:
+    """A clock that only advances when `now` is set, E.g. by a test."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now